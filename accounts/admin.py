@@ -1,9 +1,11 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
 from django.utils import timezone
 from .models import UserProfile, BankAccount, AccountBeneficiary, SecurityQuestion, LoginHistory, KYCDocument, EmailVerification
+from .dashboard_cache import invalidate_dashboards
 
 
 class KYCDocumentInline(admin.TabularInline):
@@ -183,45 +185,60 @@ class UserProfileAdmin(admin.ModelAdmin):
     actions = ['approve_kyc', 'reject_kyc', 'mark_under_review', 'upgrade_to_premium', 'downgrade_to_basic', 'mark_verified', 'mark_unverified']
 
     def approve_kyc(self, request, queryset):
+        # Read the owners first: under a filter on the changed field the queryset is empty after the update
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(
             kyc_status='approved',
             is_verified=True,
             kyc_reviewed_at=timezone.now()
         )
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles approved.')
     approve_kyc.short_description = 'Approve KYC for selected profiles'
 
     def reject_kyc(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(
             kyc_status='rejected',
             is_verified=False,
             kyc_reviewed_at=timezone.now()
         )
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles rejected.')
     reject_kyc.short_description = 'Reject KYC for selected profiles'
 
     def mark_under_review(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(kyc_status='under_review')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles marked under review.')
     mark_under_review.short_description = 'Mark as under review'
     
     def upgrade_to_premium(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(customer_tier='premium')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles upgraded to premium.')
     upgrade_to_premium.short_description = 'Upgrade to Premium tier'
     
     def downgrade_to_basic(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(customer_tier='basic')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles downgraded to basic.')
     downgrade_to_basic.short_description = 'Downgrade to Basic tier'
     
     def mark_verified(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(is_verified=True)
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles marked as verified.')
     mark_verified.short_description = 'Mark as verified'
     
     def mark_unverified(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(is_verified=False)
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} profiles marked as unverified.')
     mark_unverified.short_description = 'Mark as unverified'
 
@@ -279,32 +296,38 @@ class KYCDocumentAdmin(admin.ModelAdmin):
     actions = ['approve_documents', 'reject_documents', 'require_resubmission', 'auto_approve_test_documents']
 
     def approve_documents(self, request, queryset):
+        user_ids = list(queryset.values_list('user_profile__user_id', flat=True))
         updated = queryset.update(
             verification_status='approved',
             is_approved=True,
             reviewed_at=timezone.now(),
             reviewed_by=request.user
         )
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} documents approved.')
     approve_documents.short_description = 'Approve selected documents'
 
     def reject_documents(self, request, queryset):
+        user_ids = list(queryset.values_list('user_profile__user_id', flat=True))
         updated = queryset.update(
             verification_status='rejected',
             is_approved=False,
             reviewed_at=timezone.now(),
             reviewed_by=request.user
         )
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} documents rejected.')
     reject_documents.short_description = 'Reject selected documents'
 
     def require_resubmission(self, request, queryset):
+        user_ids = list(queryset.values_list('user_profile__user_id', flat=True))
         updated = queryset.update(
             verification_status='requires_resubmission',
             is_approved=False,
             reviewed_at=timezone.now(),
             reviewed_by=request.user
         )
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} documents marked for resubmission.')
     require_resubmission.short_description = 'Require resubmission'
 
@@ -338,8 +361,21 @@ class AccountBeneficiaryInline(admin.TabularInline):
     fields = ('full_name', 'relationship', 'percentage_share', 'is_primary', 'phone_number')
 
 
+class BankAccountAdminForm(forms.ModelForm):
+    """BankAccount form whose balance changes are entered as an explicit adjustment"""
+    balance_adjustment = forms.DecimalField(
+        max_digits=15, decimal_places=2, required=False,
+        help_text='Amount to post to the balance through the ledger; negative to debit'
+    )
+
+    class Meta:
+        model = BankAccount
+        fields = '__all__'
+
+
 @admin.register(BankAccount)
 class BankAccountAdmin(admin.ModelAdmin):
+    form = BankAccountAdminForm
     list_display = (
         'account_number', 'account_name', 'user', 'account_type', 'currency',
         'get_formatted_balance', 'status', 'kyc_status_display', 'created_at', 'last_transaction_date'
@@ -349,7 +385,10 @@ class BankAccountAdmin(admin.ModelAdmin):
         'allow_online_transactions', 'allow_international_transactions', 'created_at'
     )
     search_fields = ('account_number', 'account_name', 'user__username', 'user__email', 'user__first_name', 'user__last_name')
-    readonly_fields = ('account_number', 'available_balance', 'created_at', 'updated_at', 'last_transaction_date')
+    readonly_fields = (
+        'account_number', 'balance', 'available_balance', 'hold_balance',
+        'created_at', 'updated_at', 'last_transaction_date'
+    )
     inlines = [AccountBeneficiaryInline]
     list_per_page = 25
     date_hierarchy = 'created_at'
@@ -359,7 +398,7 @@ class BankAccountAdmin(admin.ModelAdmin):
             'fields': ('user', 'account_number', 'account_name', 'account_type', 'currency')
         }),
         ('Balances', {
-            'fields': ('balance', 'available_balance', 'hold_balance')
+            'fields': ('balance', 'available_balance', 'hold_balance', 'balance_adjustment')
         }),
         ('Account Configuration', {
             'fields': ('minimum_balance', 'daily_transaction_limit', 'monthly_transaction_limit')
@@ -385,6 +424,24 @@ class BankAccountAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'user__userprofile')
     
+    def save_model(self, request, obj, form, change):
+        """
+        Save the account and post any balance adjustment through the ledger.
+
+        The adjustment is the amount typed in, not the difference from the
+        balance the form was rendered with, so postings made while the form
+        was open are kept.
+        """
+        from django.db import transaction
+        from banking.posting import adjust_balance
+        
+        delta = form.cleaned_data.get('balance_adjustment')
+        with transaction.atomic():
+            # BankAccount.save() leaves the posting engine's columns alone on existing rows
+            obj.save()
+            if delta:
+                adjust_balance(obj, delta, description=f"Manual balance adjustment by {request.user.username}")
+    
     def get_formatted_balance(self, obj):
         color = 'green' if obj.balance >= 0 else 'red'
         return format_html(
@@ -409,17 +466,23 @@ class BankAccountAdmin(admin.ModelAdmin):
     actions = ['activate_accounts', 'suspend_accounts', 'freeze_accounts']
     
     def activate_accounts(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(status='active')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} accounts activated.')
     activate_accounts.short_description = 'Activate selected accounts'
     
     def suspend_accounts(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(status='suspended')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} accounts suspended.')
     suspend_accounts.short_description = 'Suspend selected accounts'
     
     def freeze_accounts(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(status='frozen')
+        invalidate_dashboards(user_ids)
         self.message_user(request, f'{updated} accounts frozen.')
     freeze_accounts.short_description = 'Freeze selected accounts'
 
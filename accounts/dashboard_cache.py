@@ -0,0 +1,93 @@
+"""
+Per-user dashboard cache
+
+user_dashboard and account_summary responses are cached under a key that
+embeds a per-user version number kept in the default cache. Anything that
+changes what those responses show (balances, transactions, cards, login
+history, profile or KYC documents) calls invalidate_dashboards() for the
+owning users. The version is bumped once the change commits. Old payloads are
+never deleted; nothing reads their keys any more and they expire.
+
+A request reads the version before it reads the database, so a payload built
+while a posting commits is stored under the version that posting retires.
+When a version has been evicted a new one is started from the clock rather
+than from zero, so it cannot collide with a version whose payloads may still
+be cached.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'dashboard:version:{user_id}'
+PAYLOAD_KEY = 'dashboard:{user_id}:{version}:{view}:{variant}'
+
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+
+def get_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(user_ids):
+    for user_id in set(user_ids):
+        try:
+            cache.incr(VERSION_KEY.format(user_id=user_id))
+        except ValueError:
+            # No version yet: the next read starts a fresh one
+            pass
+
+
+def invalidate_dashboards(user_ids):
+    """Retire the cached dashboards of these users once the current transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if user_ids:
+        transaction.on_commit(lambda: bump_versions(user_ids))
+
+
+def invalidate_account_owners(accounts):
+    """invalidate_dashboards() for the owners of BankAccount instances or ids"""
+    from .models import BankAccount
+    user_ids, account_ids = set(), []
+    for account in accounts:
+        if isinstance(account, BankAccount):
+            user_ids.add(account.user_id)
+        elif account is not None:
+            account_ids.append(account)
+    if account_ids:
+        user_ids.update(BankAccount.objects.filter(pk__in=account_ids).values_list('user_id', flat=True))
+    invalidate_dashboards(user_ids)
+
+
+def request_variant(request, *parts):
+    """Distinguish cached payloads by host and query string, which shape the response"""
+    query = sorted(request.query_params.lists())
+    raw = repr((request.get_host(), query, parts)).encode()
+    return hashlib.md5(raw).hexdigest()
+
+
+def cached_payload(user_id, view, variant, build):
+    """
+    Return (payload, status) from the cache, or from build() if missing.
+
+    Only 200 responses are stored.
+    """
+    version = get_version(user_id)
+    key = PAYLOAD_KEY.format(user_id=user_id, version=version, view=view, variant=variant)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, 200
+
+    payload, status = build()
+    if status == 200:
+        cache.set(key, payload, _timeout())
+    return payload, status
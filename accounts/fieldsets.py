@@ -0,0 +1,142 @@
+"""
+Sparse fieldsets
+
+List endpoints accept comma-separated ?fields= and ?exclude= parameters.
+SparseFieldsetMixin trims a serializer to those fields. SparseFieldsetViewMixin
+passes the parameters from the request and narrows the queryset with only()
+and select_related() to the columns the remaining fields read. Method fields
+name their columns in Meta.field_dependencies. When a kept field cannot be
+mapped to columns, the full row is selected as before.
+"""
+import re
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+DISPLAY_METHOD = re.compile(r'get_(\w+)_display')
+
+
+def parse_field_list(value):
+    """'a, b,,c' -> ['a', 'b', 'c']; None or blank -> None"""
+    if not value:
+        return None
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    return names or None
+
+
+def split_fieldset(names):
+    """
+    Split dotted names by section: ['accounts.balance', 'user'] ->
+    {'accounts': ['balance'], 'user': None}, where None keeps the whole section
+    """
+    if names is None:
+        return None
+    sections = {}
+    for name in names:
+        section, _, field = name.partition('.')
+        if not field:
+            sections[section] = None
+        elif sections.get(section, []) is not None:
+            sections.setdefault(section, []).append(field)
+    return sections
+
+
+class SparseFieldsetMixin:
+    """Serializer mixin taking fields= and exclude= lists of field names to keep or drop"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        exclude = kwargs.pop('exclude', None)
+        super().__init__(*args, **kwargs)
+        self.sparse = fields is not None or bool(exclude)
+
+        unknown = set(fields or []) | set(exclude or [])
+        unknown -= set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in exclude or []:
+            self.fields.pop(name, None)
+
+    def query_columns(self):
+        """
+        (only, select_related) paths the kept fields read, or None when a field
+        cannot be traced to model columns
+        """
+        opts = self.Meta.model._meta
+        dependencies = getattr(self.Meta, 'field_dependencies', {})
+        only, related = {opts.pk.name}, set()
+
+        for name, field in self.fields.items():
+            paths = dependencies.get(name)
+            if paths is None:
+                if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                    return None
+                paths = [field.source.replace('.', '__')]
+
+            for path in paths:
+                first, _, rest = path.partition('__')
+                display = DISPLAY_METHOD.fullmatch(first)
+                try:
+                    model_field = opts.get_field(display.group(1) if display and not rest else first)
+                except FieldDoesNotExist:
+                    return None
+                if model_field.many_to_many or model_field.one_to_many:
+                    return None
+                if rest or isinstance(field, serializers.BaseSerializer):
+                    # Nested serializers read the whole related row
+                    related.add(model_field.name)
+                    only.add(path if rest else model_field.name)
+                else:
+                    only.add(model_field.name)
+        return only, related
+
+
+def narrow_queryset(queryset, serializer):
+    """Select only what the serializer's remaining fields need"""
+    columns = serializer.query_columns() if hasattr(serializer, 'query_columns') else None
+    if columns is None:
+        return queryset
+    only, related = columns
+    queryset = queryset.select_related(None)
+    if related:
+        # select_related() with no arguments would follow every foreign key
+        queryset = queryset.select_related(*related)
+    return queryset.only(*only)
+
+
+def serialize_sparse(serializer_class, queryset, **fieldset):
+    """Serialize a queryset through serializer_class(many=True), reading only the kept fields' columns"""
+    serializer = serializer_class(many=True, **fieldset)
+    serializer.instance = narrow_queryset(queryset, serializer.child)
+    return serializer.data
+
+
+class SparseFieldsetViewMixin:
+    """View mixin applying ?fields= and ?exclude= to GET responses"""
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_fieldset(self):
+        if self.request.method != 'GET':
+            return {}
+        fieldset = {
+            'fields': parse_field_list(self.request.query_params.get(self.fields_query_param)),
+            'exclude': parse_field_list(self.request.query_params.get(self.exclude_query_param)),
+        }
+        return {key: value for key, value in fieldset.items() if value is not None}
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs = {**self.get_fieldset(), **kwargs}
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fieldset = self.get_fieldset()
+        if not fieldset:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context(), **fieldset)
+        return narrow_queryset(queryset, serializer)
@@ -0,0 +1,215 @@
+"""
+Block-allocated identifiers
+
+Account numbers, transaction references and card numbers used to be drawn at
+random and probed with an .exists() query until an unused one came up. Each
+series now has a row in IdentifierSequence. A process reserves a block of
+sequence values from that row with one locked update, then hands them out
+from memory. Each value is mapped through a fixed permutation of the
+identifier space, so identifiers stay unique without looking sequential.
+Card numbers also get an issuer prefix and a Luhn check digit.
+
+The database unique constraints stay in place. A reserved block is checked
+once against existing rows, which covers identifiers created before this
+scheme. A block reserved inside a transaction that later rolls back is
+dropped, because its range goes back to the series.
+"""
+import collections
+import os
+import string
+import threading
+import weakref
+from math import gcd
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import IdentifierSequence
+
+BASE36 = string.digits + string.ascii_uppercase
+
+# Values are checked against existing rows in chunks of this size
+LOOKUP_CHUNK_SIZE = 500
+
+DEFAULT_CARD_ISSUER_PREFIXES = {
+    'visa': '412345',
+    'mastercard': '512345',
+    'verve': '506099',
+}
+
+
+def reserve_block(name, size):
+    """Reserve size values of a series; returns the first one"""
+    with transaction.atomic():
+        sequence, _ = IdentifierSequence.objects.select_for_update().get_or_create(name=name)
+        start = sequence.next_value
+        IdentifierSequence.objects.filter(name=name).update(next_value=start + size)
+    return start
+
+
+def _multiplier(modulus):
+    """Golden-ratio multiplier coprime to modulus, so value -> value * m mod modulus is a bijection"""
+    multiplier = modulus * 618033988749894848 // 10 ** 18 or 1
+    while gcd(multiplier, modulus) != 1:
+        multiplier += 1
+    return multiplier
+
+
+_multipliers = {}
+
+
+def permute(value, modulus):
+    """Spread consecutive values across [0, modulus) without collisions"""
+    if modulus not in _multipliers:
+        _multipliers[modulus] = _multiplier(modulus)
+    # Offset by one so the first value of a series is not all zeros
+    return ((value + 1) * _multipliers[modulus]) % modulus
+
+
+def to_base36(value, length):
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(BASE36[remainder])
+    return ''.join(reversed(digits)).rjust(length, '0')
+
+
+def luhn_check_digit(digits):
+    """Check digit that makes digits + check digit pass the Luhn test"""
+    total = 0
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if index % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def is_luhn_valid(number):
+    return number[-1] == luhn_check_digit(number[:-1])
+
+
+class BlockAllocator:
+    """
+    Hands out identifiers of one series from blocks reserved per process and thread.
+
+    encode maps a sequence value to the identifier string. model and field
+    ('app_label.Model', 'field_name') name the column whose existing values
+    must be skipped.
+    """
+
+    def __init__(self, name, encode, model, field, block_size=None):
+        self.name = name
+        self.encode = encode
+        self.model = model
+        self.field = field
+        self.block_size = block_size
+        self._local = threading.local()
+
+    def _state(self):
+        state = self._local
+        # A forked child must not keep handing out its parent's block
+        if getattr(state, 'pid', None) != os.getpid():
+            state.pid = os.getpid()
+            state.free = collections.deque()
+            state.pending = None
+        return state
+
+    def _block_valid(self, state):
+        # pending weakly references the reserving transaction's on_commit hook.
+        # A rollback discards the hook, and with it the only strong reference.
+        if state.pending is None or state.pending() is not None:
+            return True
+        state.free.clear()
+        state.pending = None
+        return False
+
+    def _reserve(self, state, count):
+        size = max(count, self.block_size or getattr(settings, 'IDENTIFIER_BLOCK_SIZE', 100))
+        start = reserve_block(self.name, size)
+        values = [self.encode(value) for value in range(start, start + size)]
+        existing = self._existing(values)
+        state.free = collections.deque(value for value in values if value not in existing)
+        state.pending = None
+        if connection.in_atomic_block:
+            def confirm():
+                state.pending = None
+            state.pending = weakref.ref(confirm)
+            transaction.on_commit(confirm)
+
+    def _existing(self, values):
+        model = apps.get_model(self.model)
+        existing = set()
+        for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+            chunk = values[start:start + LOOKUP_CHUNK_SIZE]
+            existing.update(
+                model._default_manager.filter(**{f'{self.field}__in': chunk}).values_list(self.field, flat=True)
+            )
+        return existing
+
+    def allocate(self, count=1):
+        """Return count unused identifiers; a large count reserves one block of that size"""
+        state = self._state()
+        identifiers = []
+        while len(identifiers) < count:
+            if not self._block_valid(state) or not state.free:
+                self._reserve(state, count - len(identifiers))
+            while state.free and len(identifiers) < count:
+                identifiers.append(state.free.popleft())
+        return identifiers
+
+
+def _encode_account_number(value):
+    length = getattr(settings, 'ACCOUNT_NUMBER_LENGTH', 10)
+    return str(permute(value, 10 ** length)).zfill(length)
+
+
+def _encode_transaction_reference(value):
+    length = getattr(settings, 'TRANSACTION_REFERENCE_LENGTH', 12)
+    return 'TXN' + to_base36(permute(value, 36 ** length), length)
+
+
+def card_issuer_prefix(card_brand):
+    prefixes = getattr(settings, 'CARD_ISSUER_PREFIXES', DEFAULT_CARD_ISSUER_PREFIXES)
+    return prefixes.get(card_brand, DEFAULT_CARD_ISSUER_PREFIXES['verve'])
+
+
+def _card_number_encoder(prefix):
+    serial_length = 15 - len(prefix)
+
+    def encode(value):
+        digits = prefix + str(permute(value, 10 ** serial_length)).zfill(serial_length)
+        return digits + luhn_check_digit(digits)
+    return encode
+
+
+account_numbers = BlockAllocator('account_number', _encode_account_number, 'accounts.BankAccount', 'account_number')
+transaction_references = BlockAllocator(
+    'transaction_reference', _encode_transaction_reference, 'banking.Transaction', 'reference'
+)
+_card_numbers = {}
+
+
+def card_numbers(card_brand):
+    """Allocator for one issuer prefix; brands sharing a prefix share a series"""
+    prefix = card_issuer_prefix(card_brand)
+    if prefix not in _card_numbers:
+        _card_numbers[prefix] = BlockAllocator(
+            f'card_number:{prefix}', _card_number_encoder(prefix), 'banking.Card', 'card_number'
+        )
+    return _card_numbers[prefix]
+
+
+def allocate_account_numbers(count=1):
+    return account_numbers.allocate(count)
+
+
+def allocate_transaction_references(count=1):
+    return transaction_references.allocate(count)
+
+
+def allocate_card_numbers(count=1, card_brand='verve'):
+    return card_numbers(card_brand).allocate(count)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_userprofile_transfer_pin_hash_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bankaccount',
+            name='ledger_sequence',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Sequence number of the latest ledger entry'),
+        ),
+    ]
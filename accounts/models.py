@@ -169,70 +169,53 @@ class UserProfile(models.Model):
         names = [self.user.first_name, self.middle_name, self.user.last_name]
         return ' '.join(filter(None, names))
     
-    def get_kyc_completion_percentage(self):
-        """Calculate KYC completion percentage based on international requirements"""
+    def get_required_kyc_categories(self):
+        """Document type groups the customer needs one approved document from, based on residency"""
         # Determine if user is U.S.-based (simplified check based on country)
         is_us_client = self.country and self.country.upper() in ['US', 'USA', 'UNITED STATES']
         
         if is_us_client:
             # U.S. clients require: Government ID + Address Proof + SSN/ITIN + Selfie
-            required_categories = [
+            return [
                 ['government_id_us_drivers_license', 'government_id_us_state_id', 'government_id_us_passport'],
                 ['proof_address_utility_bill', 'proof_address_bank_statement', 'proof_address_lease_agreement', 'proof_address_mortgage_statement'],
                 ['us_ssn_card', 'us_itin_letter'],
                 ['selfie_with_id']
             ]
-        else:
-            # Non-U.S. clients require: Government ID + Address Proof + Selfie
-            required_categories = [
-                ['government_id_passport', 'government_id_national_id', 'government_id_drivers_license'],
-                ['proof_address_utility_bill', 'proof_address_bank_statement', 'proof_address_credit_card_statement', 'proof_address_lease_agreement'],
-                ['selfie_with_id']
-            ]
-        
-        uploaded_docs = self.kyc_documents.filter(
+        # Non-U.S. clients require: Government ID + Address Proof + Selfie
+        return [
+            ['government_id_passport', 'government_id_national_id', 'government_id_drivers_license'],
+            ['proof_address_utility_bill', 'proof_address_bank_statement', 'proof_address_credit_card_statement', 'proof_address_lease_agreement'],
+            ['selfie_with_id']
+        ]
+    
+    def get_approved_kyc_document_types(self):
+        """Approved document types, taken from prefetched kyc_documents when available"""
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('kyc_documents')
+        if prefetched is not None:
+            return {doc.document_type for doc in prefetched if doc.verification_status == 'approved'}
+        return set(self.kyc_documents.filter(
             verification_status='approved'
-        ).values_list('document_type', flat=True)
-        
-        completed_categories = 0
-        for category in required_categories:
-            if any(doc_type in uploaded_docs for doc_type in category):
-                completed_categories += 1
-        
-        completion = (completed_categories / len(required_categories)) * 100
+        ).values_list('document_type', flat=True))
+    
+    def get_completed_kyc_categories(self, approved_types=None):
+        """(completed, required) category counts"""
+        if approved_types is None:
+            approved_types = self.get_approved_kyc_document_types()
+        required_categories = self.get_required_kyc_categories()
+        completed = sum(1 for category in required_categories if approved_types.intersection(category))
+        return completed, len(required_categories)
+    
+    def get_kyc_completion_percentage(self, approved_types=None):
+        """Calculate KYC completion percentage based on international requirements"""
+        completed_categories, required = self.get_completed_kyc_categories(approved_types)
+        completion = (completed_categories / required) * 100
         return min(completion, 100)
     
-    def has_required_kyc_documents(self):
+    def has_required_kyc_documents(self, approved_types=None):
         """Check if user has uploaded all required KYC documents based on residency"""
-        # Determine if user is U.S.-based
-        is_us_client = self.country and self.country.upper() in ['US', 'USA', 'UNITED STATES']
-        
-        if is_us_client:
-            # U.S. clients require all 4 categories
-            required_categories = [
-                ['government_id_us_drivers_license', 'government_id_us_state_id', 'government_id_us_passport'],
-                ['proof_address_utility_bill', 'proof_address_bank_statement', 'proof_address_lease_agreement', 'proof_address_mortgage_statement'],
-                ['us_ssn_card', 'us_itin_letter'],
-                ['selfie_with_id']
-            ]
-        else:
-            # Non-U.S. clients require 3 categories
-            required_categories = [
-                ['government_id_passport', 'government_id_national_id', 'government_id_drivers_license'],
-                ['proof_address_utility_bill', 'proof_address_bank_statement', 'proof_address_credit_card_statement', 'proof_address_lease_agreement'],
-                ['selfie_with_id']
-            ]
-        
-        uploaded_docs = self.kyc_documents.filter(
-            verification_status='approved'
-        ).values_list('document_type', flat=True)
-        
-        # Check if each required category has at least one document
-        for category in required_categories:
-            if not any(doc_type in uploaded_docs for doc_type in category):
-                return False
-        
-        return True
+        completed_categories, required = self.get_completed_kyc_categories(approved_types)
+        return completed_categories == required
     
     def requires_profile_completion(self):
         """Check if user needs to complete additional profile information"""
@@ -397,6 +380,8 @@ class BankAccount(models.Model):
     balance = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     available_balance = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     hold_balance = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    ledger_sequence = models.PositiveBigIntegerField(default=0, editable=False,
+                                                     help_text="Sequence number of the latest ledger entry")
     
     # Account Configuration
     minimum_balance = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('1000.00'))
@@ -426,6 +411,9 @@ class BankAccount(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     last_transaction_date = models.DateTimeField(null=True, blank=True)
     
+    # Columns written only by the posting engine (banking.posting), never by save() of an existing row
+    POSTING_FIELDS = ('balance', 'available_balance', 'hold_balance', 'ledger_sequence', 'last_transaction_date')
+    
     def save(self, *args, **kwargs):
         if not self.account_number:
             self.account_number = self.generate_account_number()
@@ -437,14 +425,19 @@ class BankAccount(models.Model):
                 self.account_name = self.user.get_full_name()
         # Calculate available balance
         self.available_balance = self.balance - self.hold_balance
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # A copy loaded before a posting would write its stale balances back
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.POSTING_FIELDS and field.attname not in deferred
+            ]
         super().save(*args, **kwargs)
     
     def generate_account_number(self):
-        """Generate a unique 10-digit account number"""
-        while True:
-            account_number = ''.join(random.choices(string.digits, k=getattr(settings, 'ACCOUNT_NUMBER_LENGTH', 10)))
-            if not BankAccount.objects.filter(account_number=account_number).exists():
-                return account_number
+        """Allocate a unique 10-digit account number from this process's reserved block"""
+        from .identifiers import allocate_account_numbers
+        return allocate_account_numbers()[0]
     
     def can_debit(self, amount):
         """Check if account can be debited for the specified amount"""
@@ -538,3 +531,17 @@ class LoginHistory(models.Model):
         ordering = ['-login_time']
         verbose_name = "Login History"
         verbose_name_plural = "Login Histories"
+
+
+class IdentifierSequence(models.Model):
+    """High-water mark of an identifier series handed out in blocks (see accounts.identifiers)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} - {self.next_value}"
+    
+    class Meta:
+        verbose_name = "Identifier Sequence"
+        verbose_name_plural = "Identifier Sequences"
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
 from django.conf import settings
 from .models import UserProfile, BankAccount, AccountBeneficiary, SecurityQuestion, LoginHistory, KYCDocument
+from .fieldsets import SparseFieldsetMixin
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -143,7 +144,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return obj.has_required_kyc_documents()
 
 
-class BankAccountSerializer(serializers.ModelSerializer):
+class BankAccountSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     account_age_days = serializers.SerializerMethodField()
     is_overdraft_available = serializers.SerializerMethodField()
@@ -163,6 +164,10 @@ class BankAccountSerializer(serializers.ModelSerializer):
             'id', 'account_number', 'balance', 'available_balance', 'hold_balance',
             'created_at', 'updated_at', 'last_transaction_date', 'account_age_days'
         ]
+        field_dependencies = {
+            'account_age_days': ['created_at'],
+            'is_overdraft_available': ['overdraft_limit'],
+        }
     
     def get_account_age_days(self, obj):
         from datetime import date
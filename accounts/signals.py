@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import UserProfile, BankAccount, LoginHistory, KYCDocument
+from .dashboard_cache import invalidate_dashboards
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_dashboard(sender, instance, **kwargs):
+    invalidate_dashboards([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+@receiver([post_save, post_delete], sender=BankAccount)
+@receiver([post_save, post_delete], sender=LoginHistory)
+def invalidate_owner_dashboard(sender, instance, **kwargs):
+    """Profiles, accounts and login history all belong to a user directly"""
+    invalidate_dashboards([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=KYCDocument)
+def invalidate_kyc_dashboard(sender, instance, **kwargs):
+    invalidate_dashboards(
+        UserProfile.objects.filter(pk=instance.user_profile_id).values_list('user_id', flat=True)
+    )
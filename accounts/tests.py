@@ -1,3 +1,326 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from banking.activity import activity_rows
+from banking.models import Card, Transaction, AccountActivity
+from banking.posting import credit_account
+from .fieldsets import parse_field_list, split_fieldset
+from .identifiers import (
+    BlockAllocator, _encode_account_number, allocate_account_numbers, allocate_card_numbers,
+    allocate_transaction_references, card_issuer_prefix, is_luhn_valid, luhn_check_digit
+)
+from .models import UserProfile, BankAccount, IdentifierSequence, KYCDocument, LoginHistory
+from .serializers import BankAccountSerializer
+
+REQUIRED_US_DOCUMENTS = ['government_id_us_passport', 'proof_address_utility_bill', 'us_ssn_card', 'selfie_with_id']
+
+
+class DashboardQueryTests(TestCase):
+    """The dashboard costs a fixed number of queries however much the user owns"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('dashboard', 'dashboard@example.com', 'x')
+        self.profile = UserProfile.objects.create(user=self.user, date_of_birth=date(1990, 1, 1), country='US')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def grow(self, accounts, transactions, documents):
+        """Give the user more accounts, transactions, approved KYC documents and logins"""
+        BankAccount.objects.bulk_create([
+            BankAccount(
+                user=self.user, account_number=number, account_name='Dashboard',
+                account_type='savings' if index % 2 else 'current',
+                balance=Decimal('100.00'), available_balance=Decimal('90.00'),
+            )
+            for index, number in enumerate(allocate_account_numbers(accounts))
+        ])
+        owned = list(BankAccount.objects.filter(user=self.user))
+
+        now = timezone.now()
+        created = Transaction.objects.bulk_create([
+            Transaction(
+                reference=reference,
+                transaction_type='transfer',
+                amount=Decimal('5.00'),
+                total_amount=Decimal('5.00'),
+                description='Seeded transfer',
+                status='pending' if index % 2 else 'completed',
+                from_account=owned[index % len(owned)],
+                to_account=owned[(index + 1) % len(owned)],
+                expected_completion_date=date.today() + timedelta(days=1),
+                created_at=now - timedelta(minutes=index),
+            )
+            for index, reference in enumerate(allocate_transaction_references(transactions))
+        ])
+        AccountActivity.objects.bulk_create([row for txn in created for row in activity_rows(txn)])
+
+        KYCDocument.objects.bulk_create([
+            KYCDocument(
+                user_profile=self.profile, document_type=document_type,
+                document_name=document_type, verification_status='approved', is_approved=True,
+            )
+            for document_type in documents
+        ])
+        LoginHistory.objects.bulk_create([
+            LoginHistory(user=self.user, ip_address='127.0.0.1', user_agent='tests') for _ in range(transactions)
+        ])
+
+    def dashboard_queries(self):
+        """Queries of a cold (uncached) dashboard request"""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/auth/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_query_count_is_constant(self):
+        self.grow(accounts=1, transactions=2, documents=['selfie_with_id'])
+        small, small_count = self.dashboard_queries()
+        self.grow(accounts=4, transactions=30, documents=['us_ssn_card', 'proof_address_utility_bill'])
+        large, large_count = self.dashboard_queries()
+
+        self.assertEqual(len(small['accounts']), 1)
+        self.assertEqual(len(large['accounts']), 5)
+        self.assertEqual(len(large['recent_transactions']), 5)
+        self.assertEqual(len(large['profile']['kyc_documents']), 3)
+        self.assertEqual(small_count, large_count)
+        # profile + KYC documents, accounts, totals, recent activity + transactions, logins
+        self.assertEqual(large_count, 7)
+
+    def test_aggregates(self):
+        self.grow(accounts=3, transactions=4, documents=REQUIRED_US_DOCUMENTS)
+        data, _ = self.dashboard_queries()
+
+        self.assertEqual(Decimal(str(data['financial_summary']['total_balance'])), Decimal('300.00'))
+        self.assertEqual(data['account_statistics'], {
+            'total_accounts': 3, 'active_accounts': 3, 'savings_accounts': 1, 'current_accounts': 2,
+        })
+        self.assertEqual(data['kyc_information']['completion_percentage'], 100)
+        self.assertTrue(data['kyc_information']['has_required_documents'])
+        self.assertEqual(data['profile']['kyc_completion_percentage'], 100)
+
+    def test_account_summary_counts_all_activity(self):
+        self.grow(accounts=2, transactions=12, documents=[])
+        account = BankAccount.objects.filter(user=self.user).first()
+
+        response = self.client.get(f'/api/auth/accounts/{account.pk}/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['transaction_summary'], {
+            'total_transactions': 12, 'pending_transactions': 6,
+        })
+
+
+class DashboardCacheTests(TestCase):
+    """Warm dashboards come from the cache until the user's data changes"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('cached', 'cached@example.com', 'x')
+            UserProfile.objects.create(user=self.user, date_of_birth=date(1990, 1, 1))
+            self.account = BankAccount.objects.create(
+                user=self.user, account_number=allocate_account_numbers()[0], account_name='Cached'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def dashboard(self):
+        response = self.client.get('/api/auth/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_warm_request_skips_the_database(self):
+        cold = self.dashboard()
+        with self.assertNumQueries(0):
+            warm = self.dashboard()
+        self.assertEqual(warm, cold)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.dashboard()
+        response = self.client.get('/api/auth/dashboard/', {'fields': 'financial_summary'})
+        self.assertEqual(list(response.json()), ['financial_summary'])
+
+    def test_posting_retires_the_cached_balance(self):
+        self.assertEqual(Decimal(str(self.dashboard()['financial_summary']['total_balance'])), Decimal('0'))
+        with self.captureOnCommitCallbacks(execute=True):
+            credit_account(self.account, Decimal('25.00'))
+        self.assertEqual(Decimal(str(self.dashboard()['financial_summary']['total_balance'])), Decimal('25.00'))
+
+    def test_login_retires_the_cached_history(self):
+        self.assertEqual(self.dashboard()['recent_logins'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            LoginHistory.objects.create(user=self.user, ip_address='127.0.0.1', user_agent='tests')
+        self.assertEqual(len(self.dashboard()['recent_logins']), 1)
+
+    def admin_action(self, changelist, action, pks):
+        """Run an admin action on a changelist URL, which may carry a filter"""
+        admin_user = User.objects.create_superuser('dashboardadmin', 'dashboardadmin@example.com', 'x')
+        self.client.force_login(admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(changelist, {
+                'action': action, '_selected_action': [str(pk) for pk in pks], 'index': 0,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.client.force_authenticate(self.user)
+
+    def test_filtered_profile_action_retires_the_dashboard(self):
+        self.assertEqual(self.dashboard()['profile']['kyc_status'], 'pending')
+        # The filter matches nothing once the action has run
+        self.admin_action('/admin/accounts/userprofile/?kyc_status__exact=pending', 'approve_kyc',
+                          [self.user.userprofile.pk])
+        self.assertEqual(self.dashboard()['profile']['kyc_status'], 'approved')
+
+    def test_filtered_card_action_retires_the_dashboard(self):
+        card = Card.objects.create(account=self.account, expiry_date=date.today() + timedelta(days=365))
+        self.dashboard()
+        self.admin_action('/admin/banking/card/?status__exact=active', 'block_cards', [card.pk])
+        self.assertEqual(Card.objects.get(pk=card.pk).status, 'blocked')
+        with CaptureQueriesContext(connection) as queries:
+            self.dashboard()
+        self.assertTrue(queries, 'The dashboard was served from the cache')
+
+    def test_other_users_changes_keep_the_cache(self):
+        self.dashboard()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user('other', 'other@example.com', 'x')
+        with self.assertNumQueries(0):
+            self.dashboard()
+
+
+class IdentifierAllocationTests(TestCase):
+    """Identifiers come from reserved blocks of a shared series, never twice"""
+
+    def allocator(self, name='test_series'):
+        return BlockAllocator(name, _encode_account_number, 'accounts.BankAccount', 'account_number', block_size=5)
+
+    def next_value(self, name='test_series'):
+        return IdentifierSequence.objects.get(name=name).next_value
+
+    def test_block_is_handed_out_from_memory(self):
+        allocator = self.allocator()
+        first = allocator.allocate(3)
+        self.assertEqual(self.next_value(), 5)
+        with self.assertNumQueries(0):
+            second = allocator.allocate(2)
+        third = allocator.allocate()
+        self.assertEqual(self.next_value(), 10)
+        self.assertEqual(len(set(first + second + third)), 6)
+
+    def test_large_request_reserves_one_block_of_its_size(self):
+        self.assertEqual(len(set(self.allocator().allocate(12))), 12)
+        self.assertEqual(self.next_value(), 12)
+
+    def test_allocators_sharing_a_series_never_collide(self):
+        # Two processes each hold their own allocator over the same sequence row
+        one, other = self.allocator(), self.allocator()
+        identifiers = []
+        for _ in range(4):
+            identifiers += one.allocate(3) + other.allocate(2)
+        self.assertEqual(len(identifiers), len(set(identifiers)))
+
+    def test_existing_identifiers_are_skipped(self):
+        taken = _encode_account_number(1)
+        BankAccount.objects.create(
+            user=User.objects.create_user('taken', 'taken@example.com', 'x'), account_number=taken
+        )
+        identifiers = self.allocator().allocate(5)
+        self.assertNotIn(taken, identifiers)
+        self.assertEqual(len(identifiers), 5)
+
+    def test_block_reserved_in_a_rolled_back_transaction_is_dropped(self):
+        allocator = self.allocator()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                rolled_back = allocator.allocate()
+                raise RuntimeError
+        # The range went back to the series, so it is reserved again rather than reused from memory
+        self.assertEqual(allocator.allocate(), rolled_back)
+        self.assertEqual(self.next_value(), 5)
+
+    def test_block_reserved_in_a_committed_transaction_is_kept(self):
+        allocator = self.allocator()
+        with transaction.atomic():
+            allocator.allocate()
+        with self.assertNumQueries(0):
+            allocator.allocate()
+
+    def test_card_numbers_carry_the_issuer_prefix_and_check_digit(self):
+        self.assertEqual(luhn_check_digit('7992739871'), '3')
+        self.assertFalse(is_luhn_valid('79927398710'))
+
+        numbers = allocate_card_numbers(20, card_brand='visa')
+        self.assertEqual(len(set(numbers)), 20)
+        for number in numbers:
+            self.assertEqual(len(number), 16)
+            self.assertTrue(number.startswith(card_issuer_prefix('visa')))
+            self.assertTrue(is_luhn_valid(number))
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= and ?exclude= trim serializers and the columns read for them"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sparse', 'sparse@example.com', 'x')
+        UserProfile.objects.create(user=self.user, date_of_birth=date(1990, 1, 1), country='US')
+        self.account = BankAccount.objects.create(
+            user=self.user, account_number=allocate_account_numbers()[0], account_name='Sparse',
+            balance=Decimal('12.00'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unknown_fields_are_refused(self):
+        with self.assertRaises(ValidationError):
+            BankAccountSerializer(fields=['balance', 'pin'])
+        with self.assertRaises(ValidationError):
+            BankAccountSerializer(exclude=['pin'])
+
+        response = self.client.get('/api/auth/accounts/', {'fields': 'balance,pin'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pin', response.json()['fields'])
+
+    def test_kept_fields_narrow_the_columns(self):
+        self.assertEqual(
+            BankAccountSerializer(fields=['balance', 'account_age_days']).query_columns(),
+            ({'id', 'balance', 'created_at'}, set())
+        )
+        # A nested serializer reads its whole related row
+        self.assertEqual(
+            BankAccountSerializer(fields=['balance', 'user']).query_columns(),
+            ({'id', 'balance', 'user'}, {'user'})
+        )
+
+    def test_nested_fields_select_within_a_dashboard_section(self):
+        response = self.client.get('/api/auth/dashboard/', {
+            'fields': 'accounts.balance,accounts.user,financial_summary',
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(set(data), {'accounts', 'financial_summary'})
+        [account] = data['accounts']
+        self.assertEqual(set(account), {'balance', 'user'})
+        self.assertEqual((account['balance'], account['user']['username']), ('12.00', 'sparse'))
+
+        response = self.client.get('/api/auth/dashboard/', {'exclude': 'accounts.user,recent_logins'})
+        data = response.json()
+        self.assertNotIn('recent_logins', data)
+        self.assertNotIn('user', data['accounts'][0])
+        self.assertIn('balance', data['accounts'][0])
 
-# Create your tests here.
+    def test_split_fieldset(self):
+        self.assertEqual(
+            split_fieldset(['accounts.balance', 'accounts.status', 'user', 'user.email']),
+            {'accounts': ['balance', 'status'], 'user': None}
+        )
+        self.assertIsNone(split_fieldset(parse_field_list(' , ')))
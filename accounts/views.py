@@ -19,10 +19,12 @@ import json
 from datetime import datetime, timedelta
 from .models import UserProfile, BankAccount, LoginHistory, EmailVerification, KYCDocument
 from .serializers import UserRegistrationSerializer, UserSerializer, UserProfileSerializer, BankAccountSerializer, KYCDocumentSerializer
+from .fieldsets import SparseFieldsetViewMixin, parse_field_list, split_fieldset, serialize_sparse
+from .dashboard_cache import cached_payload, request_variant
 from banking.models import Transaction
 from banking.serializers import TransactionSerializer
 from notifications.services import NotificationService
-from django.db.models import Sum, Q
+from django.db.models import Count, Sum, Q
 from .serializers import KYCUpdateSerializer, KYCDocumentUploadSerializer, KYCDocumentSerializer, LoginHistorySerializer, ProfileCompletionSerializer
 from .models import KYCDocument
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
@@ -409,7 +411,7 @@ def kyc_status(request):
         }, status=status.HTTP_404_NOT_FOUND)
 
 
-class BankAccountListView(generics.ListCreateAPIView):
+class BankAccountListView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """Enhanced list user's bank accounts or create new account"""
     serializer_class = BankAccountSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -464,97 +466,153 @@ class BankAccountDetailView(generics.RetrieveUpdateAPIView):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_dashboard(request):
-    """Enhanced dashboard view with comprehensive user summary"""
+    """
+    Enhanced dashboard view with comprehensive user summary
+    
+    ?fields= and ?exclude= take section names (accounts) or section.field
+    names (recent_transactions.amount); sections left out are not computed.
+    Responses are cached per user until the user's data next changes.
+    """
+    payload, status_code = cached_payload(
+        request.user.pk, 'dashboard', request_variant(request), lambda: _build_dashboard(request)
+    )
+    return Response(payload, status=status_code)
+
+
+def _build_dashboard(request):
+    """(payload, status) of the dashboard"""
     try:
-        profile = UserProfile.objects.get(user=request.user)
+        # kyc_documents is read by the profile section and the KYC figures alike
+        profile = UserProfile.objects.select_related('user').prefetch_related('kyc_documents').get(user=request.user)
         accounts = BankAccount.objects.filter(user=request.user).select_related('user')
         
-        # Calculate financial summary
-        total_balance = accounts.aggregate(total=Sum('balance'))['total'] or 0
-        total_available = accounts.aggregate(total=Sum('available_balance'))['total'] or 0
-        
-        # Get recent transactions (last 5)
-        from banking.models import Transaction
-        recent_transactions = Transaction.objects.filter(
-            Q(from_account__in=accounts) | Q(to_account__in=accounts)
-        ).distinct().order_by('-created_at')[:5]
-        
-        # Get recent login history
-        recent_logins = LoginHistory.objects.filter(
-            user=request.user
-        ).order_by('-login_time')[:5]
-        
-        # Account statistics
-        account_stats = {
-            'total_accounts': accounts.count(),
-            'active_accounts': accounts.filter(status='active').count(),
-            'savings_accounts': accounts.filter(account_type='savings').count(),
-            'current_accounts': accounts.filter(account_type='current').count(),
-        }
-        
-        # KYC information
-        kyc_info = {
-            'status': profile.kyc_status,
-            'completion_percentage': profile.get_kyc_completion_percentage(),
-            'has_required_documents': profile.has_required_kyc_documents(),
-            'is_verified': profile.is_verified
-        }
+        include = split_fieldset(parse_field_list(request.query_params.get('fields')))
+        exclude = split_fieldset(parse_field_list(request.query_params.get('exclude'))) or {}
+        
+        def wanted(section):
+            if section in exclude and exclude[section] is None:
+                return False
+            return include is None or section in include
+        
+        def fieldset(section):
+            options = {}
+            if include and include.get(section):
+                options['fields'] = include[section]
+            if exclude.get(section):
+                options['exclude'] = exclude[section]
+            return options
+        
+        def pick(section, values):
+            options = fieldset(section)
+            return {
+                key: value for key, value in values.items()
+                if key in options.get('fields', values) and key not in options.get('exclude', [])
+            }
         
         from banking.serializers import TransactionSerializer
         
-        return Response({
-            'user': UserSerializer(request.user).data,
-            'profile': UserProfileSerializer(profile, context={'request': request}).data,
-            'accounts': BankAccountSerializer(accounts, many=True).data,
-            'financial_summary': {
-                'total_balance': total_balance,
-                'total_available': total_available,
+        data = {}
+        if wanted('user'):
+            data['user'] = UserSerializer(request.user).data
+        if wanted('profile'):
+            data['profile'] = UserProfileSerializer(profile, context={'request': request}).data
+        if wanted('accounts'):
+            data['accounts'] = serialize_sparse(BankAccountSerializer, accounts, **fieldset('accounts'))
+        if wanted('financial_summary') or wanted('account_statistics'):
+            # Balances and account counts in a single conditional aggregate
+            totals = accounts.aggregate(
+                total_balance=Sum('balance'),
+                total_available=Sum('available_balance'),
+                total_accounts=Count('pk'),
+                active_accounts=Count('pk', filter=Q(status='active')),
+                savings_accounts=Count('pk', filter=Q(account_type='savings')),
+                current_accounts=Count('pk', filter=Q(account_type='current')),
+            )
+        if wanted('financial_summary'):
+            data['financial_summary'] = pick('financial_summary', {
+                'total_balance': totals['total_balance'] or 0,
+                'total_available': totals['total_available'] or 0,
                 'currency': 'USD'  # Default currency
-            },
-            'account_statistics': account_stats,
-            'kyc_information': kyc_info,
-            'recent_transactions': TransactionSerializer(recent_transactions, many=True).data,
-            'recent_logins': LoginHistorySerializer(recent_logins, many=True).data,
-            'verification_required': not profile.is_verified
-        })
+            })
+        if wanted('account_statistics'):
+            data['account_statistics'] = pick('account_statistics', {
+                key: totals[key]
+                for key in ('total_accounts', 'active_accounts', 'savings_accounts', 'current_accounts')
+            })
+        if wanted('kyc_information'):
+            # KYC information, from one pass over the approved documents
+            approved_types = profile.get_approved_kyc_document_types()
+            data['kyc_information'] = pick('kyc_information', {
+                'status': profile.kyc_status,
+                'completion_percentage': profile.get_kyc_completion_percentage(approved_types),
+                'has_required_documents': profile.has_required_kyc_documents(approved_types),
+                'is_verified': profile.is_verified
+            })
+        if wanted('recent_transactions'):
+            # Get recent transactions (last 5)
+            from banking.activity import recent_transactions as recent_account_transactions
+            data['recent_transactions'] = serialize_sparse(
+                TransactionSerializer, recent_account_transactions(accounts, 5), **fieldset('recent_transactions')
+            )
+        if wanted('recent_logins'):
+            # Get recent login history
+            recent_logins = LoginHistory.objects.filter(
+                user=request.user
+            ).order_by('-login_time')[:5]
+            data['recent_logins'] = LoginHistorySerializer(recent_logins, many=True).data
+        if wanted('verification_required'):
+            data['verification_required'] = not profile.is_verified
+        
+        return data, status.HTTP_200_OK
     except UserProfile.DoesNotExist:
-        return Response({
+        return {
             'error': 'User profile not found. Please complete your registration.'
-        }, status=status.HTTP_404_NOT_FOUND)
+        }, status.HTTP_404_NOT_FOUND
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def account_summary(request, account_id):
-    """Get detailed summary for a specific account"""
+    """Get detailed summary for a specific account, cached like the dashboard"""
+    payload, status_code = cached_payload(
+        request.user.pk, 'account_summary', request_variant(request, str(account_id)),
+        lambda: _build_account_summary(request, account_id)
+    )
+    return Response(payload, status=status_code)
+
+
+def _build_account_summary(request, account_id):
+    """(payload, status) of an account summary"""
     try:
-        account = BankAccount.objects.get(id=account_id, user=request.user)
+        account = BankAccount.objects.select_related('user').get(id=account_id, user=request.user)
         
         # Get recent transactions for this account
-        from banking.models import Transaction
-        recent_transactions = Transaction.objects.filter(
-            Q(from_account=account) | Q(to_account=account)
-        ).order_by('-created_at')[:10]
+        from banking.activity import recent_transactions as recent_account_transactions
+        recent_transactions = recent_account_transactions([account], 10)
         
         # Get cards for this account
         from banking.models import Card
-        cards = Card.objects.filter(account=account)
+        cards = Card.objects.filter(account=account).select_related('account')
+        
+        # Totals over all of the account's activity in one conditional aggregate
+        from banking.models import AccountActivity
+        transaction_summary = AccountActivity.objects.filter(account=account).aggregate(
+            total_transactions=Count('transaction', distinct=True),
+            pending_transactions=Count('transaction', distinct=True, filter=Q(status='pending')),
+        )
         
         from banking.serializers import TransactionSerializer, CardSerializer
         
-        return Response({
+        return {
             'account': BankAccountSerializer(account).data,
             'recent_transactions': TransactionSerializer(recent_transactions, many=True).data,
             'cards': CardSerializer(cards, many=True).data,
-            'transaction_summary': {
-                'total_transactions': recent_transactions.count(),
-                'pending_transactions': recent_transactions.filter(status='pending').count(),
-            }
-        })
+            'transaction_summary': transaction_summary
+        }, status.HTTP_200_OK
     except BankAccount.DoesNotExist:
-        return Response({'error': 'Account not found'}, status=404)
+        return {'error': 'Account not found'}, status.HTTP_404_NOT_FOUND
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
+        return {'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
 class EmailVerificationView(APIView):
@@ -0,0 +1,140 @@
+"""
+Per-account activity projection
+
+AccountActivity keeps one row per (account, transaction, direction). It lets
+account-centric reads range-scan the (account, created_at) index instead of
+OR-ing from_account and to_account on Transaction.
+
+The rows are maintained in three places:
+- banking.signals creates them when a transaction is inserted and mirrors its
+  status on every save();
+- code that changes status with a queryset update() or bulk_update() calls
+  sync_activity_status() for the affected ids;
+- the backfill_account_activity command builds them for existing
+  transactions.
+
+Every status sync also retires the cached dashboards of the accounts' owners
+and the cached renderings of the transactions.
+"""
+import heapq
+
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from accounts.dashboard_cache import invalidate_dashboards
+from .models import AccountActivity, Transaction
+from .representations import forget_representations
+
+
+def activity_rows(txn):
+    """Unsaved AccountActivity rows for a transaction (a dict or model instance)"""
+    if isinstance(txn, dict):
+        pk, from_id, to_id = txn['pk'], txn['from_account_id'], txn['to_account_id']
+        status, created_at, updated_at = txn['status'], txn['created_at'], txn['updated_at']
+    else:
+        pk, from_id, to_id = txn.pk, txn.from_account_id, txn.to_account_id
+        status, created_at, updated_at = txn.status, txn.created_at, txn.updated_at
+
+    copied = {'transaction_id': pk, 'status': status, 'created_at': created_at, 'updated_at': updated_at}
+    rows = []
+    if from_id:
+        rows.append(AccountActivity(account_id=from_id, direction='out', **copied))
+    if to_id:
+        rows.append(AccountActivity(account_id=to_id, direction='in', **copied))
+    return rows
+
+
+def record_activity(txn):
+    """Create the activity rows of a new transaction"""
+    AccountActivity.objects.bulk_create(activity_rows(txn), ignore_conflicts=True)
+
+
+def rebuild_activity(txn):
+    """Replace a transaction's rows, e.g. after its accounts were edited"""
+    AccountActivity.objects.filter(transaction_id=txn.pk).delete()
+    record_activity(txn)
+
+
+def sync_activity_status(transaction_ids):
+    """
+    Copy the current status of these transactions onto their activity rows in
+    one statement, marking them changed for delta sync
+    """
+    transaction_ids = list(transaction_ids)
+    if not transaction_ids:
+        return 0
+    current_status = Transaction.objects.filter(pk=OuterRef('transaction_id')).values('status')[:1]
+    updated = AccountActivity.objects.filter(transaction_id__in=transaction_ids).update(
+        status=Subquery(current_status), updated_at=timezone.now()
+    )
+    invalidate_transaction_owners(transaction_ids)
+    forget_representations(transaction_ids)
+    return updated
+
+
+def invalidate_transaction_owners(transaction_ids):
+    """Retire the cached dashboards of everyone whose accounts these transactions touch"""
+    invalidate_dashboards(
+        AccountActivity.objects.filter(transaction_id__in=list(transaction_ids)).values_list(
+            'account__user_id', flat=True
+        ).distinct()
+    )
+
+
+def _activity_for(accounts, status=None):
+    activity = AccountActivity.objects.filter(account__in=accounts)
+    if status:
+        activity = activity.filter(status=status)
+    return activity
+
+
+def recent_transactions(accounts, limit, status=None):
+    """
+    The latest transactions touching any of the accounts, newest first.
+
+    A transfer between two of the accounts has two activity rows, so twice
+    the limit is read before de-duplicating.
+    """
+    ids = _activity_for(accounts, status).order_by('-created_at', '-transaction_id').values_list(
+        'transaction_id', flat=True
+    )[:limit * 2]
+    ids = list(dict.fromkeys(ids))[:limit]
+    return Transaction.objects.filter(pk__in=ids).order_by('-created_at')
+
+
+def account_transactions(accounts, status=None):
+    """Every transaction touching any of the accounts, without OR or DISTINCT"""
+    ids = _activity_for(accounts, status).values('transaction_id')
+    return Transaction.objects.filter(pk__in=ids).order_by('-created_at')
+
+
+def changed_transactions(accounts, since=None, limit=100, until=None):
+    """
+    (updated_at, transaction_id) keys of transactions touching the accounts
+    that changed after the since key (and before until), oldest change first.
+
+    Each account is one range scan of (account, updated_at, transaction);
+    limit + 1 keys are read per account so the caller can tell whether more
+    changes follow.
+    """
+    branches = []
+    for account in accounts:
+        activity = AccountActivity.objects.filter(account=account)
+        if since is not None:
+            updated_at, pk = since
+            activity = activity.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, transaction_id__gt=pk))
+        if until is not None:
+            activity = activity.filter(updated_at__lt=until)
+        branches.append(list(
+            activity.order_by('updated_at', 'transaction_id').values_list('updated_at', 'transaction_id')[:limit + 1]
+        ))
+
+    keys, seen = [], set()
+    for key in heapq.merge(*branches):
+        if key[1] in seen:
+            continue
+        seen.add(key[1])
+        keys.append(key)
+        if len(keys) > limit:
+            break
+    return keys
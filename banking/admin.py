@@ -5,12 +5,18 @@ from django.urls import path, reverse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.utils import timezone
+from django.db import transaction as db_transaction
 from accounts.models import BankAccount, User
 from decimal import Decimal
 from .models import (
     Transaction, TransferRequest, DepositRequest, Card, AccountStatement, 
-    AccountNotification, TransactionLimit
+    AccountNotification, TransactionLimit, LedgerEntry
 )
+from .posting import credit_account, debit_account, reverse_postings, release_hold
+from .activity import rebuild_activity, sync_activity_status, invalidate_transaction_owners
+from .exports import stream_transactions
+from .changelist import EstimatedCountPaginator, transaction_stats
+from accounts.dashboard_cache import invalidate_dashboards
 
 
 class DepositForm(forms.Form):
@@ -166,11 +172,14 @@ class TransactionAdmin(admin.ModelAdmin):
         'id', 'reference', 'from_balance_before', 'from_balance_after',
         'to_balance_before', 'to_balance_after', 'created_at', 
         'updated_at', 'processed_at', 'completed_at', 'confirmed_at', 'failed_at',
-        'total_amount'
+        'total_amount', 'held_amount'
     )
     date_hierarchy = 'created_at'
     list_per_page = 25
     list_max_show_all = 100
+    paginator = EstimatedCountPaginator
+    # The filtered count is enough; skip the second COUNT(*) over the whole table
+    show_full_result_count = False
     
     # Allow deletion and proper cascade handling
     def has_delete_permission(self, request, obj=None):
@@ -181,22 +190,32 @@ class TransactionAdmin(admin.ModelAdmin):
         """Handle transaction deletion with balance restoration"""
         # Restore account balances if transaction was completed
         if obj.status == 'completed':
-            from decimal import Decimal
+            description = f"Reversal of deleted transaction {obj.reference}"
             
-            if obj.transaction_type == 'deposit' and obj.to_account and obj.to_balance_before is not None:
-                # Reverse deposit - remove funds from account
-                obj.to_account.balance = obj.to_balance_before
-                obj.to_account.save()
-                
-            elif obj.transaction_type in ['withdrawal', 'transfer', 'fee', 'charge'] and obj.from_account and obj.from_balance_before is not None:
-                # Reverse withdrawal/transfer - restore funds to account
-                obj.from_account.balance = obj.from_balance_before
-                obj.from_account.save()
+            with db_transaction.atomic():
+                if not reverse_postings(obj, description=description):
+                    # Posted before the ledger existed - compensate from the transaction amounts
+                    ledger = {'contra': 'adjustments', 'description': description}
+                    
+                    if obj.transaction_type == 'deposit' and obj.to_account and obj.to_balance_before is not None:
+                        # Reverse deposit - remove funds from account
+                        debit_account(obj.to_account, obj.amount, allow_overdraft=True, **ledger)
+                        
+                    elif obj.transaction_type in ['withdrawal', 'transfer', 'fee', 'charge'] and obj.from_account and obj.from_balance_before is not None:
+                        # Reverse withdrawal/transfer - restore funds to account
+                        credit_account(obj.from_account, obj.total_amount or obj.amount, **ledger)
+                        
+                        # For internal transfers, also restore destination account
+                        if obj.transaction_type == 'transfer' and obj.to_account and obj.to_balance_before is not None:
+                            debit_account(obj.to_account, obj.amount, allow_overdraft=True, **ledger)
                 
-                # For internal transfers, also restore destination account
-                if obj.transaction_type == 'transfer' and obj.to_account and obj.to_balance_before is not None:
-                    obj.to_account.balance = obj.to_balance_before
-                    obj.to_account.save()
+                # Delete the transaction
+                super().delete_model(request, obj)
+            return
+        
+        # Hand back any funds still held for the transaction
+        if obj.held_amount:
+            release_hold(obj)
         
         # Delete the transaction
         super().delete_model(request, obj)
@@ -247,7 +266,8 @@ class TransactionAdmin(admin.ModelAdmin):
         ('Balance Tracking', {
             'fields': (
                 ('from_balance_before', 'from_balance_after'),
-                ('to_balance_before', 'to_balance_after')
+                ('to_balance_before', 'to_balance_after'),
+                'held_amount'
             ),
             'classes': ('collapse',),
             'description': 'Account balance snapshots before and after transaction'
@@ -408,28 +428,12 @@ class TransactionAdmin(admin.ModelAdmin):
     
     def changelist_view(self, request, extra_context=None):
         """Add summary statistics to the change list view"""
-        extra_context = extra_context or {}
-        
-        # Get queryset with applied filters
-        cl = self.get_changelist_instance(request)
-        queryset = cl.get_queryset(request)
-        
-        # Calculate summary statistics
-        from django.db.models import Sum, Count
-        from decimal import Decimal
-        
-        stats = {
-            'total_transactions': queryset.count(),
-            'total_amount': queryset.aggregate(Sum('amount'))['amount__sum'] or Decimal('0'),
-            'pending_count': queryset.filter(status='pending').count(),
-            'completed_count': queryset.filter(status='completed').count(),
-            'failed_count': queryset.filter(status='failed').count(),
-            'pending_amount': queryset.filter(status='pending').aggregate(Sum('amount'))['amount__sum'] or Decimal('0'),
-            'completed_amount': queryset.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or Decimal('0'),
-        }
-        
-        extra_context['transaction_stats'] = stats
-        return super().changelist_view(request, extra_context=extra_context)
+        response = super().changelist_view(request, extra_context=extra_context)
+        context = getattr(response, 'context_data', None)
+        if context and 'cl' in context:
+            # The filtered queryset of the changelist that was just built, aggregated in one pass
+            context['transaction_stats'] = transaction_stats(context['cl'].queryset, request.GET)
+        return response
     
     def has_delete_permission(self, request, obj=None):
         """Restrict deletion of completed/failed transactions"""
@@ -441,6 +445,8 @@ class TransactionAdmin(admin.ModelAdmin):
         """Custom save logic for transactions"""
         # Simply save the model without trying to set non-existent processed_by field
         super().save_model(request, obj, form, change)
+        if change and {'from_account', 'to_account'} & set(form.changed_data):
+            rebuild_activity(obj)
     
     def get_form(self, request, obj=None, **kwargs):
         """Customize form based on transaction status"""
@@ -659,6 +665,35 @@ class AccountNotificationAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('user', 'account', 'transaction')
 
 
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'ledger_account', 'account', 'entry_type', 'amount',
+        'sequence', 'balance_after', 'transaction', 'description'
+    )
+    list_filter = ('ledger_account', 'entry_type', 'created_at')
+    search_fields = ('account__account_number', 'transaction__reference', 'description', 'posting_id')
+    readonly_fields = (
+        'posting_id', 'ledger_account', 'account', 'transaction', 'entry_type', 'amount',
+        'sequence', 'balance_after', 'description', 'created_at'
+    )
+    date_hierarchy = 'created_at'
+    list_per_page = 50
+    
+    # The ledger is append-only: entries are written by the posting engine only
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('account', 'transaction')
+
+
 @admin.register(TransactionLimit)
 class TransactionLimitAdmin(admin.ModelAdmin):
     list_display = (
@@ -701,21 +736,37 @@ def create_deposit_transaction(modeladmin, request, queryset):
     return redirect(f"{url}?transaction_type=deposit&channel=system")
 
 
+def _release_holds(queryset):
+    """Bulk updates bypass Transaction.save(), so give held funds back before changing status"""
+    for transaction in queryset.filter(held_amount__gt=0).select_related('from_account'):
+        release_hold(transaction)
+
+
 @admin.action(description='Mark selected transactions as completed')
 def mark_transactions_completed(modeladmin, request, queryset):
+    # Read the ids first: under a status filter the queryset is empty after the update
+    pks = list(queryset.values_list('pk', flat=True))
+    _release_holds(queryset)
     updated = queryset.update(status='completed')
+    sync_activity_status(pks)
     modeladmin.message_user(request, f'{updated} transactions marked as completed.')
 
 
 @admin.action(description='Mark selected transactions as pending')
 def mark_transactions_pending(modeladmin, request, queryset):
+    pks = list(queryset.values_list('pk', flat=True))
+    _release_holds(queryset)
     updated = queryset.update(status='pending')
+    sync_activity_status(pks)
     modeladmin.message_user(request, f'{updated} transactions marked as pending.')
 
 
 @admin.action(description='Mark selected transactions as failed')
 def mark_transactions_failed(modeladmin, request, queryset):
+    pks = list(queryset.values_list('pk', flat=True))
+    _release_holds(queryset)
     updated = queryset.update(status='failed')
+    sync_activity_status(pks)
     modeladmin.message_user(request, f'{updated} transactions marked as failed.')
 
 
@@ -730,27 +781,33 @@ def confirm_transactions(modeladmin, request, queryset):
 
 @admin.action(description='Mark OFAC screening as cleared')
 def clear_ofac_screening(modeladmin, request, queryset):
+    pks = list(queryset.values_list('pk', flat=True))
     updated = queryset.update(ofac_screening_status='cleared')
+    invalidate_transaction_owners(pks)
     modeladmin.message_user(request, f'{updated} transactions cleared for OFAC screening.')
 
 
 @admin.action(description='Process selected transactions')
 def process_transactions(modeladmin, request, queryset):
     from django.utils import timezone
-    updated = queryset.filter(status='confirmed').update(
+    confirmed = list(queryset.filter(status='confirmed').values_list('pk', flat=True))
+    updated = queryset.filter(pk__in=confirmed, status='confirmed').update(
         status='processing',
         processed_at=timezone.now(),
         processed_by=f"Admin: {request.user.username}"
     )
+    sync_activity_status(confirmed)
     modeladmin.message_user(request, f'{updated} transactions marked as processing.')
 
 
 @admin.action(description='Approve transactions requiring approval')
 def approve_transactions(modeladmin, request, queryset):
-    updated = queryset.filter(approval_required=True, status='pending').update(
+    approvable = list(queryset.filter(approval_required=True, status='pending').values_list('pk', flat=True))
+    updated = queryset.filter(pk__in=approvable, status='pending').update(
         approved_by=f"Admin: {request.user.username}",
         status='confirmed'
     )
+    sync_activity_status(approvable)
     modeladmin.message_user(request, f'{updated} transactions approved.')
 
 
@@ -766,18 +823,19 @@ def approve_pending_deposits(modeladmin, request, queryset):
     ):
         # Credit the account
         account = transaction.to_account
-        account.balance += transaction.amount
-        
-        # Update transaction
-        transaction.to_account_balance_after = account.balance
-        transaction.status = 'completed'
-        transaction.processed_at = timezone.now()
-        transaction.completed_at = timezone.now()
-        transaction.processed_by = f"Admin: {request.user.username}"
         
-        # Save changes
-        account.save()
-        transaction.save()
+        with db_transaction.atomic():
+            transaction.to_balance_before, transaction.to_balance_after = credit_account(
+                account, transaction.amount, transaction_obj=transaction,
+                description=f"Deposit approved by {request.user.username}"
+            )
+            
+            # Update transaction
+            transaction.status = 'completed'
+            transaction.processed_at = timezone.now()
+            transaction.completed_at = timezone.now()
+            transaction.processed_by = f"Admin: {request.user.username}"
+            transaction.save()
         
         # Create notification
         AccountNotification.objects.create(
@@ -802,34 +860,17 @@ def approve_pending_deposits(modeladmin, request, queryset):
 
 @admin.action(description='Export selected transactions to CSV')
 def export_transactions_csv(modeladmin, request, queryset):
-    import csv
-    from django.http import HttpResponse
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="transactions.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'Reference', 'Type', 'Amount', 'Currency', 'Status', 'From Account', 
-        'To Account', 'Description', 'Channel', 'Created At', 'Processed At'
-    ])
-    
-    for transaction in queryset:
-        writer.writerow([
-            transaction.reference,
-            transaction.transaction_type,
-            transaction.amount,
-            transaction.currency,
-            transaction.status,
-            transaction.from_account.account_number if transaction.from_account else '',
-            transaction.to_account.account_number if transaction.to_account else transaction.to_account_number,
-            transaction.description,
-            transaction.channel,
-            transaction.created_at,
-            transaction.processed_at
-        ])
-    
-    return response
+    return stream_transactions(queryset, 'csv')
+
+
+@admin.action(description='Export selected transactions to CSV (gzip)')
+def export_transactions_csv_gzip(modeladmin, request, queryset):
+    return stream_transactions(queryset, 'csv', compress=True)
+
+
+@admin.action(description='Export selected transactions to JSON Lines (gzip)')
+def export_transactions_jsonl_gzip(modeladmin, request, queryset):
+    return stream_transactions(queryset, 'jsonl', compress=True)
 
 
 @admin.action(description='Mark selected notifications as read')
@@ -848,31 +889,42 @@ def mark_notifications_sent(modeladmin, request, queryset):
 
 @admin.action(description='Activate selected cards')
 def activate_cards(modeladmin, request, queryset):
+    # Read the owners first: under a filter on the changed field the queryset is empty after the update
+    user_ids = list(queryset.values_list('account__user_id', flat=True))
     updated = queryset.update(status='active')
+    invalidate_dashboards(user_ids)
     modeladmin.message_user(request, f'{updated} cards activated.')
 
 
 @admin.action(description='Block selected cards')
 def block_cards(modeladmin, request, queryset):
+    user_ids = list(queryset.values_list('account__user_id', flat=True))
     updated = queryset.update(status='blocked')
+    invalidate_dashboards(user_ids)
     modeladmin.message_user(request, f'{updated} cards blocked.')
 
 
 @admin.action(description='Suspend selected cards')
 def suspend_cards(modeladmin, request, queryset):
+    user_ids = list(queryset.values_list('account__user_id', flat=True))
     updated = queryset.update(status='suspended')
+    invalidate_dashboards(user_ids)
     modeladmin.message_user(request, f'{updated} cards suspended.')
 
 
 @admin.action(description='Enable international transactions')
 def enable_international_transactions(modeladmin, request, queryset):
+    user_ids = list(queryset.values_list('account__user_id', flat=True))
     updated = queryset.update(international_transactions=True)
+    invalidate_dashboards(user_ids)
     modeladmin.message_user(request, f'International transactions enabled for {updated} cards.')
 
 
 @admin.action(description='Disable international transactions')
 def disable_international_transactions(modeladmin, request, queryset):
+    user_ids = list(queryset.values_list('account__user_id', flat=True))
     updated = queryset.update(international_transactions=False)
+    invalidate_dashboards(user_ids)
     modeladmin.message_user(request, f'International transactions disabled for {updated} cards.')
 
 
@@ -880,7 +932,8 @@ def disable_international_transactions(modeladmin, request, queryset):
 TransactionAdmin.actions = [
     create_deposit_transaction, mark_transactions_completed, mark_transactions_pending, mark_transactions_failed,
     confirm_transactions, clear_ofac_screening, process_transactions, 
-    approve_transactions, approve_pending_deposits, export_transactions_csv
+    approve_transactions, approve_pending_deposits, export_transactions_csv,
+    export_transactions_csv_gzip, export_transactions_jsonl_gzip
 ]
 AccountNotificationAdmin.actions = [mark_notifications_read, mark_notifications_sent]
 CardAdmin.actions = [activate_cards, block_cards, suspend_cards, enable_international_transactions, disable_international_transactions]
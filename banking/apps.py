@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BankingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'banking'
+    
+    def ready(self):
+        import banking.signals
+        # Build the business-day tables once per process rather than on the first request
+        from .business_days import get_calendar
+        get_calendar() 
@@ -0,0 +1,109 @@
+"""
+Precompiled business-day calendar
+
+Business days are Monday to Friday, excluding US federal holidays. The
+calendar covers BUSINESS_CALENDAR_YEARS_BACK years before and
+BUSINESS_CALENDAR_YEARS_AHEAD years after the year it is built. For that
+range it precomputes three lookup tables:
+
+- a bitmap of open days;
+- the running count of business days before each day;
+- the position of every business day.
+
+Checking a day, adding business days and counting the business days between
+two dates are then each a single index lookup. Dates outside the range fall
+back to walking the calendar.
+"""
+from array import array
+from datetime import date, timedelta
+
+import holidays
+from django.conf import settings
+
+
+class BusinessCalendar:
+    """Business-day lookup tables for whole years first_year..last_year"""
+
+    def __init__(self, first_year, last_year):
+        self.start = date(first_year, 1, 1)
+        self.end = date(last_year, 12, 31)
+        self.holidays = holidays.US(years=range(first_year, last_year + 1))
+
+        days = (self.end - self.start).days + 1
+        self._open = bytearray(days)
+        # _count_before[i]: business days in [start, start + i)
+        self._count_before = array('l', [0]) * (days + 1)
+        self._positions = array('l')
+        for index in range(days):
+            day = self.start + timedelta(days=index)
+            is_open = day.weekday() < 5 and day not in self.holidays
+            self._open[index] = is_open
+            self._count_before[index + 1] = self._count_before[index] + is_open
+            if is_open:
+                self._positions.append(index)
+
+    def _index(self, day):
+        index = (day - self.start).days
+        if 0 <= index < len(self._open):
+            return index
+        return None
+
+    def covers(self, day):
+        return self._index(day) is not None
+
+    def is_business_day(self, day):
+        index = self._index(day)
+        if index is None:
+            return day.weekday() < 5 and day not in holidays.US(years=day.year)
+        return bool(self._open[index])
+
+    def holiday_name(self, day):
+        if self.covers(day):
+            return self.holidays.get(day)
+        return holidays.US(years=day.year).get(day)
+
+    def add_business_days(self, start_date, days_ahead=1):
+        """The days_ahead-th business day after start_date"""
+        index = self._index(start_date)
+        if index is not None and days_ahead > 0:
+            position = self._count_before[index + 1] + days_ahead - 1
+            if position < len(self._positions):
+                return self.start + timedelta(days=self._positions[position])
+
+        current_date = start_date
+        business_days_added = 0
+        while business_days_added < days_ahead:
+            current_date += timedelta(days=1)
+            if self.is_business_day(current_date):
+                business_days_added += 1
+        return current_date
+
+    def business_days_between(self, start_date, end_date):
+        """Business days in (start_date, end_date]"""
+        if start_date >= end_date:
+            return 0
+        start_index, end_index = self._index(start_date), self._index(end_date)
+        if start_index is not None and end_index is not None:
+            return self._count_before[end_index + 1] - self._count_before[start_index + 1]
+
+        business_days = 0
+        current_date = start_date
+        while current_date < end_date:
+            current_date += timedelta(days=1)
+            business_days += self.is_business_day(current_date)
+        return business_days
+
+
+_calendar = None
+
+
+def get_calendar():
+    """The process-wide calendar, built on first use"""
+    global _calendar
+    if _calendar is None:
+        this_year = date.today().year
+        _calendar = BusinessCalendar(
+            this_year - getattr(settings, 'BUSINESS_CALENDAR_YEARS_BACK', 2),
+            this_year + getattr(settings, 'BUSINESS_CALENDAR_YEARS_AHEAD', 5),
+        )
+    return _calendar
@@ -0,0 +1,189 @@
+"""
+Idempotency-Key support for money-moving endpoints
+
+A client that sends an Idempotency-Key header gets exactly one execution of
+the view per key: the first request stores its response, and any retry with
+the same key within IDEMPOTENCY_KEY_TTL_HOURS gets that response back without
+the view running again.
+
+The key row is committed on its own before the view runs, so the view keeps
+its own transaction boundaries and no lock is held across payment processor
+or notification work. A concurrent duplicate finds the key in progress and
+waits up to IDEMPOTENCY_WAIT_SECONDS for the first request's response; if the
+first request gave up its key in the meantime, the duplicate runs the view
+itself.
+
+Server errors are stored like any other response: the view may have
+committed part of its work before failing, so running it again for the same
+key could move money twice. A client retrying after a 5xx needs a new key.
+
+A request killed before storing its response (worker timeout, crash) leaves
+its key unfinished. Once the key is older than IDEMPOTENCY_LEASE_SECONDS it
+is answered with a stored "outcome unknown" 500 instead of 409, so the
+client learns that it must check what happened and retry with a new key
+rather than being locked out until the key expires.
+
+Requests are compared by an HMAC of their method, path and body keyed with
+SECRET_KEY, so a stored hash does not reveal the PIN or other fields of the
+body.
+"""
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# How often a duplicate re-reads a key that is still being processed
+POLL_INTERVAL = 0.1
+
+OUTCOME_UNKNOWN = {
+    'error': 'The original request did not finish and its outcome is unknown; '
+             'check your transactions before retrying with a new Idempotency-Key',
+    'outcome': 'unknown',
+}
+
+
+def _request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return salted_hmac(
+        'banking.idempotency', f'{request.method}:{request.path}:{body}', algorithm='sha256'
+    ).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for_response(record):
+    """Re-read an in-progress key until it has a response; None if it was given up or never finished"""
+    deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        current = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if current is None or current.response_status is not None:
+            return current
+    return record
+
+
+def _lease_expired(record):
+    lease = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 120))
+    return record.created_at <= timezone.now() - lease
+
+
+def _abandon(record):
+    """Store the outcome-unknown response on an unfinished key; returns the key as it now stands"""
+    IdempotencyKey.objects.filter(pk=record.pk, response_status__isnull=True).update(
+        response_status=status.HTTP_500_INTERNAL_SERVER_ERROR, response_body=OUTCOME_UNKNOWN
+    )
+    return IdempotencyKey.objects.filter(pk=record.pk).first()
+
+
+def _claim(request, key, request_hash):
+    """
+    Commit the key for this request, or resolve it against an existing one.
+
+    Returns (record, None) when this request should run the view, or
+    (None, response) when it must not.
+    """
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+    # Two passes: an expired or given-up key frees the slot once
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    endpoint=request.path[:200],
+                    request_hash=request_hash,
+                    expires_at=timezone.now() + ttl
+                )
+            return record, None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+
+        if existing is None:
+            continue
+        if existing.is_expired():
+            existing.delete()
+            continue
+        if existing.request_hash != request_hash:
+            return None, Response({
+                'error': f'{IDEMPOTENCY_HEADER} has already been used for a different request'
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if existing.response_status is None and not _lease_expired(existing):
+            existing = _wait_for_response(existing)
+            if existing is None:
+                continue
+        if existing.response_status is None:
+            if not _lease_expired(existing):
+                return None, Response({
+                    'error': f'A request with this {IDEMPOTENCY_HEADER} is still being processed'
+                }, status=status.HTTP_409_CONFLICT)
+            # The request holding the key died without storing its response
+            existing = _abandon(existing)
+            if existing is None:
+                continue
+        return None, _replay(existing)
+
+    return None, Response({
+        'error': f'Could not reserve {IDEMPOTENCY_HEADER}, please retry'
+    }, status=status.HTTP_409_CONFLICT)
+
+
+def idempotent(view):
+    """
+    Make a DRF function view replay its stored response for a repeated Idempotency-Key.
+
+    Apply below @api_view and @permission_classes so request is an
+    authenticated DRF request. Requests without the header run as before.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        if not key or len(key) > 255:
+            return Response({
+                'error': f'{IDEMPOTENCY_HEADER} must be between 1 and 255 characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        record, response = _claim(request, key, _request_hash(request))
+        if response is not None:
+            return response
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            # Whatever the view committed before raising stays; so does the key
+            record.response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            record.response_body = {'error': 'The request failed; retry with a new Idempotency-Key'}
+            record.save(update_fields=['response_status', 'response_body'])
+            raise
+
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys():
+    """Delete keys past their TTL; returns the number removed"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
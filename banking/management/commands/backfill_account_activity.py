@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from banking.models import Transaction, AccountActivity
+from banking.activity import activity_rows, sync_activity_status
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Build AccountActivity rows for existing transactions, streaming them in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Transactions read and activity rows written per round trip',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Delete all activity rows first instead of only filling gaps',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        if options['rebuild']:
+            deleted, _ = AccountActivity.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} activity rows')
+
+        transactions = Transaction.objects.order_by().values(
+            'pk', 'from_account_id', 'to_account_id', 'status', 'created_at', 'updated_at'
+        )
+
+        processed = 0
+        chunk = []
+        for txn in transactions.iterator(chunk_size=chunk_size):
+            chunk.append(txn)
+            if len(chunk) >= chunk_size:
+                self.write_chunk(chunk)
+                processed += len(chunk)
+                chunk = []
+                self.stdout.write(f'  {processed} transactions backfilled...')
+        if chunk:
+            self.write_chunk(chunk)
+            processed += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled activity for {processed} transactions'))
+        logger.info(f'Account activity backfill covered {processed} transactions')
+
+    def write_chunk(self, chunk):
+        rows = [row for txn in chunk for row in activity_rows(txn)]
+        # Rows that already exist are kept; their status is refreshed below
+        AccountActivity.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+        sync_activity_status(txn['pk'] for txn in chunk)
@@ -4,6 +4,11 @@ from django.utils import timezone
 from django.db.models import Q
 from banking.models import Transaction, get_next_business_day
 from banking.external_processors import get_payment_processor, get_compliance_checker
+from banking.posting import (
+    debit_account, credit_account, transfer_between_accounts, post_in_batches, has_postings,
+    InsufficientFundsError
+)
+from banking.workers import due_for_processing, run_worker_pool, format_worker_stats
 from accounts.models import BankAccount
 from datetime import datetime, date
 import logging
@@ -41,6 +46,18 @@ class Command(BaseCommand):
             default=100,
             help='Maximum number of transactions to process in one run',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=0,
+            help='Post due pending transactions in batches of this size with one balance update per batch',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Post due pending transactions with this many parallel worker processes',
+        )
     
     def handle(self, *args, **options):
         dry_run = options['dry_run']
@@ -48,6 +65,8 @@ class Command(BaseCommand):
         complete_only = options['complete_only']
         process_external = options['process_external']
         max_transactions = options['max_transactions']
+        batch_size = options['batch_size']
+        workers = options['workers']
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -55,7 +74,19 @@ class Command(BaseCommand):
             )
         )
         
-        if not complete_only:
+        if not complete_only and workers > 0 and not dry_run:
+            # Step 1: Post due pending transactions with a pool of workers claiming disjoint chunks
+            confirmed_count = self.post_with_workers(workers, max_transactions, batch_size or 200)
+            self.stdout.write(
+                self.style.SUCCESS(f'Confirmed {confirmed_count} transactions')
+            )
+        elif not complete_only and batch_size > 0:
+            # Step 1: Post due pending transactions through the batch engine
+            confirmed_count = self.post_due_transactions(dry_run, max_transactions, batch_size)
+            self.stdout.write(
+                self.style.SUCCESS(f'Confirmed {confirmed_count} transactions')
+            )
+        elif not complete_only:
             # Step 1: Confirm eligible pending transactions
             confirmed_count = self.confirm_eligible_transactions(dry_run, max_transactions)
             self.stdout.write(
@@ -126,6 +157,37 @@ class Command(BaseCommand):
         
         return confirmed_count
     
+    def post_due_transactions(self, dry_run=False, max_count=100, batch_size=500):
+        """Post pending transactions whose confirmation delay has passed, a batch at a time"""
+        due = list(due_for_processing()[:max_count])
+        
+        if dry_run:
+            for transaction in due:
+                self.stdout.write(
+                    self.style.WARNING(f'[DRY RUN] Would confirm {transaction.reference}')
+                )
+            return len(due)
+        
+        posted, failed = post_in_batches(due, batch_size, use_overdraft_limit=True)
+        
+        for transaction in failed:
+            self.stdout.write(
+                self.style.ERROR(
+                    f'Failed to confirm transaction {transaction.reference}: {transaction.failure_reason}'
+                )
+            )
+        
+        return len(posted)
+    
+    def post_with_workers(self, workers, max_count=100, batch_size=200):
+        """Drain due pending transactions with a worker pool, max_count per worker"""
+        stats = run_worker_pool(workers, chunk_size=batch_size, once=True, max_transactions=max_count)
+        
+        for worker_stats in stats:
+            self.stdout.write(format_worker_stats(worker_stats))
+        
+        return sum(worker_stats['posted'] for worker_stats in stats)
+    
     def submit_external_transfers(self, dry_run=False, max_count=100):
         """Submit confirmed external transfers to payment networks"""
         # Find confirmed external transfers that haven't been submitted yet
@@ -218,7 +280,7 @@ class Command(BaseCommand):
         ready_transactions = Transaction.objects.filter(
             status__in=['confirmed', 'processing'],
             expected_completion_date__lte=date.today()
-        ).order_by('confirmed_at')[:max_count]
+        ).annotate(posted=has_postings()).order_by('confirmed_at')[:max_count]
         
         completed_count = 0
         
@@ -240,7 +302,11 @@ class Command(BaseCommand):
                 )
                 
                 if not dry_run:
-                    success = self.process_transaction(transaction)
+                    if transaction.posted:
+                        # The batch engine or a worker already moved the money
+                        success = self.finish_posted_transaction(transaction)
+                    else:
+                        success = self.process_transaction(transaction)
                     if success:
                         completed_count += 1
                     else:
@@ -265,6 +331,15 @@ class Command(BaseCommand):
         
         return completed_count
     
+    def finish_posted_transaction(self, transaction):
+        """Mark a transaction whose postings are already on the ledger as completed"""
+        now = timezone.now()
+        transaction.status = 'completed'
+        transaction.processed_at = transaction.processed_at or now
+        transaction.completed_at = now
+        transaction.save()
+        return True
+    
     def check_external_transfer_completion(self, transaction, dry_run=False):
         """Check if external transfer has completed"""
         transfer_request = transaction.transfer_request
@@ -288,15 +363,25 @@ class Command(BaseCommand):
                         with db_transaction.atomic():
                             # Debit from sender's account (external transfers only debit, no credit locally)
                             from_account = transaction.from_account
-                            if from_account and from_account.can_debit(transaction.total_amount):
-                                from_account.balance -= transaction.total_amount
-                                from_account.save()
-                                
+                            # external_transfer debits the sender when the transfer is submitted
+                            posted = transaction.posted
+                            if from_account and not posted:
+                                try:
+                                    transaction.from_balance_before, transaction.from_balance_after = debit_account(
+                                        from_account, transaction.total_amount, use_overdraft_limit=True,
+                                        contra='external_clearing', fee=transaction.fee,
+                                        transaction_obj=transaction, description=f"External transfer via {processor.name}",
+                                        release_hold=True
+                                    )
+                                    posted = True
+                                except InsufficientFundsError:
+                                    pass
+                            
+                            if posted:
                                 # Update transaction
                                 transaction.status = 'completed'
                                 transaction.processed_at = timezone.now()
                                 transaction.completed_at = timezone.now()
-                                transaction.from_account_balance_after = from_account.balance
                                 transaction.narration = f"External transfer completed via {processor.name}"
                                 transaction.save()
                                 
@@ -396,8 +481,15 @@ class Command(BaseCommand):
             transaction.save()
             return False
         
-        # Check if from_account still has sufficient balance
-        if not from_account.can_debit(amount):
+        # Perform the transfer - the debit only applies if the balance still covers it
+        try:
+            (transaction.from_balance_before, transaction.from_balance_after), \
+                (transaction.to_balance_before, transaction.to_balance_after) = transfer_between_accounts(
+                    from_account, to_account, amount, transaction.amount,  # Don't include fee in credit
+                    use_overdraft_limit=True, transaction_obj=transaction, description=transaction.description,
+                    release_hold=True
+                )
+        except InsufficientFundsError:
             transaction.status = 'failed'
             transaction.save()
             self.stdout.write(
@@ -407,19 +499,10 @@ class Command(BaseCommand):
             )
             return False
         
-        # Perform the transfer
-        from_account.balance -= amount
-        from_account.save()
-        
-        to_account.balance += transaction.amount  # Don't include fee in credit
-        to_account.save()
-        
         # Update transaction
         transaction.status = 'completed'
         transaction.processed_at = timezone.now()
         transaction.completed_at = timezone.now()
-        transaction.from_account_balance_after = from_account.balance
-        transaction.to_account_balance_after = to_account.balance
         transaction.save()
         
         return True
@@ -436,14 +519,14 @@ class Command(BaseCommand):
             return False
         
         # Perform the deposit
-        to_account.balance += amount
-        to_account.save()
+        transaction.to_balance_before, transaction.to_balance_after = credit_account(
+            to_account, amount, transaction_obj=transaction, description=transaction.description
+        )
         
         # Update transaction
         transaction.status = 'completed'
         transaction.processed_at = timezone.now()
         transaction.completed_at = timezone.now()
-        transaction.to_account_balance_after = to_account.balance
         transaction.save()
         
         return True
@@ -459,8 +542,13 @@ class Command(BaseCommand):
             transaction.save()
             return False
         
-        # Check if account still has sufficient balance
-        if not from_account.can_debit(amount):
+        # Perform the withdrawal - the debit only applies if the balance still covers it
+        try:
+            transaction.from_balance_before, transaction.from_balance_after = debit_account(
+                from_account, amount, use_overdraft_limit=True, fee=transaction.fee,
+                transaction_obj=transaction, description=transaction.description, release_hold=True
+            )
+        except InsufficientFundsError:
             transaction.status = 'failed'
             transaction.save()
             self.stdout.write(
@@ -470,15 +558,10 @@ class Command(BaseCommand):
             )
             return False
         
-        # Perform the withdrawal
-        from_account.balance -= amount
-        from_account.save()
-        
         # Update transaction
         transaction.status = 'completed'
         transaction.processed_at = timezone.now()
         transaction.completed_at = timezone.now()
-        transaction.from_account_balance_after = from_account.balance
         transaction.save()
         
         return True 
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from banking.models import Transaction
+from banking.posting import post_transactions_batch
 from datetime import timedelta
 import logging
 
@@ -26,11 +27,18 @@ class Command(BaseCommand):
             default=100,
             help='Maximum number of transactions to process in one run',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=0,
+            help='Post transactions in batches of this size with one balance update per batch (0 = one at a time)',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         force = options['force']
         limit = options['limit']
+        batch_size = options['batch_size']
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -66,6 +74,10 @@ class Command(BaseCommand):
         processed_count = 0
         failed_count = 0
         
+        if batch_size > 0 and not dry_run:
+            processed_count, failed_count = self.process_in_batches(transactions_to_process, batch_size)
+            transactions_to_process = []
+        
         for transaction in transactions_to_process:
             if dry_run:
                 self.stdout.write(
@@ -120,3 +132,35 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.WARNING('DRY RUN completed - no transactions were actually processed')
             )
+    
+    def process_in_batches(self, transactions, batch_size):
+        """Post transactions through the batch engine; returns (processed, failed) counts"""
+        transactions = list(transactions)
+        processed_count = failed_count = 0
+        
+        for start in range(0, len(transactions), batch_size):
+            batch = transactions[start:start + batch_size]
+            try:
+                # Each batch commits on its own, so an error only loses the batch it hit
+                posted, failed = post_transactions_batch(batch)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'✗ Error processing batch: {str(e)}'))
+                logger.error(f'Exception processing transaction batch: {str(e)}')
+                failed_count += len(batch)
+                continue
+            
+            for transaction in failed:
+                self.stdout.write(
+                    self.style.ERROR(
+                        f'✗ Failed: {transaction.reference} - {transaction.failure_reason}'
+                    )
+                )
+                logger.error(f'Failed to process transaction {transaction.reference}: {transaction.failure_reason}')
+            processed_count += len(posted)
+            failed_count += len(failed)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ Processed {processed_count} transactions in batches of {batch_size}')
+        )
+        logger.info(f'Batch processed {processed_count} transactions, {failed_count} failed')
+        return processed_count, failed_count
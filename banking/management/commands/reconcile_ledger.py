@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Sum, Case, When, F, DecimalField, Value
+from django.db.models.functions import Coalesce
+from banking.models import LedgerEntry
+from banking.posting import open_ledger
+from accounts.models import BankAccount
+from decimal import Decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Reconcile BankAccount balances against the append-only ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--open-missing',
+            action='store_true',
+            help='Record opening-balance entries for accounts with no ledger history',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=50,
+            help='Maximum number of discrepancies to print per check',
+        )
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+
+        if options['open_missing']:
+            opened = 0
+            for account in BankAccount.objects.filter(ledger_sequence=0).iterator(chunk_size=500):
+                open_ledger(account)
+                opened += 1
+            self.stdout.write(self.style.SUCCESS(f'Opened ledger for {opened} accounts'))
+
+        mismatched = self.check_account_balances(limit)
+        unbalanced = self.check_balanced_postings(limit)
+
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write('RECONCILIATION SUMMARY:')
+        self.stdout.write(f'Accounts out of balance with ledger: {mismatched}')
+        self.stdout.write(f'Postings whose debits and credits do not net to zero: {unbalanced}')
+
+        if mismatched or unbalanced:
+            self.stdout.write(self.style.ERROR('Ledger reconciliation found discrepancies'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Ledger reconciliation completed - no discrepancies'))
+
+    def check_account_balances(self, limit):
+        """Compare each account balance with the running balance of its latest ledger entry"""
+        # Each lookup is a single descending scan of the (account, sequence) unique index
+        latest_entry = LedgerEntry.objects.filter(
+            account=OuterRef('pk'),
+            ledger_account='customer'
+        ).order_by('-sequence')
+
+        zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=15, decimal_places=2))
+        accounts = BankAccount.objects.annotate(
+            ledger_balance=Coalesce(Subquery(latest_entry.values('balance_after')[:1]), zero)
+        ).exclude(ledger_balance=F('balance')).only('account_number', 'balance', 'ledger_sequence')
+
+        count = 0
+        for account in accounts.iterator(chunk_size=500):
+            count += 1
+            if count <= limit:
+                self.stdout.write(
+                    self.style.ERROR(
+                        f'✗ {account.account_number}: balance {account.balance}, '
+                        f'ledger {account.ledger_balance if account.ledger_sequence else "no entries"}'
+                    )
+                )
+            logger.warning(f'Ledger mismatch for account {account.account_number}')
+        return count
+
+    def check_balanced_postings(self, limit):
+        """Every posting must have equal debit and credit totals"""
+        zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=15, decimal_places=2))
+        postings = LedgerEntry.objects.values('posting_id').annotate(
+            debits=Coalesce(Sum(Case(When(entry_type='debit', then=F('amount')))), zero),
+            credits=Coalesce(Sum(Case(When(entry_type='credit', then=F('amount')))), zero),
+        ).exclude(debits=F('credits'))
+
+        count = 0
+        for posting in postings.iterator(chunk_size=500):
+            count += 1
+            if count <= limit:
+                self.stdout.write(
+                    self.style.ERROR(
+                        f'✗ Posting {posting["posting_id"]}: debits {posting["debits"]}, '
+                        f'credits {posting["credits"]}'
+                    )
+                )
+        return count
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from banking.scheduler import TransactionScheduler
+import signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the transaction scheduler daemon, posting each transaction at its exact due time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Maximum number of due transactions posted in one batch',
+        )
+        parser.add_argument(
+            '--refresh-interval',
+            type=float,
+            default=30.0,
+            help='Seconds between checks for transactions created since the last check',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['refresh_interval'] <= 0:
+            raise CommandError('--batch-size and --refresh-interval must be positive')
+
+        scheduler = TransactionScheduler(
+            batch_size=options['batch_size'],
+            refresh_interval=options['refresh_interval'],
+        )
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        self.stdout.write(self.style.SUCCESS('Starting transaction scheduler (press Ctrl+C to stop)'))
+        scheduler.run(stopping)
+        self.stdout.write(self.style.SUCCESS('Transaction scheduler stopped'))
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+from banking.workers import run_worker_pool, format_worker_stats
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of workers that claim and post due pending transactions in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Number of transactions each worker claims and posts at a time',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when no due transactions are left instead of polling for more',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Seconds an idle worker waits before checking for due transactions again',
+        )
+        parser.add_argument(
+            '--max-transactions',
+            type=int,
+            default=0,
+            help='Stop each worker after this many transactions (0 = no limit)',
+        )
+        parser.add_argument(
+            '--report-interval',
+            type=float,
+            default=60.0,
+            help='Seconds between per-worker throughput log lines',
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be at least 1')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Starting {workers} transaction workers '
+                f'({"until the queue is empty" if options["once"] else "press Ctrl+C to stop"})'
+            )
+        )
+
+        stats = run_worker_pool(
+            workers,
+            chunk_size=chunk_size,
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            max_transactions=options['max_transactions'],
+            report_interval=options['report_interval'],
+        )
+        self.report(stats, workers)
+
+    def report(self, stats, workers):
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write('WORKER SUMMARY:')
+        for worker_stats in stats:
+            self.stdout.write(format_worker_stats(worker_stats))
+            logger.info(format_worker_stats(worker_stats))
+
+        if len(stats) < workers:
+            self.stdout.write(self.style.ERROR(f'{workers - len(stats)} workers exited without reporting'))
+
+        posted = sum(worker_stats['posted'] for worker_stats in stats)
+        failed = sum(worker_stats['failed'] for worker_stats in stats)
+        elapsed = max((worker_stats['elapsed_seconds'] for worker_stats in stats), default=0.0)
+        rate = (posted + failed) / elapsed if elapsed else 0.0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Total posted: {posted}, Failed: {failed} ({rate:.1f} tx/s across all workers)'
+            )
+        )
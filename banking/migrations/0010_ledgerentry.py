@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:02
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_bankaccount_ledger_sequence'),
+        ('banking', '0009_add_transaction_details'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posting_id', models.UUIDField(db_index=True, default=uuid.uuid4)),
+                ('ledger_account', models.CharField(choices=[('customer', 'Customer Account'), ('cash_clearing', 'Cash Clearing'), ('external_clearing', 'External Transfer Clearing'), ('fee_income', 'Fee Income'), ('interest_expense', 'Interest Expense'), ('adjustments', 'Manual Adjustments')], default='customer', max_length=20)),
+                ('entry_type', models.CharField(choices=[('debit', 'Debit'), ('credit', 'Credit')], max_length=6)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('sequence', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('balance_after', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True)),
+                ('description', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(blank=True, help_text="Customer account for 'customer' entries. Null for internal ledger accounts.", null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='accounts.bankaccount')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='banking.transaction')),
+            ],
+            options={
+                'verbose_name': 'Ledger Entry',
+                'verbose_name_plural': 'Ledger Entries',
+                'ordering': ['account', 'sequence'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'sequence'), name='unique_ledger_account_sequence')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0010_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='claimed_by',
+            field=models.CharField(blank=True, help_text='Worker that claimed this transaction for processing', max_length=100),
+        ),
+    ]
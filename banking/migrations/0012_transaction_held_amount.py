@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0011_transaction_worker_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='held_amount',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Funds held on the source account until this transaction posts', max_digits=15),
+        ),
+    ]
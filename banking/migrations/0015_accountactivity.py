@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_identifiersequence'),
+        ('banking', '0014_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('out', 'Money Out'), ('in', 'Money In')], max_length=3)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='accounts.bankaccount')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='banking.transaction')),
+            ],
+            options={
+                'verbose_name': 'Account Activity',
+                'verbose_name_plural': 'Account Activity',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['account', '-created_at', '-transaction'], name='activity_account_created_idx'), models.Index(condition=models.Q(('status', 'pending')), fields=['account', '-created_at'], name='activity_account_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'transaction', 'direction'), name='unique_account_activity')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:36
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_transaction_updated_at(apps, schema_editor):
+    AccountActivity = apps.get_model('banking', 'AccountActivity')
+    Transaction = apps.get_model('banking', 'Transaction')
+    AccountActivity.objects.update(updated_at=Subquery(
+        Transaction.objects.filter(pk=OuterRef('transaction_id')).values('updated_at')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_identifiersequence'),
+        ('banking', '0015_accountactivity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountactivity',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_transaction_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='accountactivity',
+            index=models.Index(fields=['account', 'updated_at', 'transaction'], name='activity_account_updated_idx'),
+        ),
+    ]
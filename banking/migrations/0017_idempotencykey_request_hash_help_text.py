@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0016_accountactivity_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='request_hash',
+            field=models.CharField(help_text='HMAC-SHA256 of the request method, path and body, keyed with SECRET_KEY', max_length=64),
+        ),
+    ]
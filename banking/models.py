@@ -1,12 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from accounts.models import BankAccount
+from accounts.identifiers import allocate_transaction_references, allocate_card_numbers
+from .business_days import get_calendar
 import uuid
 import random
 import string
-import holidays
 from datetime import date, timedelta, datetime
 
 
@@ -15,16 +17,7 @@ def is_business_day(check_date):
     Check if a given date is a business day
     Business days are Monday-Friday, excluding US federal holidays
     """
-    # Check if it's a weekend
-    if check_date.weekday() >= 5:  # Saturday = 5, Sunday = 6
-        return False
-    
-    # Check if it's a US federal holiday
-    us_holidays = holidays.US()
-    if check_date in us_holidays:
-        return False
-    
-    return True
+    return get_calendar().is_business_day(check_date)
 
 
 def get_next_business_day(start_date=None, days_ahead=1):
@@ -33,18 +26,7 @@ def get_next_business_day(start_date=None, days_ahead=1):
     """
     if start_date is None:
         start_date = date.today()
-    
-    current_date = start_date
-    business_days_added = 0
-    
-    while business_days_added < days_ahead:
-        current_date += timedelta(days=1)
-        
-        # Check if this date is a business day
-        if is_business_day(current_date):
-            business_days_added += 1
-    
-    return current_date
+    return get_calendar().add_business_days(start_date, days_ahead)
 
 
 def get_holiday_info(check_date):
@@ -52,28 +34,15 @@ def get_holiday_info(check_date):
     Get holiday information for a specific date
     Returns tuple: (is_holiday, holiday_name)
     """
-    us_holidays = holidays.US()
-    if check_date in us_holidays:
-        return True, us_holidays[check_date]
-    return False, None
+    holiday_name = get_calendar().holiday_name(check_date)
+    return holiday_name is not None, holiday_name
 
 
 def calculate_business_days_between(start_date, end_date):
     """
     Calculate the number of business days between two dates
     """
-    if start_date >= end_date:
-        return 0
-    
-    business_days = 0
-    current_date = start_date
-    
-    while current_date < end_date:
-        current_date += timedelta(days=1)
-        if is_business_day(current_date):
-            business_days += 1
-    
-    return business_days
+    return get_calendar().business_days_between(start_date, end_date)
 
 
 class Transaction(models.Model):
@@ -201,6 +170,11 @@ class Transaction(models.Model):
     confirmation_delay_hours = models.IntegerField(default=1)  # Hours to wait before auto-confirm
     confirmed_at = models.DateTimeField(null=True, blank=True)
     
+    # Worker Claim
+    claimed_by = models.CharField(max_length=100, blank=True,
+                                  help_text="Worker that claimed this transaction for processing")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    
     # Balance Snapshots
     from_balance_before = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True,
                                             help_text="Balance before transaction for source account")
@@ -210,6 +184,8 @@ class Transaction(models.Model):
                                           help_text="Balance before transaction for destination account")
     to_balance_after = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True,
                                          help_text="Balance after transaction for destination account")
+    held_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0.00,
+                                      help_text="Funds held on the source account until this transaction posts")
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -243,17 +219,16 @@ class Transaction(models.Model):
                 days_ahead=days_ahead
             )
         
+        # Funds still held when a transaction ends without posting go back to the account
+        if self.pk and self.held_amount and self.status in ['completed', 'failed', 'cancelled']:
+            from .posting import release_hold
+            release_hold(self)
+        
         super().save(*args, **kwargs)
     
     def generate_reference(self):
-        """Generate a unique transaction reference"""
-        while True:
-            reference = 'TXN' + ''.join(random.choices(
-                string.ascii_uppercase + string.digits, 
-                k=getattr(settings, 'TRANSACTION_REFERENCE_LENGTH', 12)
-            ))
-            if not Transaction.objects.filter(reference=reference).exists():
-                return reference
+        """Allocate a unique transaction reference from this process's reserved block"""
+        return allocate_transaction_references()[0]
     
     def get_primary_account(self):
         """Get the primary account affected by this transaction"""
@@ -270,7 +245,7 @@ class Transaction(models.Model):
         """Check if this is a withdrawal or transfer transaction"""
         return self.transaction_type in ['withdrawal', 'transfer']
     
-    def can_be_processed(self):
+    def can_be_processed(self, now=None):
         """Check if transaction can be processed now"""
         if self.status != 'pending':
             return False
@@ -278,7 +253,7 @@ class Transaction(models.Model):
         # For auto-confirm transactions, check delay
         if self.auto_confirm:
             confirm_time = self.created_at + timedelta(hours=self.confirmation_delay_hours)
-            return timezone.now() >= confirm_time
+            return (now or timezone.now()) >= confirm_time
         
         return True  # Manual transactions can be processed anytime
     
@@ -287,101 +262,48 @@ class Transaction(models.Model):
         if not self.can_be_processed():
             return False
         
+        from django.db import transaction as db_transaction
+        from .posting import has_postings, post_transaction
+        
         try:
-            from decimal import Decimal
-            
-            # Update status to processing
-            self.status = 'processing'
-            self.processed_at = timezone.now()
-            self.confirmed_at = timezone.now()
-            
-            # Capture balances before transaction
-            if self.from_account:
-                self.from_balance_before = self.from_account.balance
-            if self.to_account:
-                self.to_balance_before = self.to_account.balance
-            
-            # Execute balance changes based on transaction type
-            total_amount = self.total_amount or (self.amount + (self.fee or Decimal('0')))
-            
-            if self.transaction_type == 'deposit' and self.to_account:
-                # Credit the destination account
-                self.to_account.balance += self.amount
-                self.to_account.save()
-                self.to_balance_after = self.to_account.balance
+            with db_transaction.atomic():
+                # Claim the row with a compare-and-swap so overlapping runs never post it twice;
+                # rows debited when they were submitted are not posted again either
+                claimed = Transaction.objects.filter(pk=self.pk, status='pending').filter(
+                    ~has_postings()
+                ).update(status='processing')
+                if not claimed:
+                    return False
+                
+                # Update status to processing
+                self.status = 'processing'
+                self.processed_at = timezone.now()
+                self.confirmed_at = timezone.now()
                 
-            elif self.transaction_type in ['withdrawal', 'fee', 'charge'] and self.from_account:
-                # Debit the source account
-                if self.from_account.balance >= total_amount:
-                    self.from_account.balance -= total_amount
-                    self.from_account.save()
-                    self.from_balance_after = self.from_account.balance
+                # Execute balance changes based on transaction type. Every leg is a
+                # single conditional UPDATE that returns the balance it produced.
+                post_transaction(self)
+                
+                # Set final status based on transaction type
+                if self.transaction_type == 'transfer':
+                    # Transfers should remain in processing status until confirmed by external network
+                    self.status = 'processing'
                 else:
-                    raise ValueError("Insufficient funds")
-                    
-            elif self.transaction_type == 'transfer':
-                # Handle transfer between accounts
-                if self.from_account and self.to_account:
-                    # Internal transfer
-                    if self.from_account.balance >= total_amount:
-                        self.from_account.balance -= total_amount
-                        self.to_account.balance += self.amount  # Only transfer amount, not fees
-                        self.from_account.save()
-                        self.to_account.save()
-                        self.from_balance_after = self.from_account.balance
-                        self.to_balance_after = self.to_account.balance
-                    else:
-                        raise ValueError("Insufficient funds")
-                elif self.from_account:
-                    # External transfer - only debit source account
-                    if self.from_account.balance >= total_amount:
-                        self.from_account.balance -= total_amount
-                        self.from_account.save()
-                        self.from_balance_after = self.from_account.balance
-                    else:
-                        raise ValueError("Insufficient funds")
-                        
-            elif self.transaction_type == 'interest' and self.to_account:
-                # Credit interest to account
-                self.to_account.balance += self.amount
-                self.to_account.save()
-                self.to_balance_after = self.to_account.balance
+                    # Other transaction types (deposits, withdrawals) are completed immediately
+                    self.status = 'completed'
+                    self.completed_at = timezone.now()
                 
-            elif self.transaction_type == 'reversal':
-                # Reverse the original transaction
-                if self.from_account and self.to_account:
-                    # Reverse transfer
-                    self.from_account.balance += self.amount
-                    self.to_account.balance -= self.amount
-                    self.from_account.save()
-                    self.to_account.save()
-                    self.from_balance_after = self.from_account.balance
-                    self.to_balance_after = self.to_account.balance
-                elif self.from_account:
-                    # Reverse withdrawal/charge
-                    self.from_account.balance += total_amount
-                    self.from_account.save()
-                    self.from_balance_after = self.from_account.balance
-                elif self.to_account:
-                    # Reverse deposit
-                    self.to_account.balance -= self.amount
-                    self.to_account.save()
-                    self.to_balance_after = self.to_account.balance
-            
-            # Set final status based on transaction type
-            if self.transaction_type == 'transfer':
-                # Transfers should remain in processing status until confirmed by external network
-                self.status = 'processing'
-            else:
-                # Other transaction types (deposits, withdrawals) are completed immediately
-                self.status = 'completed'
-                self.completed_at = timezone.now()
-            
-            self.save()
+                self.save()
             
             return True
             
         except Exception as e:
+            # Nothing was posted, so make sure fail_transaction has no funds to restore
+            # and still sees any hold the rolled-back posting had claimed
+            self.status = 'pending'
+            self.from_balance_before = self.from_balance_after = None
+            self.to_balance_before = self.to_balance_after = None
+            self.refresh_from_db(fields=['held_amount'])
             self.fail_transaction(str(e))
             return False
     
@@ -391,30 +313,37 @@ class Transaction(models.Model):
             return False
         
         from decimal import Decimal
+        from django.db import transaction as db_transaction
+        from .posting import credit_account, debit_account, reverse_postings
         
-        # Restore funds based on transaction type if they were already deducted
-        if self.status in ['processing'] and self.from_balance_before is not None:
-            total_amount = self.total_amount or (self.amount + (self.fee or Decimal('0')))
+        with db_transaction.atomic():
+            # Restore funds by reversing whatever this transaction posted to the ledger.
+            # Restores are compensating postings, never overwrites of the old snapshot,
+            # so postings made to the same accounts in the meantime are preserved.
+            description = f'Reversal: {reason}' if reason else 'Reversal'
+            restored = reverse_postings(self, description=description)
             
-            if self.transaction_type in ['withdrawal', 'transfer', 'fee', 'charge'] and self.from_account:
-                # Restore funds to source account
-                self.from_account.balance = self.from_balance_before
-                self.from_account.save()
-                
-            if self.transaction_type == 'transfer' and self.to_account and self.to_balance_before is not None:
-                # Restore destination account balance for internal transfers
-                self.to_account.balance = self.to_balance_before
-                self.to_account.save()
+            if not restored and self.status in ['processing'] and self.from_balance_before is not None:
+                # Posted before the ledger existed - compensate from the transaction amounts
+                total_amount = self.total_amount or (self.amount + (self.fee or Decimal('0')))
+                ledger = {'transaction_obj': self, 'contra': 'adjustments', 'description': description}
                 
-            elif self.transaction_type == 'deposit' and self.to_account and self.to_balance_before is not None:
-                # Remove provisional credit from destination account
-                self.to_account.balance = self.to_balance_before
-                self.to_account.save()
-        
-        self.status = 'failed'
-        self.failure_reason = reason
-        self.failed_at = timezone.now()
-        self.save()
+                if self.transaction_type in ['withdrawal', 'transfer', 'fee', 'charge'] and self.from_account:
+                    # Restore funds to source account
+                    credit_account(self.from_account, total_amount, **ledger)
+                    
+                if self.transaction_type == 'transfer' and self.to_account and self.to_balance_before is not None:
+                    # Take back the credit made to the destination account for internal transfers
+                    debit_account(self.to_account, self.amount, allow_overdraft=True, **ledger)
+                    
+                elif self.transaction_type == 'deposit' and self.to_account and self.to_balance_before is not None:
+                    # Remove provisional credit from destination account
+                    debit_account(self.to_account, self.amount, allow_overdraft=True, **ledger)
+            
+            self.status = 'failed'
+            self.failure_reason = reason
+            self.failed_at = timezone.now()
+            self.save()
         
         return True
     
@@ -489,6 +418,12 @@ class Transaction(models.Model):
             
         return details
     
+    def calculate_business_days_remaining(self):
+        """Business days left until the expected completion date"""
+        if not self.expected_completion_date or self.status in ['completed', 'failed', 'cancelled']:
+            return 0
+        return calculate_business_days_between(date.today(), self.expected_completion_date)
+    
     def get_estimated_completion_message(self):
         """Get user-friendly completion message with business day awareness"""
         if self.status == 'completed':
@@ -525,6 +460,140 @@ class Transaction(models.Model):
         ordering = ['-created_at']
         verbose_name = "Transaction"
         verbose_name_plural = "Transactions"
+        indexes = [
+            # Account history, newest first: each side of the from/to OR in listings
+            models.Index(fields=['from_account', '-created_at'], name='txn_from_account_created_idx'),
+            models.Index(fields=['to_account', '-created_at'], name='txn_to_account_created_idx'),
+            # Pending debits against an account
+            models.Index(fields=['from_account', 'status'], name='txn_from_account_status_idx'),
+            # Admin changelist and admin pending list sort
+            models.Index(fields=['-created_at'], name='txn_created_idx'),
+            # Completion step of process_pending_transactions
+            models.Index(fields=['status', 'expected_completion_date'], name='txn_status_completion_idx'),
+            # Scheduler and worker queue: only pending rows are ever read through it
+            models.Index(
+                fields=['auto_confirm', 'created_at'], name='txn_pending_queue_idx',
+                condition=models.Q(status='pending')
+            ),
+            # Stale worker claims
+            models.Index(
+                fields=['claimed_at'], name='txn_processing_claim_idx',
+                condition=models.Q(status='processing')
+            ),
+        ]
+
+
+class LedgerEntry(models.Model):
+    """Append-only double-entry ledger line behind BankAccount balances"""
+    ENTRY_TYPES = [
+        ('debit', 'Debit'),
+        ('credit', 'Credit'),
+    ]
+    
+    LEDGER_ACCOUNTS = [
+        ('customer', 'Customer Account'),
+        ('cash_clearing', 'Cash Clearing'),
+        ('external_clearing', 'External Transfer Clearing'),
+        ('fee_income', 'Fee Income'),
+        ('interest_expense', 'Interest Expense'),
+        ('adjustments', 'Manual Adjustments'),
+    ]
+    
+    # Every leg of one posting shares a posting_id; its debits and credits always net to zero
+    posting_id = models.UUIDField(default=uuid.uuid4, db_index=True)
+    ledger_account = models.CharField(max_length=20, choices=LEDGER_ACCOUNTS, default='customer')
+    account = models.ForeignKey(
+        BankAccount,
+        on_delete=models.PROTECT,
+        related_name='ledger_entries',
+        null=True,
+        blank=True,
+        help_text="Customer account for 'customer' entries. Null for internal ledger accounts."
+    )
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.SET_NULL,
+        related_name='ledger_entries',
+        null=True,
+        blank=True
+    )
+    
+    entry_type = models.CharField(max_length=6, choices=ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    
+    # Per-account ordering and running balance (customer entries only)
+    sequence = models.PositiveBigIntegerField(null=True, blank=True)
+    balance_after = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    
+    description = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only and cannot be modified")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only and cannot be deleted")
+    
+    @property
+    def signed_amount(self):
+        """Amount as it affects the customer balance (credits positive)"""
+        return self.amount if self.entry_type == 'credit' else -self.amount
+    
+    def __str__(self):
+        target = self.account.account_number if self.account else self.get_ledger_account_display()
+        return f"{self.entry_type.title()} {target} - {self.amount}"
+    
+    class Meta:
+        ordering = ['account', 'sequence']
+        verbose_name = "Ledger Entry"
+        verbose_name_plural = "Ledger Entries"
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_ledger_account_sequence'),
+        ]
+
+
+class AccountActivity(models.Model):
+    """
+    One row per account a transaction touches, maintained by banking.activity
+
+    Account-centric reads (histories, recent and pending lists) range-scan
+    this table by account instead of OR-ing from_account and to_account.
+    """
+    DIRECTIONS = [
+        ('out', 'Money Out'),
+        ('in', 'Money In'),
+    ]
+    
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='activity')
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='activity')
+    direction = models.CharField(max_length=3, choices=DIRECTIONS)
+    
+    # Copied from the transaction so lists filter and sort without joining it
+    status = models.CharField(max_length=20, choices=Transaction.TRANSACTION_STATUS)
+    created_at = models.DateTimeField()
+    # When the transaction last changed, for delta sync
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.account.account_number} {self.direction} {self.transaction.reference}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Account Activity"
+        verbose_name_plural = "Account Activity"
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'transaction', 'direction'], name='unique_account_activity'),
+        ]
+        indexes = [
+            models.Index(fields=['account', '-created_at', '-transaction'], name='activity_account_created_idx'),
+            models.Index(
+                fields=['account', '-created_at'], name='activity_account_pending_idx',
+                condition=models.Q(status='pending')
+            ),
+            models.Index(fields=['account', 'updated_at', 'transaction'], name='activity_account_updated_idx'),
+        ]
 
 
 class TransferRequest(models.Model):
@@ -854,11 +923,8 @@ class Card(models.Model):
         super().save(*args, **kwargs)
     
     def generate_card_number(self):
-        """Generate a unique 16-digit card number"""
-        while True:
-            card_number = ''.join(random.choices(string.digits, k=16))
-            if not Card.objects.filter(card_number=card_number).exists():
-                return card_number
+        """Allocate a unique 16-digit card number with the brand's issuer prefix and a Luhn check digit"""
+        return allocate_card_numbers(card_brand=self.card_brand)[0]
     
     def is_expired(self):
         """Check if card is expired"""
@@ -1025,3 +1091,33 @@ class TransactionLimit(models.Model):
         unique_together = ['account_type', 'customer_tier', 'limit_type', 'transaction_category']
         verbose_name = "Transaction Limit"
         verbose_name_plural = "Transaction Limits"
+
+
+class IdempotencyKey(models.Model):
+    """Stored response for a money-moving request, replayed when its Idempotency-Key is retried"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=200)
+    request_hash = models.CharField(max_length=64, help_text="HMAC-SHA256 of the request method, path and body, keyed with SECRET_KEY")
+    
+    # Response (null until the first request has finished)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.endpoint} - {self.key}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
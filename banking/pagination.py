@@ -0,0 +1,118 @@
+"""
+Keyset pagination for transaction feeds
+
+A feed is a set of branch querysets. Each branch is an index range scan, for
+example one account's rows in AccountActivity. A page reads at most
+page_size + 1 (created_at, id) keys from each branch past the cursor. It
+merges them newest first and drops duplicates, such as a transfer between two
+of the user's own accounts. The page's objects are then loaded by primary key
+from the view's queryset, or by the view's get_feed_objects() if it has one. The cursor holds the (created_at, id) of the last
+row served, so page 100 costs the same as page 1.
+"""
+import base64
+import heapq
+import uuid
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(created_at, pk):
+    position = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(cursor)
+        return created_at, uuid.UUID(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+class TransactionCursorPagination(BasePagination):
+    """
+    Newest-first keyset pagination on (created_at, id).
+
+    Views supply their branches through get_feed_branches(), naming the
+    column that holds the object's id in feed_id_field. Otherwise the view's
+    queryset is paginated as a single branch.
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if hasattr(view, 'get_feed_branches'):
+            branches, id_field = view.get_feed_branches(), getattr(view, 'feed_id_field', 'pk')
+        else:
+            branches, id_field = [queryset], 'pk'
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            after = Q(created_at__lt=created_at) | Q(created_at=created_at, **{f'{id_field}__lt': pk})
+            branches = [branch.filter(after) for branch in branches]
+
+        keys = [
+            list(branch.order_by('-created_at', f'-{id_field}').values_list('created_at', id_field)[:page_size + 1])
+            for branch in branches
+        ]
+        page, seen = [], set()
+        for key in heapq.merge(*keys, reverse=True):
+            if key[1] in seen:
+                continue
+            seen.add(key[1])
+            page.append(key)
+            if len(page) > page_size:
+                break
+
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        # Loading through the view's queryset keeps its scoping and select_related
+        ids = [pk for _, pk in self.page]
+        if hasattr(view, 'get_feed_objects'):
+            return view.get_feed_objects(queryset, ids)
+        objects = {obj.pk: obj for obj in queryset.filter(pk__in=ids)} if ids else {}
+        return [objects[pk] for pk in ids if pk in objects]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        created_at, pk = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(created_at, pk))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,776 @@
+"""
+Balance posting engine
+
+All balance movements go through conditional, single-statement UPDATEs on the
+affected BankAccount rows instead of reading the balance in Python and saving
+the whole row. Each leg touches its row exactly once and hands back the new
+balance from the same round trip (UPDATE ... RETURNING where supported).
+
+Every posting is also written to the append-only LedgerEntry table as a
+balanced set of debit and credit lines. Customer lines carry the account's
+next ledger sequence number and running balance, allocated by the same
+UPDATE that moved the money, so the hot path is one UPDATE per account leg
+plus one multi-row INSERT.
+
+Funds promised to a pending debit are reserved as a hold: hold_balance goes
+up and available_balance down in one conditional UPDATE, so checking what a
+customer can spend is a column read rather than a Sum over their pending
+transactions. A hold is consumed by the posting that moves the money, or
+released when the transaction ends without posting.
+"""
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Case, When, Value, DecimalField, Exists, OuterRef, PositiveBigIntegerField
+from django.utils import timezone
+
+from accounts.dashboard_cache import invalidate_dashboards
+from accounts.models import BankAccount
+
+
+# One balance movement on a customer account. side names the balance snapshot
+# ('from' or 'to') on the Transaction that the leg fills in.
+PostingLeg = namedtuple('PostingLeg', ['account', 'side', 'entry_type', 'amount', 'require_funds'])
+
+# The internal ledger line(s) that balance the customer legs of a posting
+ContraLine = namedtuple('ContraLine', ['ledger_account', 'entry_type', 'amount'])
+
+
+class InsufficientFundsError(ValueError):
+    """Raised when a conditional debit finds the balance too low"""
+
+    def __init__(self, message="Insufficient funds"):
+        super().__init__(message)
+
+
+def _supports_update_returning():
+    """Check if the database can return columns from an UPDATE statement"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        # SQLite gained RETURNING in 3.35, same as INSERT ... RETURNING
+        return connection.features.can_return_columns_from_insert
+    return False
+
+
+def _to_decimal(value):
+    """Normalise a raw database value into a 2dp Decimal"""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(Decimal('0.01'))
+
+
+def _apply_delta(account, delta, require_funds=False, use_overdraft_limit=False, release=Decimal('0')):
+    """
+    Apply a signed delta to one account row in a single statement.
+
+    When require_funds is set the UPDATE only matches if the available balance
+    covers the debit, so concurrent postings can never overdraw the account
+    or spend funds held for someone else. With use_overdraft_limit the check
+    mirrors BankAccount.can_debit instead. release is a hold being consumed
+    by this posting: it leaves hold_balance and counts towards the funds.
+    Returns (balance_before, balance_after, ledger_sequence) for the row.
+    """
+    delta = _to_decimal(delta)
+    release = _to_decimal(release)
+    qn = connection.ops.quote_name
+    pk_field = BankAccount._meta.pk
+    balance_field = BankAccount._meta.get_field('balance')
+    table = qn(BankAccount._meta.db_table)
+    now = timezone.now()
+
+    sql = (
+        f"UPDATE {table} SET "
+        f"{qn('balance')} = {qn('balance')} + %s, "
+        f"{qn('available_balance')} = {qn('available_balance')} + %s, "
+        f"{qn('hold_balance')} = {qn('hold_balance')} - %s, "
+        f"{qn('ledger_sequence')} = {qn('ledger_sequence')} + 1, "
+        f"{qn('updated_at')} = %s, "
+        f"{qn('last_transaction_date')} = %s "
+        f"WHERE {qn(pk_field.column)} = %s"
+    )
+    db_delta = balance_field.get_db_prep_save(delta, connection)
+    db_now = BankAccount._meta.get_field('updated_at').get_db_prep_save(now, connection)
+    db_release = balance_field.get_db_prep_save(release, connection)
+    params = [
+        db_delta, balance_field.get_db_prep_save(delta + release, connection), db_release,
+        db_now, db_now, pk_field.get_db_prep_value(account.pk, connection)
+    ]
+
+    if require_funds and delta < 0:
+        # Keep the parameters on the right-hand side as arithmetic so SQLite
+        # compares numbers rather than numbers against text
+        if use_overdraft_limit:
+            sql += f" AND {qn('available_balance')} + {qn('overdraft_limit')} >= %s - %s"
+        else:
+            sql += f" AND {qn('available_balance')} >= %s - %s"
+        params += [balance_field.get_db_prep_save(-delta, connection), db_release]
+
+    returning = f"{qn('balance')}, {qn('available_balance')}, {qn('hold_balance')}, {qn('ledger_sequence')}"
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if _supports_update_returning():
+                cursor.execute(f"{sql} RETURNING {returning}", params)
+                row = cursor.fetchone()
+            else:
+                cursor.execute(sql, params)
+                row = None
+                if cursor.rowcount:
+                    # The UPDATE above holds the row lock, so this read is consistent
+                    cursor.execute(
+                        f"SELECT {returning} FROM {table} WHERE {qn(pk_field.column)} = %s",
+                        [pk_field.get_db_prep_value(account.pk, connection)]
+                    )
+                    row = cursor.fetchone()
+
+    if row is None:
+        if require_funds and delta < 0:
+            raise InsufficientFundsError()
+        raise BankAccount.DoesNotExist(f"Bank account {account.pk} not found")
+
+    invalidate_dashboards([account.user_id])
+    balance_after = _to_decimal(row[0])
+    account.balance = balance_after
+    account.available_balance = _to_decimal(row[1])
+    account.hold_balance = _to_decimal(row[2])
+    account.ledger_sequence = row[3]
+    account.updated_at = now
+    account.last_transaction_date = now
+    return balance_after - delta, balance_after, row[3]
+
+
+def _move_hold(account, amount, require_funds=False, use_overdraft_limit=False):
+    """
+    Move amount from available_balance into hold_balance (negative to release).
+
+    With require_funds the UPDATE only matches if the available balance covers
+    the hold. Returns whether the row was updated.
+    """
+    accounts = BankAccount.objects.filter(pk=account.pk)
+    if require_funds:
+        if use_overdraft_limit:
+            accounts = accounts.filter(available_balance__gte=Value(amount) - F('overdraft_limit'))
+        else:
+            accounts = accounts.filter(available_balance__gte=amount)
+    updated = accounts.update(
+        hold_balance=F('hold_balance') + amount,
+        available_balance=F('available_balance') - amount,
+        updated_at=timezone.now()
+    )
+    if updated:
+        account.hold_balance += amount
+        account.available_balance -= amount
+        invalidate_dashboards([account.user_id])
+    return bool(updated)
+
+
+def place_hold(transaction_obj, amount=None, use_overdraft_limit=False):
+    """
+    Reserve funds on a transaction's source account until it is posted.
+
+    Defaults to the transaction's total amount. Raises InsufficientFundsError
+    if the available balance does not cover it; nothing is reserved then.
+    """
+    from .models import Transaction
+    amount = _to_decimal(transaction_obj.total_amount if amount is None else amount)
+    with transaction.atomic():
+        if not _move_hold(transaction_obj.from_account, amount, require_funds=True,
+                          use_overdraft_limit=use_overdraft_limit):
+            raise InsufficientFundsError()
+        Transaction.objects.filter(pk=transaction_obj.pk).update(held_amount=F('held_amount') + amount)
+    transaction_obj.held_amount = (transaction_obj.held_amount or Decimal('0')) + amount
+    return amount
+
+
+def _take_hold(transaction_obj):
+    """Claim a transaction's hold so exactly one caller consumes or releases it"""
+    from .models import Transaction
+    if not transaction_obj.held_amount:
+        return Decimal('0')
+    with transaction.atomic():
+        held = Transaction.objects.select_for_update().filter(
+            pk=transaction_obj.pk
+        ).values_list('held_amount', flat=True).first()
+        if held:
+            Transaction.objects.filter(pk=transaction_obj.pk).update(held_amount=Decimal('0'))
+    transaction_obj.held_amount = Decimal('0')
+    return _to_decimal(held or 0)
+
+
+def release_hold(transaction_obj):
+    """Give a transaction's held funds back to its source account; returns the amount"""
+    with transaction.atomic():
+        held = _take_hold(transaction_obj)
+        if held:
+            _move_hold(transaction_obj.from_account, -held)
+    return held
+
+
+def _customer_entry(posting_id, account, entry_type, amount, sequence, balance_after,
+                    transaction_obj, description):
+    from .models import LedgerEntry
+    return LedgerEntry(
+        posting_id=posting_id,
+        ledger_account='customer',
+        account=account,
+        transaction=transaction_obj,
+        entry_type=entry_type,
+        amount=amount,
+        sequence=sequence,
+        balance_after=balance_after,
+        description=description[:200]
+    )
+
+
+def _contra_entries(posting_id, entry_type, amount, contra, fee, transaction_obj, description):
+    """Build the internal ledger lines that balance a customer leg"""
+    from .models import LedgerEntry
+    fee = _to_decimal(fee or 0)
+    lines = [(contra, amount - fee), ('fee_income', fee)]
+    return [
+        LedgerEntry(
+            posting_id=posting_id,
+            ledger_account=ledger_account,
+            transaction=transaction_obj,
+            entry_type=entry_type,
+            amount=line_amount,
+            description=description[:200]
+        )
+        for ledger_account, line_amount in lines
+        if line_amount > 0
+    ]
+
+
+def _record(entries):
+    from .models import LedgerEntry
+    LedgerEntry.objects.bulk_create(entries)
+
+
+def debit_account(account, amount, allow_overdraft=False, use_overdraft_limit=False,
+                  contra='cash_clearing', fee=None, transaction_obj=None, description='',
+                  release_hold=False):
+    """
+    Debit an account and return its (balance_before, balance_after).
+
+    The balancing credit goes to the contra ledger account, with any fee
+    portion of the amount split out to fee income. With release_hold the
+    funds held for transaction_obj are consumed by this debit.
+    """
+    amount = _to_decimal(amount)
+    posting_id = uuid.uuid4()
+    with transaction.atomic():
+        release = _take_hold(transaction_obj) if release_hold and transaction_obj else Decimal('0')
+        before, after, sequence = _apply_delta(
+            account, -amount,
+            require_funds=not allow_overdraft,
+            use_overdraft_limit=use_overdraft_limit,
+            release=release
+        )
+        _record(
+            [_customer_entry(posting_id, account, 'debit', amount, sequence, after, transaction_obj, description)]
+            + _contra_entries(posting_id, 'credit', amount, contra, fee, transaction_obj, description)
+        )
+    return before, after
+
+
+def credit_account(account, amount, contra='cash_clearing', transaction_obj=None, description=''):
+    """Credit an account and return its (balance_before, balance_after)"""
+    amount = _to_decimal(amount)
+    posting_id = uuid.uuid4()
+    with transaction.atomic():
+        before, after, sequence = _apply_delta(account, amount)
+        _record(
+            [_customer_entry(posting_id, account, 'credit', amount, sequence, after, transaction_obj, description)]
+            + _contra_entries(posting_id, 'debit', amount, contra, None, transaction_obj, description)
+        )
+    return before, after
+
+
+def adjust_balance(account, delta, transaction_obj=None, description='Manual balance adjustment'):
+    """Post a signed manual adjustment against the adjustments ledger account"""
+    delta = _to_decimal(delta)
+    if delta >= 0:
+        return credit_account(account, delta, contra='adjustments',
+                              transaction_obj=transaction_obj, description=description)
+    return debit_account(account, -delta, allow_overdraft=True, contra='adjustments',
+                         transaction_obj=transaction_obj, description=description)
+
+
+def transfer_between_accounts(from_account, to_account, debit_amount, credit_amount=None,
+                              use_overdraft_limit=False, transaction_obj=None, description='',
+                              release_hold=False):
+    """
+    Debit one account and credit another atomically.
+
+    Rows are updated in primary key order so two opposite transfers between
+    the same pair of accounts cannot deadlock. Any difference between the
+    debit and credit amounts is booked as fee income. Returns a pair of
+    (balance_before, balance_after) tuples for the source and destination.
+    """
+    debit_amount = _to_decimal(debit_amount)
+    credit_amount = debit_amount if credit_amount is None else _to_decimal(credit_amount)
+    posting_id = uuid.uuid4()
+    release = Decimal('0')
+
+    legs = [
+        (from_account, 'debit', debit_amount, lambda: _apply_delta(
+            from_account, -debit_amount, require_funds=True, use_overdraft_limit=use_overdraft_limit,
+            release=release
+        )),
+        (to_account, 'credit', credit_amount, lambda: _apply_delta(to_account, credit_amount)),
+    ]
+    legs.sort(key=lambda leg: str(leg[0].pk))
+
+    results = {}
+    entries = []
+    with transaction.atomic():
+        if release_hold and transaction_obj:
+            release = _take_hold(transaction_obj)
+        for account, entry_type, amount, post in legs:
+            before, after, sequence = post()
+            results[id(account)] = (before, after)
+            entries.append(_customer_entry(
+                posting_id, account, entry_type, amount, sequence, after, transaction_obj, description
+            ))
+        entries += _contra_entries(
+            posting_id, 'credit', debit_amount - credit_amount, 'fee_income', None,
+            transaction_obj, description
+        )
+        _record(entries)
+
+    return results[id(from_account)], results[id(to_account)]
+
+
+def open_ledger(account, description='Opening balance'):
+    """
+    Record an opening-balance entry for an account with no ledger history.
+
+    The balance itself is not changed; the entry anchors the running balance
+    for accounts that were funded before the ledger existed.
+    """
+    posting_id = uuid.uuid4()
+    with transaction.atomic():
+        _, balance, sequence = _apply_delta(account, Decimal('0'))
+        entry_type = 'credit' if balance >= 0 else 'debit'
+        amount = abs(balance)
+        _record(
+            [_customer_entry(posting_id, account, entry_type, amount, sequence, balance, None, description)]
+            + _contra_entries(posting_id, 'debit' if entry_type == 'credit' else 'credit',
+                              amount, 'adjustments', None, None, description)
+        )
+    return balance
+
+
+def reverse_postings(transaction_obj, description='Reversal'):
+    """
+    Post the mirror image of every ledger line recorded for a transaction.
+
+    Customer accounts are moved back by their net amount in one UPDATE each
+    (overdraft allowed, since the original credit may already be spent) and
+    every internal line is mirrored, so the reversal is itself a balanced
+    posting. Returns the number of customer accounts that were adjusted.
+    """
+    from .models import LedgerEntry
+
+    entries = list(
+        LedgerEntry.objects.filter(transaction=transaction_obj).select_related('account').order_by('id')
+    )
+    if not entries:
+        return 0
+
+    net_by_account = {}
+    accounts = {}
+    contra_lines = []
+    for entry in entries:
+        if entry.ledger_account == 'customer':
+            accounts[entry.account_id] = entry.account
+            net_by_account[entry.account_id] = net_by_account.get(entry.account_id, Decimal('0')) + entry.signed_amount
+        else:
+            contra_lines.append(entry)
+
+    posting_id = uuid.uuid4()
+    reversal = []
+    opposite = {'debit': 'credit', 'credit': 'debit'}
+    with transaction.atomic():
+        for account_id in sorted(net_by_account, key=str):
+            net = net_by_account[account_id]
+            if not net:
+                continue
+            account = accounts[account_id]
+            _, after, sequence = _apply_delta(account, -net)
+            reversal.append(_customer_entry(
+                posting_id, account, 'debit' if net > 0 else 'credit', abs(net),
+                sequence, after, transaction_obj, description
+            ))
+        for entry in contra_lines:
+            reversal.append(LedgerEntry(
+                posting_id=posting_id,
+                ledger_account=entry.ledger_account,
+                transaction=transaction_obj,
+                entry_type=opposite[entry.entry_type],
+                amount=entry.amount,
+                description=description[:200]
+            ))
+        _record(reversal)
+
+    return len([line for line in reversal if line.ledger_account == 'customer'])
+
+
+def has_postings():
+    """
+    Whether a transaction row has already moved money, as an Exists() expression.
+
+    Views such as external_transfer debit the customer up front and leave the
+    row pending, and the batch engine leaves posted transfers in 'processing';
+    filtering on this keeps later steps from posting those rows again.
+    """
+    from .models import LedgerEntry
+    return Exists(LedgerEntry.objects.filter(transaction=OuterRef('pk'), ledger_account='customer'))
+
+
+def plan_transaction(txn):
+    """
+    Describe the ledger legs a Transaction posts when it is processed.
+
+    Returns (legs, contra_lines). This is the single definition of how each
+    transaction type moves money; post_transaction and the batch engine both
+    execute it.
+    """
+    total_amount = _to_decimal(txn.total_amount or (txn.amount + (txn.fee or Decimal('0'))))
+    amount = _to_decimal(txn.amount)
+    fee = _to_decimal(txn.fee or 0)
+    from_account, to_account = txn.from_account, txn.to_account
+
+    if txn.transaction_type == 'deposit' and to_account:
+        # Credit the destination account
+        return [PostingLeg(to_account, 'to', 'credit', amount, False)], \
+            [ContraLine('cash_clearing', 'debit', amount)]
+
+    if txn.transaction_type == 'withdrawal' and from_account:
+        # Debit the source account
+        return [PostingLeg(from_account, 'from', 'debit', total_amount, True)], \
+            [ContraLine('cash_clearing', 'credit', total_amount - fee), ContraLine('fee_income', 'credit', fee)]
+
+    if txn.transaction_type in ['fee', 'charge'] and from_account:
+        # Debit the source account into fee income
+        return [PostingLeg(from_account, 'from', 'debit', total_amount, True)], \
+            [ContraLine('fee_income', 'credit', total_amount)]
+
+    if txn.transaction_type == 'transfer' and from_account:
+        if to_account:
+            # Internal transfer - only transfer amount is credited, not fees
+            return [
+                PostingLeg(from_account, 'from', 'debit', total_amount, True),
+                PostingLeg(to_account, 'to', 'credit', amount, False),
+            ], [ContraLine('fee_income', 'credit', total_amount - amount)]
+        # External transfer - only debit source account
+        return [PostingLeg(from_account, 'from', 'debit', total_amount, True)], \
+            [ContraLine('external_clearing', 'credit', total_amount - fee), ContraLine('fee_income', 'credit', fee)]
+
+    if txn.transaction_type == 'interest' and to_account:
+        # Credit interest to account
+        return [PostingLeg(to_account, 'to', 'credit', amount, False)], \
+            [ContraLine('interest_expense', 'debit', amount)]
+
+    if txn.transaction_type == 'reversal':
+        if from_account and to_account:
+            # Reverse transfer
+            return [
+                PostingLeg(to_account, 'to', 'debit', amount, True),
+                PostingLeg(from_account, 'from', 'credit', amount, False),
+            ], []
+        if from_account:
+            # Reverse withdrawal/charge
+            return [PostingLeg(from_account, 'from', 'credit', total_amount, False)], \
+                [ContraLine('cash_clearing', 'debit', total_amount)]
+        if to_account:
+            # Reverse deposit
+            return [PostingLeg(to_account, 'to', 'debit', amount, False)], \
+                [ContraLine('cash_clearing', 'credit', amount)]
+
+    return [], []
+
+
+def _contra_line_entries(posting_id, contra_lines, transaction_obj, description):
+    from .models import LedgerEntry
+    return [
+        LedgerEntry(
+            posting_id=posting_id,
+            ledger_account=line.ledger_account,
+            transaction=transaction_obj,
+            entry_type=line.entry_type,
+            amount=line.amount,
+            description=description[:200]
+        )
+        for line in contra_lines
+        if line.amount > 0
+    ]
+
+
+def _posting_description(txn):
+    return txn.description or txn.get_transaction_type_display()
+
+
+def post_transaction(txn, use_overdraft_limit=False):
+    """
+    Execute a transaction's posting plan and fill in its balance snapshots.
+
+    Each leg is one conditional UPDATE in primary key order; the ledger lines
+    are written with a single INSERT. Raises InsufficientFundsError (and
+    rolls back every leg) if any debit is not covered.
+    """
+    legs, contra_lines = plan_transaction(txn)
+    description = _posting_description(txn)
+    posting_id = uuid.uuid4()
+    entries = []
+
+    with transaction.atomic():
+        # Funds held for this transaction are consumed by its source debit
+        held = _take_hold(txn)
+        for leg in sorted(legs, key=lambda leg: str(leg.account.pk)):
+            delta = leg.amount if leg.entry_type == 'credit' else -leg.amount
+            release = Decimal('0')
+            if held and leg.side == 'from' and leg.entry_type == 'debit':
+                release, held = held, Decimal('0')
+            before, after, sequence = _apply_delta(
+                leg.account, delta,
+                require_funds=leg.require_funds,
+                use_overdraft_limit=use_overdraft_limit,
+                release=release
+            )
+            setattr(txn, f'{leg.side}_balance_before', before)
+            setattr(txn, f'{leg.side}_balance_after', after)
+            entries.append(_customer_entry(
+                posting_id, leg.account, leg.entry_type, leg.amount, sequence, after, txn, description
+            ))
+        entries += _contra_line_entries(posting_id, contra_lines, txn, description)
+        if entries:
+            _record(entries)
+        if held:
+            # Nothing debited the source account, so the hold goes back
+            _move_hold(txn.from_account, -held)
+
+
+def _release_in_state(account_state, amount):
+    account_state['available_balance'] += amount
+    account_state['hold_balance'] -= amount
+    account_state['available_delta'] += amount
+    account_state['hold_delta'] -= amount
+
+
+def post_transactions_batch(transactions, use_overdraft_limit=False, claimed_by=None):
+    """
+    Post many pending transactions with one balance UPDATE for the whole batch.
+
+    The batch is re-read under lock so rows already handled or posted
+    elsewhere are skipped, and every affected account is locked in primary
+    key order. Each transaction is then checked and applied in creation
+    order against the running balances, the per-account deltas are netted
+    into a single UPDATE, the ledger lines go in with bulk INSERTs and the
+    transaction rows are bulk-updated. Model signals are bypassed; status
+    notifications are sent once the batch has committed.
+
+    With claimed_by, the batch is the rows that worker already moved to
+    'processing' with its compare-and-swap claim instead of pending rows.
+
+    Funds held for a transaction are consumed by its source debit, or
+    released if it fails.
+
+    Returns (posted, failed) lists of Transaction instances.
+    """
+    from .models import Transaction, LedgerEntry
+    from .activity import sync_activity_status
+
+    ids = [txn.pk for txn in transactions]
+    if not ids:
+        return [], []
+
+    now = timezone.now()
+    posted, failed = [], []
+
+    with transaction.atomic():
+        if claimed_by:
+            batch = Transaction.objects.filter(pk__in=ids, status='processing', claimed_by=claimed_by)
+        else:
+            batch = Transaction.objects.filter(pk__in=ids, status='pending')
+        # Rows that already moved money (e.g. debited on submission) are never posted again
+        batch = list(batch.filter(~has_postings()).select_for_update().order_by('created_at'))
+        account_ids = set()
+        for txn in batch:
+            account_ids.update(pk for pk in (txn.from_account_id, txn.to_account_id) if pk)
+
+        locked = {
+            account.pk: account
+            for account in BankAccount.objects.select_for_update().filter(pk__in=account_ids).order_by('pk')
+        }
+        state = {
+            pk: {
+                'balance': account.balance,
+                'available_balance': account.available_balance,
+                'hold_balance': account.hold_balance,
+                'sequence': account.ledger_sequence,
+                'delta': Decimal('0'),
+                'available_delta': Decimal('0'),
+                'hold_delta': Decimal('0'),
+                'entries': 0,
+            }
+            for pk, account in locked.items()
+        }
+
+        entries = []
+        for txn in batch:
+            # Share one instance per account across the batch
+            if txn.from_account_id:
+                txn.from_account = locked.get(txn.from_account_id)
+            if txn.to_account_id:
+                txn.to_account = locked.get(txn.to_account_id)
+            legs, contra_lines = plan_transaction(txn)
+
+            txn.processed_at = now
+            txn.confirmed_at = now
+            txn.updated_at = now
+
+            # Check every leg against the running balances before applying any of them.
+            # Funds held for the transaction are consumed by its source debit.
+            held = total_held = _to_decimal(txn.held_amount or 0)
+            txn.held_amount = Decimal('0')
+            pending = {}
+            sufficient = True
+            for leg in legs:
+                current = pending.get(leg.account.pk) or dict(state[leg.account.pk])
+                delta = leg.amount if leg.entry_type == 'credit' else -leg.amount
+                release = Decimal('0')
+                if held and leg.side == 'from' and leg.entry_type == 'debit':
+                    release, held = held, Decimal('0')
+                if leg.entry_type == 'debit' and leg.require_funds:
+                    funds = current['available_balance'] + release
+                    if use_overdraft_limit:
+                        funds += leg.account.overdraft_limit
+                    if funds < leg.amount:
+                        sufficient = False
+                        break
+                current['balance'] += delta
+                current['available_balance'] += delta + release
+                current['hold_balance'] -= release
+                current['delta'] += delta
+                current['available_delta'] += delta + release
+                current['hold_delta'] -= release
+                current['sequence'] += 1
+                current['entries'] += 1
+                pending[leg.account.pk] = current
+
+            if not sufficient:
+                # Nothing is posted, so the whole hold goes back to the source account
+                held = total_held
+                if held and txn.from_account_id in state:
+                    _release_in_state(state[txn.from_account_id], held)
+                txn.status = 'failed'
+                txn.failure_reason = 'Insufficient funds'
+                txn.failed_at = now
+                failed.append(txn)
+                continue
+
+            description = _posting_description(txn)
+            posting_id = uuid.uuid4()
+            running = {}
+            for leg in legs:
+                previous = running.get(leg.account.pk, state[leg.account.pk])
+                current = dict(previous)
+                delta = leg.amount if leg.entry_type == 'credit' else -leg.amount
+                current['balance'] += delta
+                current['sequence'] += 1
+                running[leg.account.pk] = current
+                setattr(txn, f'{leg.side}_balance_before', previous['balance'])
+                setattr(txn, f'{leg.side}_balance_after', current['balance'])
+                entries.append(_customer_entry(
+                    posting_id, leg.account, leg.entry_type, leg.amount,
+                    current['sequence'], current['balance'], txn, description
+                ))
+            entries += _contra_line_entries(posting_id, contra_lines, txn, description)
+            state.update(pending)
+            if held and txn.from_account_id in state:
+                # No source debit consumed the hold, so it is released
+                _release_in_state(state[txn.from_account_id], held)
+
+            # Transfers stay in processing until confirmed by the external network
+            if txn.transaction_type == 'transfer':
+                txn.status = 'processing'
+            else:
+                txn.status = 'completed'
+                txn.completed_at = now
+            posted.append(txn)
+
+        touched = [
+            pk for pk, account_state in state.items()
+            if account_state['entries'] or account_state['hold_delta']
+        ]
+        if touched:
+            money = DecimalField(max_digits=15, decimal_places=2)
+
+            def per_account(key):
+                return Case(
+                    *[When(pk=pk, then=Value(state[pk][key], output_field=money)) for pk in touched],
+                    output_field=money
+                )
+
+            BankAccount.objects.filter(pk__in=touched).update(
+                balance=F('balance') + per_account('delta'),
+                available_balance=F('available_balance') + per_account('available_delta'),
+                hold_balance=F('hold_balance') + per_account('hold_delta'),
+                ledger_sequence=F('ledger_sequence') + Case(
+                    *[When(pk=pk, then=Value(state[pk]['entries'])) for pk in touched],
+                    output_field=PositiveBigIntegerField()
+                ),
+                updated_at=now,
+                last_transaction_date=now,
+            )
+            for pk in touched:
+                locked[pk].balance = state[pk]['balance']
+                locked[pk].available_balance = state[pk]['available_balance']
+                locked[pk].hold_balance = state[pk]['hold_balance']
+                locked[pk].ledger_sequence = state[pk]['sequence']
+            invalidate_dashboards(locked[pk].user_id for pk in touched)
+
+        if entries:
+            LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+        Transaction.objects.bulk_update(
+            posted + failed,
+            [
+                'status', 'processed_at', 'confirmed_at', 'completed_at', 'failed_at', 'failure_reason',
+                'from_balance_before', 'from_balance_after', 'to_balance_before', 'to_balance_after',
+                'held_amount', 'updated_at',
+            ],
+            batch_size=500
+        )
+        sync_activity_status(txn.pk for txn in posted + failed)
+
+        completed = [txn for txn in posted if txn.status == 'completed']
+        _notify_status_changes(completed, failed)
+
+    return posted, failed
+
+
+def _notify_status_changes(completed, failed):
+    """Queue the status notifications the per-row save signals would have queued"""
+    from notifications.signals import _send_status_change_notification
+    for txn in completed:
+        _send_status_change_notification(txn, 'transaction_completed')
+    for txn in failed:
+        _send_status_change_notification(txn, 'transaction_failed')
+
+
+def post_in_batches(transactions, batch_size, use_overdraft_limit=False):
+    """Post transactions batch_size at a time; returns (posted, failed) lists"""
+    transactions = list(transactions)
+    posted, failed = [], []
+    for start in range(0, len(transactions), batch_size):
+        batch_posted, batch_failed = post_transactions_batch(
+            transactions[start:start + batch_size], use_overdraft_limit=use_overdraft_limit
+        )
+        posted += batch_posted
+        failed += batch_failed
+    return posted, failed
@@ -0,0 +1,124 @@
+"""
+Rendered transactions in terminal states
+
+A transaction that is completed, failed or cancelled serializes the same way
+every time, so its TransactionSerializer output is kept in the default cache
+under its id. The cached form is filled the first time such a transaction is
+rendered with the full field set. Sparse fieldsets are cut from it.
+
+Cached forms are dropped when the transaction is saved and when its status
+is changed by a queryset update (through sync_activity_status). Each cached
+form also records the version of both its accounts; renaming an account
+bumps its version, which retires every form showing the old name without
+looking them up. TRANSACTION_REPRESENTATION_TIMEOUT bounds how long they
+live regardless.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+KEY = 'transaction:representation:{pk}'
+
+ACCOUNT_VERSION_KEY = 'account:representation-version:{pk}'
+
+
+class CachedRepresentation:
+    """Stand-in for a transaction whose rendered form was found in the cache"""
+    __slots__ = ('pk', 'data')
+
+    def __init__(self, pk, data):
+        self.pk = pk
+        self.data = data
+
+
+def _key(pk):
+    return KEY.format(pk=pk)
+
+
+def is_terminal(txn):
+    return txn.status in TERMINAL_STATUSES
+
+
+def _account_versions(account_ids):
+    """{account id: current version} in one cache lookup; accounts never renamed are at 0"""
+    keys = {pk: ACCOUNT_VERSION_KEY.format(pk=pk) for pk in set(account_ids) if pk is not None}
+    found = cache.get_many(list(keys.values()))
+    return {pk: found.get(key, 0) for pk, key in keys.items()}
+
+
+def get_representations(ids):
+    """{id: rendered form} for those of ids that are cached and current"""
+    ids = list(ids)
+    if not ids:
+        return {}
+    found = cache.get_many([_key(pk) for pk in ids])
+    entries = {pk: found[_key(pk)] for pk in ids if _key(pk) in found}
+    current = _account_versions(account_id for versions, _ in entries.values() for account_id in versions)
+    return {
+        pk: data for pk, (versions, data) in entries.items()
+        if all(current[account_id] == version for account_id, version in versions.items())
+    }
+
+
+def store_representations(rendered):
+    """Cache {transaction: rendered form} for transactions in a terminal state"""
+    if not rendered:
+        return
+    versions = _account_versions(
+        account_id for txn in rendered for account_id in (txn.from_account_id, txn.to_account_id)
+    )
+    cache.set_many(
+        {
+            _key(txn.pk): (
+                {account_id: versions[account_id] for account_id in (txn.from_account_id, txn.to_account_id)
+                 if account_id is not None},
+                data
+            )
+            for txn, data in rendered.items()
+        },
+        getattr(settings, 'TRANSACTION_REPRESENTATION_TIMEOUT', 86400)
+    )
+
+
+def forget_representations(ids):
+    """Drop the cached forms of these transactions once the current transaction commits"""
+    keys = [_key(pk) for pk in ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_account_representations(account_ids):
+    """Retire the cached forms of every transaction on these accounts once the current transaction commits"""
+    def bump():
+        for pk in account_ids:
+            key = ACCOUNT_VERSION_KEY.format(pk=pk)
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add and incr
+                cache.set(key, 1, None)
+
+    account_ids = list(account_ids)
+    if account_ids:
+        transaction.on_commit(bump)
+
+
+def load_with_cached(queryset, ids):
+    """
+    The transactions with these ids, in order. Cached ones come back as
+    CachedRepresentation; only the rest are read through queryset, so ids
+    must already be limited to transactions the caller may see.
+    """
+    cached = get_representations(ids)
+    missing = [pk for pk in ids if pk not in cached]
+    objects = {obj.pk: obj for obj in queryset.filter(pk__in=missing)} if missing else {}
+    rows = []
+    for pk in ids:
+        if pk in cached:
+            rows.append(CachedRepresentation(pk, cached[pk]))
+        elif pk in objects:
+            rows.append(objects[pk])
+    return rows
@@ -0,0 +1,218 @@
+"""
+Event-driven transaction scheduler
+
+Instead of re-scanning every pending transaction on each cron run, the
+scheduler loads the due time of each pending auto-confirm transaction once
+into an in-memory heap and sleeps until the earliest one. Transactions created
+afterwards are picked up from a created_at high-water mark and, on PostgreSQL,
+immediately through LISTEN/NOTIFY (see banking.signals). Due transactions are
+posted through the batch engine, which re-checks their status under lock, so
+rows cancelled or processed elsewhere in the meantime are simply dropped.
+
+Completion of confirmed transactions is keyed by expected_completion_date;
+the scheduler wakes at the start of each such date and runs the existing
+completion step of process_pending_transactions. Dates are read with the
+pending rows they belong to, and afterwards only from rows created since the
+last refresh. When a completion run leaves due transactions behind (e.g. an
+external transfer the network has not settled yet) it runs again after
+completion_retry.
+"""
+import heapq
+import logging
+import select
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from .models import Transaction
+from .posting import post_in_batches
+from .workers import scheduled_transactions
+
+logger = logging.getLogger(__name__)
+
+# Channel used by banking.signals to announce new pending transactions
+NOTIFY_CHANNEL = 'banking_transaction_due'
+
+POST = 'post'
+COMPLETE = 'complete'
+
+
+def _start_of_day(day):
+    """Aware datetime for local midnight, matching date.today() in the completion step"""
+    return datetime.combine(day, dt_time.min).astimezone(dt_timezone.utc)
+
+
+class TransactionScheduler:
+    """Heap of due transactions and completion dates, fired at their due time"""
+
+    def __init__(self, batch_size=500, refresh_interval=30.0, overlap=timedelta(minutes=5),
+                 completion_retry=timedelta(minutes=15)):
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+        # Rows committed late can carry a created_at just below the high-water mark
+        self.overlap = overlap
+        self.completion_retry = completion_retry
+        self._heap = []
+        self._scheduled = set()
+        self._watermark = None
+        self._listener = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, kind, key, due_at):
+        if (kind, key) in self._scheduled:
+            return
+        self._scheduled.add((kind, key))
+        heapq.heappush(self._heap, (due_at, kind, key))
+
+    def schedule_completion(self, day):
+        self.schedule(COMPLETE, day, _start_of_day(day))
+
+    def _schedule_pending(self, queryset):
+        rows = queryset.values_list('pk', 'due_at', 'created_at', 'expected_completion_date')
+        for pk, due_at, created_at, completion_date in rows.iterator(chunk_size=2000):
+            self.schedule(POST, pk, due_at)
+            if completion_date:
+                self.schedule_completion(completion_date)
+            if self._watermark is None or created_at > self._watermark:
+                self._watermark = created_at
+
+    def _schedule_completions(self, since=None):
+        """Schedule the completion dates of confirmed and processing transactions created since since"""
+        ready = Transaction.objects.filter(
+            status__in=['confirmed', 'processing'],
+            expected_completion_date__isnull=False
+        )
+        if since is not None:
+            ready = ready.filter(created_at__gte=since)
+        for day in ready.values_list('expected_completion_date', flat=True).distinct():
+            self.schedule_completion(day)
+
+    def load(self):
+        """Load every pending transaction's due time; the only full scan the scheduler makes"""
+        self._schedule_pending(scheduled_transactions())
+        self._schedule_completions()
+        logger.info(f'Scheduler loaded {len(self._heap)} events')
+
+    def refresh(self):
+        """Pick up transactions created since the last load or refresh"""
+        since = None if self._watermark is None else self._watermark - self.overlap
+        pending = scheduled_transactions()
+        if since is not None:
+            pending = pending.filter(created_at__gte=since)
+        self._schedule_pending(pending)
+        if since is not None:
+            self._schedule_completions(since)
+
+    def add(self, pks):
+        """Schedule specific transactions, e.g. ones announced over NOTIFY"""
+        self._schedule_pending(scheduled_transactions().filter(pk__in=pks))
+
+    def seconds_until_next(self, now=None):
+        if not self._heap:
+            return None
+        now = now or timezone.now()
+        return max((self._heap[0][0] - now).total_seconds(), 0.0)
+
+    def fire_due(self, now=None):
+        """Run every event whose time has come; returns (posted, failed) counts"""
+        now = now or timezone.now()
+        due_pks, due_dates = [], []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, kind, key = heapq.heappop(self._heap)
+            self._scheduled.discard((kind, key))
+            if kind == POST:
+                due_pks.append(key)
+            else:
+                due_dates.append(key)
+
+        posted = failed = 0
+        if due_pks:
+            # Re-read the rows: anything cancelled, processed, posted or re-timed since loading is skipped
+            due = [txn for txn in scheduled_transactions().filter(pk__in=due_pks) if txn.can_be_processed()]
+            try:
+                batch_posted, batch_failed = post_in_batches(due, self.batch_size)
+                posted, failed = len(batch_posted), len(batch_failed)
+                # A date whose completion run came before the posting needs another run
+                for txn in batch_posted:
+                    if txn.expected_completion_date:
+                        self.schedule_completion(txn.expected_completion_date)
+                logger.info(f'Scheduler posted {posted} transactions, {failed} failed')
+            except Exception as e:
+                # Try again shortly rather than dropping the events
+                logger.error(f'Scheduler could not post {len(due)} transactions: {str(e)}')
+                for txn in due:
+                    self.schedule(POST, txn.pk, now + timedelta(seconds=5))
+
+        if due_dates:
+            logger.info(f'Scheduler completing transactions due {max(due_dates)}')
+            call_command('process_pending_transactions', complete_only=True)
+            left_behind = Transaction.objects.filter(
+                status__in=['confirmed', 'processing'],
+                expected_completion_date__lte=date.today()
+            )
+            if left_behind.exists():
+                self.schedule(COMPLETE, date.today(), now + self.completion_retry)
+
+        return posted, failed
+
+    def listen(self):
+        """Subscribe to new-transaction notifications where the database supports it"""
+        if connection.vendor != 'postgresql' or connection.Database.__name__ != 'psycopg2':
+            return False
+        # A connection of its own: Django may close or recycle its connection, dropping the LISTEN
+        listener = connection.Database.connect(**connection.get_connection_params())
+        listener.autocommit = True
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        self._listener = listener
+        return True
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds, returning early with any notified transaction ids"""
+        if self._listener is None:
+            time.sleep(timeout)
+            return []
+
+        # psycopg2's documented notification loop: wait until readable, poll, drain notifies
+        if select.select([self._listener], [], [], timeout) == ([], [], []):
+            return []
+        self._listener.poll()
+        pks = []
+        while self._listener.notifies:
+            pks.append(self._listener.notifies.pop(0).payload)
+        return pks
+
+    def run(self, stopping=None):
+        """Fire events at their due time until stopping is non-empty"""
+        stopping = stopping if stopping is not None else []
+        self.load()
+        self.listen()
+        next_refresh = time.monotonic() + self.refresh_interval
+
+        try:
+            while not stopping:
+                self.fire_due()
+
+                until_refresh = max(next_refresh - time.monotonic(), 0.0)
+                until_next = self.seconds_until_next()
+                timeout = until_refresh if until_next is None else min(until_next, until_refresh)
+
+                notified = self.wait(timeout)
+                if notified:
+                    self.add(notified)
+
+                if time.monotonic() >= next_refresh:
+                    self.refresh()
+                    next_refresh = time.monotonic() + self.refresh_interval
+        finally:
+            self.close()
@@ -1,10 +1,66 @@
+from django.db.models import Manager, QuerySet, prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Transaction, TransferRequest, Card, DepositRequest
 from accounts.models import BankAccount
 from accounts.serializers import BankAccountSerializer
+from accounts.fieldsets import SparseFieldsetMixin
+from .representations import (
+    CachedRepresentation, is_terminal, get_representations, store_representations
+)
 
+# Relations TransactionSerializer reads on every row
+TRANSACTION_RELATED = ('from_account', 'to_account')
 
-class TransactionSerializer(serializers.ModelSerializer):
+
+class TransactionListSerializer(serializers.ListSerializer):
+    """
+    Serializes a page of transactions in a fixed number of queries.
+    
+    Terminal transactions are taken from the representation cache in one
+    lookup; only the rest are rendered, and relations are loaded for those.
+    """
+    
+    def to_representation(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        # Only relations the kept fields read through (e.g. from_account.account_number)
+        related = [
+            name for name in TRANSACTION_RELATED
+            if any(field.source.startswith(f'{name}.') for field in self.child.fields.values())
+        ]
+        if isinstance(data, QuerySet) and not data.query.select_related and related:
+            data = data.select_related(*related)
+        rows = list(data)
+        
+        cached = get_representations(
+            row.pk for row in rows if not isinstance(row, CachedRepresentation) and is_terminal(row)
+        )
+        fresh = [row for row in rows if not isinstance(row, CachedRepresentation) and row.pk not in cached]
+        # Loads each relation for the whole page at once; rows that already have it are skipped
+        prefetch_related_objects(fresh, *related)
+        
+        # Display fields shared across the page are worked out once
+        self.child.page_now = timezone.now()
+        self.child.completion_labels = {}
+        rendered, results = {}, []
+        try:
+            for row in rows:
+                if isinstance(row, CachedRepresentation):
+                    results.append(self.child.cut_representation(row.data))
+                elif row.pk in cached:
+                    results.append(self.child.cut_representation(cached[row.pk]))
+                else:
+                    results.append(self.child.render(row))
+                    if is_terminal(row) and not self.child.sparse:
+                        rendered[row] = results[-1]
+        finally:
+            del self.child.page_now, self.child.completion_labels
+        store_representations(rendered)
+        return results
+
+
+class TransactionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     from_account_number = serializers.CharField(source='from_account.account_number', read_only=True)
     to_account_number = serializers.CharField(source='to_account.account_number', read_only=True)
     from_account_name = serializers.CharField(source='from_account.account_name', read_only=True)
@@ -46,15 +102,49 @@ class TransactionSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'confirmed_at', 'processed_at', 'completed_at', 'failed_at',
             'expected_completion_date', 'failure_reason'
         ]
+        list_serializer_class = TransactionListSerializer
+        field_dependencies = {
+            'status_message': ['status_message', 'status', 'failure_reason'],
+            'can_be_processed': ['status', 'auto_confirm', 'created_at', 'confirmation_delay_hours'],
+            'estimated_completion': ['status', 'completed_at', 'expected_completion_date'],
+        }
+    
+    def to_representation(self, instance):
+        if isinstance(instance, CachedRepresentation):
+            return self.cut_representation(instance.data)
+        if not is_terminal(instance):
+            return self.render(instance)
+        cached = get_representations([instance.pk]).get(instance.pk)
+        if cached is not None:
+            return self.cut_representation(cached)
+        data = self.render(instance)
+        if not self.sparse:
+            store_representations({instance: data})
+        return data
+    
+    def render(self, instance):
+        """Serialize without consulting the representation cache"""
+        return super().to_representation(instance)
+    
+    def cut_representation(self, data):
+        """The kept fields of a cached full representation"""
+        if not self.sparse:
+            return data
+        return {name: data[name] for name in self.fields}
     
     def get_status_message(self, obj):
         return obj.get_status_message()
     
     def get_can_be_processed(self, obj):
-        return obj.can_be_processed()
+        return obj.can_be_processed(now=getattr(self, 'page_now', None))
     
     def get_estimated_completion(self, obj):
-        return obj.get_estimated_completion()
+        labels = getattr(self, 'completion_labels', None)
+        if labels is None or obj.status == 'completed':
+            return obj.get_estimated_completion()
+        if obj.expected_completion_date not in labels:
+            labels[obj.expected_completion_date] = obj.get_estimated_completion()
+        return labels[obj.expected_completion_date]
 
 
 class TransferRequestSerializer(serializers.ModelSerializer):
@@ -205,7 +295,7 @@ class WithdrawalSerializer(serializers.Serializer):
         return value
 
 
-class CardSerializer(serializers.ModelSerializer):
+class CardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     account_number = serializers.CharField(source='account.account_number', read_only=True)
     card_type_display = serializers.CharField(source='get_card_type_display', read_only=True)
     card_brand_display = serializers.CharField(source='get_card_brand_display', read_only=True)
@@ -228,6 +318,10 @@ class CardSerializer(serializers.ModelSerializer):
         read_only_fields = [
             'id', 'card_number', 'cvv', 'pin_hash', 'created_at', 'updated_at'
         ]
+        field_dependencies = {
+            'masked_card_number': ['card_number'],
+            'is_expired': ['expiry_date'],
+        }
     
     def get_masked_card_number(self, obj):
         if obj.card_number:
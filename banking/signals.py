@@ -0,0 +1,81 @@
+from django.db import connection, transaction as db_transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from accounts.dashboard_cache import invalidate_account_owners
+from accounts.models import BankAccount
+from .models import Transaction, AccountActivity, Card
+from .activity import record_activity
+from .representations import forget_account_representations, forget_representations
+from .scheduler import NOTIFY_CHANNEL
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Transaction)
+def announce_scheduled_transaction(sender, instance, created, **kwargs):
+    """Wake the transaction scheduler as soon as a new pending transaction commits"""
+    if not created or instance.status != 'pending' or not instance.auto_confirm:
+        return
+    if connection.vendor != 'postgresql':
+        # Other databases are picked up by the scheduler's periodic refresh
+        return
+
+    def notify():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, str(instance.pk)])
+        except Exception as e:
+            logger.error(f'Failed to notify scheduler of transaction {instance.reference}: {str(e)}')
+
+    db_transaction.on_commit(notify)
+
+
+@receiver(post_save, sender=Transaction)
+def maintain_account_activity(sender, instance, created, **kwargs):
+    """Keep the per-account activity rows in step with the transaction"""
+    if created:
+        record_activity(instance)
+    else:
+        AccountActivity.objects.filter(transaction_id=instance.pk).update(
+            status=instance.status, updated_at=instance.updated_at
+        )
+
+
+def _accounts_of(instance, *fields):
+    """Account instances already loaded on instance, else their ids"""
+    return [
+        getattr(instance, name) if instance._meta.get_field(name).is_cached(instance) else getattr(instance, f'{name}_id')
+        for name in fields
+    ]
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def invalidate_transaction_dashboards(sender, instance, **kwargs):
+    invalidate_account_owners(_accounts_of(instance, 'from_account', 'to_account'))
+
+
+@receiver([post_save, post_delete], sender=Card)
+def invalidate_card_dashboards(sender, instance, **kwargs):
+    invalidate_account_owners(_accounts_of(instance, 'account'))
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def forget_transaction_representation(sender, instance, **kwargs):
+    forget_representations([instance.pk])
+
+
+@receiver(post_init, sender=BankAccount)
+def remember_account_name(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred name is not loaded just for this
+    instance._saved_account_name = instance.__dict__.get('account_name')
+
+
+@receiver(post_save, sender=BankAccount)
+def forget_renamed_account_representations(sender, instance, created, update_fields=None, **kwargs):
+    """Rendered transactions show the account name, so a rename retires them"""
+    if update_fields is not None and 'account_name' not in update_fields:
+        return
+    if not created and instance.account_name != instance._saved_account_name:
+        forget_account_representations([instance.pk])
+    instance._saved_account_name = instance.account_name
@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import re
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import holidays
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from accounts.identifiers import allocate_account_numbers, allocate_transaction_references
+from accounts.models import BankAccount
+from .activity import (
+    account_transactions, activity_rows, rebuild_activity, recent_transactions, sync_activity_status
+)
+from .business_days import BusinessCalendar
+from .idempotency import idempotent, purge_expired_keys
+from .models import Transaction, AccountActivity, IdempotencyKey, LedgerEntry
+from . import posting
+from .posting import (
+    InsufficientFundsError, credit_account, debit_account, place_hold, post_transaction, post_transactions_batch,
+    release_hold
+)
+from .scheduler import POST, TransactionScheduler
+from .serializers import TransactionSerializer
+from .workers import CLAIM_LEASE, claim_and_post, due_for_processing, release_stale_claims, scheduled_transactions
+
+
+class BankingTestCase(TestCase):
+    """TestCase with helpers for seeding customers and their transactions in setUpTestData"""
+
+    @classmethod
+    def create_customers(cls, prefix, count=2):
+        """count users with one bank account each; returns the accounts in user order"""
+        users = [
+            User.objects.create_user(f'{prefix}{index}', f'{prefix}{index}@example.com', 'x')
+            for index in range(count)
+        ]
+        BankAccount.objects.bulk_create([
+            BankAccount(user=user, account_number=number, account_name=user.username)
+            for user, number in zip(users, allocate_account_numbers(len(users)))
+        ])
+        accounts = {account.user_id: account for account in BankAccount.objects.filter(user__in=users)}
+        return [accounts[user.pk] for user in users]
+
+    @classmethod
+    def seed_transactions(cls, count, fields, activity=True):
+        """
+        Bulk-create count transactions, with fields(index) giving the columns
+        of each row on top of a completed 5.00 transfer.
+        """
+        defaults = {
+            'transaction_type': 'transfer',
+            'amount': Decimal('5.00'),
+            'total_amount': Decimal('5.00'),
+            'description': 'Seeded transfer',
+            'status': 'completed',
+        }
+        rows = [{**defaults, **fields(index)} for index in range(count)]
+        transactions = Transaction.objects.bulk_create([
+            Transaction(reference=reference, **row)
+            for row, reference in zip(rows, allocate_transaction_references(count))
+        ])
+        # created_at is auto_now_add, which bulk_create fills in regardless; put the requested ones back
+        stamped = []
+        for txn, row in zip(transactions, rows):
+            if 'created_at' in row:
+                txn.created_at = row['created_at']
+                stamped.append(txn)
+        Transaction.objects.bulk_update(stamped, ['created_at'])
+        if activity:
+            AccountActivity.objects.bulk_create([row for txn in transactions for row in activity_rows(txn)])
+        return transactions
+
+
+class TransactionQueryPlanTests(BankingTestCase):
+    """
+    The hot Transaction queries must be answered from an index.
+
+    Each query is EXPLAINed against a seeded table. On PostgreSQL sequential
+    scans are disabled for the check, so the planner reports whether an index
+    path exists at all rather than what is cheapest for a small test table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.accounts = cls.create_customers('plan', 5)
+        cls.account = cls.accounts[0]
+        cls.user = cls.account.user
+
+        statuses = ['pending', 'confirmed', 'processing', 'completed', 'failed']
+        now = timezone.now()
+        cls.seed_transactions(500, lambda index: {
+            'amount': Decimal('10.00'),
+            'total_amount': Decimal('10.00'),
+            'status': statuses[index % len(statuses)],
+            'from_account': cls.accounts[index % len(cls.accounts)],
+            'to_account': cls.accounts[(index + 1) % len(cls.accounts)],
+            'expected_completion_date': date.today() + timedelta(days=index % 7),
+            'created_at': now - timedelta(minutes=index),
+        }, activity=False)
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, ordered_scan=False):
+        """
+        Fail unless the table is reached through an index lookup.
+
+        A walk over a whole index just to return rows in order is only
+        accepted with ordered_scan, or when the index is partial and so
+        already limited to the rows asked for.
+        """
+        plan = self.explain(queryset)
+        table = Transaction._meta.db_table
+        partial = {index.name for index in Transaction._meta.indexes if index.condition is not None}
+        if connection.vendor == 'postgresql':
+            self.assertNotRegex(plan, rf'Seq Scan on {table}\b', f'Full table scan of {table}:\n{plan}')
+            if not ordered_scan and not any(name in plan for name in partial):
+                self.assertIn('Index Cond', plan, f'Full index scan of {table}:\n{plan}')
+            return
+
+        for match in re.finditer(rf'\bSCAN {table}\b(?: USING (?:COVERING )?INDEX (\w+))?', plan):
+            index_name = match.group(1)
+            self.assertIsNotNone(index_name, f'Full table scan of {table}:\n{plan}')
+            if not ordered_scan:
+                self.assertIn(index_name, partial, f'Full index scan of {table}:\n{plan}')
+
+    def test_transaction_list(self):
+        user_accounts = BankAccount.objects.filter(user=self.user)
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                Q(from_account__in=user_accounts) | Q(to_account__in=user_accounts)
+            ).order_by('-created_at')[:20]
+        )
+
+    def test_account_recent_transactions(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                Q(from_account=self.account) | Q(to_account=self.account)
+            ).order_by('-created_at')[:10]
+        )
+
+    def test_pending_debits(self):
+        self.assertUsesIndex(Transaction.objects.filter(from_account=self.account, status='pending'))
+
+    def test_unindexed_filter_is_reported(self):
+        with self.assertRaises(AssertionError):
+            self.assertUsesIndex(Transaction.objects.filter(description='Seeded transfer'))
+
+    def test_admin_changelist_sort(self):
+        self.assertUsesIndex(Transaction.objects.order_by('-created_at')[:100], ordered_scan=True)
+
+    def test_completion_step(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                status__in=['confirmed', 'processing'],
+                expected_completion_date__lte=date.today()
+            )
+        )
+
+    def test_worker_queue(self):
+        self.assertUsesIndex(due_for_processing()[:200])
+        self.assertUsesIndex(scheduled_transactions().values_list('pk', 'created_at'))
+
+    def test_stale_claims(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(
+                status='processing', processed_at__isnull=True, claimed_at__lt=timezone.now()
+            )
+        )
+
+
+class TransactionSerializerQueryTests(BankingTestCase):
+    """Serializing a list of transactions costs the same number of queries at any length"""
+
+    @classmethod
+    def setUpTestData(cls):
+        own, other = cls.create_customers('lean')
+        cls.user = own.user
+
+        now = timezone.now()
+        cls.seed_transactions(60, lambda index: {
+            'status': 'pending' if index % 2 else 'completed',
+            'from_account': own if index % 2 else other,
+            'to_account': other if index % 2 else own,
+            'expected_completion_date': date.today() + timedelta(days=index % 3),
+            'created_at': now - timedelta(minutes=index),
+        })
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return len(queries)
+
+    def test_queryset_serializes_in_one_query(self):
+        for size in (5, 50):
+            with self.subTest(size=size), self.assertNumQueries(1):
+                data = TransactionSerializer(Transaction.objects.all()[:size], many=True).data
+                self.assertEqual(len(data), size)
+
+    def test_loaded_instances_fetch_each_relation_once(self):
+        for size in (5, 50):
+            rows = list(Transaction.objects.all()[:size])
+            with self.subTest(size=size), self.assertNumQueries(2):
+                TransactionSerializer(rows, many=True).data
+
+    def test_transaction_list_query_count_is_constant(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def page(size):
+            response = client.get('/api/banking/transactions/', {'page_size': size})
+            self.assertEqual(len(response.json()['results']), size)
+
+        self.assertEqual(self.count_queries(lambda: page(5)), self.count_queries(lambda: page(50)))
+
+    def test_sparse_fields_skip_relations_they_do_not_read(self):
+        rows = list(Transaction.objects.filter(status='pending')[:10])
+        with self.assertNumQueries(0):
+            TransactionSerializer(rows, many=True, fields=['id', 'amount', 'status_message']).data
+        # Only from_account is prefetched
+        with CaptureQueriesContext(connection) as queries:
+            data = TransactionSerializer(rows, many=True, fields=['id', 'from_account_number']).data
+        self.assertEqual(len(queries), 1)
+        self.assertEqual({row['from_account_number'] for row in data}, {rows[0].from_account.account_number})
+
+    def test_sparse_fields_narrow_the_query(self):
+        serializer = TransactionSerializer(fields=['id', 'from_account_name', 'status_message'])
+        self.assertEqual(
+            serializer.query_columns(),
+            ({'id', 'from_account__account_name', 'status_message', 'status', 'failure_reason'}, {'from_account'})
+        )
+        with CaptureQueriesContext(connection) as queries:
+            TransactionSerializer(Transaction.objects.filter(status='pending')[:5], many=True, fields=['id', 'amount']).data
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
+    def test_unknown_fields_are_refused(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/banking/transactions/', {'fields': 'id,from_account.user'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('from_account.user', response.json()['fields'])
+
+
+class TransactionRepresentationCacheTests(BankingTestCase):
+    """Terminal transactions are rendered once and then spliced in from the cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own, other = cls.create_customers('cached')
+        own = cls.own
+        cls.user = own.user
+
+        now = timezone.now()
+        cls.transactions = cls.seed_transactions(10, lambda index: {
+            'from_account': own,
+            'to_account': other,
+            'completed_at': now - timedelta(minutes=index),
+            'created_at': now - timedelta(minutes=index),
+        })
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def transaction_queries(self, path, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params or {})
+        self.assertEqual(response.status_code, 200)
+        table = Transaction._meta.db_table
+        return response.json(), [query['sql'] for query in queries if f'"{table}"' in query['sql']]
+
+    def test_warm_page_skips_transaction_rows(self):
+        cold, cold_reads = self.transaction_queries('/api/banking/transactions/')
+        warm, warm_reads = self.transaction_queries('/api/banking/transactions/')
+        self.assertTrue(cold_reads)
+        self.assertEqual(warm_reads, [])
+        self.assertEqual(warm, cold)
+
+    def test_sparse_page_is_cut_from_cached_renderings(self):
+        full, _ = self.transaction_queries('/api/banking/transactions/')
+        sparse, reads = self.transaction_queries('/api/banking/transactions/', {'fields': 'id,amount'})
+        self.assertEqual(reads, [])
+        self.assertEqual(sparse['results'], [
+            {'id': row['id'], 'amount': row['amount']} for row in full['results']
+        ])
+
+    def test_detail_uses_cached_rendering(self):
+        pk = self.transactions[0].pk
+        cold, _ = self.transaction_queries(f'/api/banking/transactions/{pk}/')
+        warm, reads = self.transaction_queries(f'/api/banking/transactions/{pk}/')
+        self.assertEqual(reads, [])
+        self.assertEqual(warm, cold)
+
+    def test_status_change_drops_cached_rendering(self):
+        pk = self.transactions[0].pk
+        self.transaction_queries(f'/api/banking/transactions/{pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.filter(pk=pk).update(status='failed', failure_reason='Reversed')
+            sync_activity_status([pk])
+        data, _ = self.transaction_queries(f'/api/banking/transactions/{pk}/')
+        self.assertEqual(data['status'], 'failed')
+
+    def test_rename_retires_cached_renderings(self):
+        self.transaction_queries('/api/banking/transactions/')
+        account = BankAccount.objects.get(pk=self.own.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            account.account_name = 'Renamed'
+            account.save()
+        page, reads = self.transaction_queries('/api/banking/transactions/')
+        self.assertTrue(reads)
+        self.assertEqual({row['from_account_name'] for row in page['results']}, {'Renamed'})
+
+    def test_saving_an_account_keeps_cached_renderings(self):
+        self.transaction_queries('/api/banking/transactions/')
+        account = BankAccount.objects.get(pk=self.own.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            # Only the UPDATE: the loaded name tells whether it was renamed
+            with self.assertNumQueries(1):
+                account.save()
+            with self.assertNumQueries(1):
+                account.save(update_fields=['status'])
+        _, reads = self.transaction_queries('/api/banking/transactions/')
+        self.assertEqual(reads, [])
+
+    def test_cached_rendering_is_not_shared_across_users(self):
+        pk = self.transactions[0].pk
+        self.transaction_queries(f'/api/banking/transactions/{pk}/')
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'x')
+        self.client.force_authenticate(stranger)
+        self.assertEqual(self.client.get(f'/api/banking/transactions/{pk}/').status_code, 404)
+
+
+@override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+class TransactionChangesTests(BankingTestCase):
+    """transactions/changes/ hands out every change exactly once, in order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own, cls.other = cls.create_customers('sync')
+        cls.user = cls.own.user
+
+        cls.seed_transactions(25, lambda index: {
+            'status': 'pending',
+            'from_account': cls.own if index % 2 else cls.other,
+            'to_account': cls.other if index % 2 else cls.own,
+        })
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None, page_size=10):
+        """Follow has_more to the end; returns (ids in order, final cursor)"""
+        ids = []
+        while True:
+            params = {'page_size': page_size}
+            if cursor:
+                params['since'] = cursor
+            response = self.client.get('/api/banking/transactions/changes/', params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [row['id'] for row in body['results']]
+            cursor = body['cursor']
+            if not body['has_more']:
+                return ids, cursor
+
+    def test_initial_sync_returns_everything_once(self):
+        ids, cursor = self.sync()
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        self.assertIsNotNone(cursor)
+
+        again, same_cursor = self.sync(cursor)
+        self.assertEqual(again, [])
+        self.assertEqual(same_cursor, cursor)
+
+    def test_changes_after_cursor(self):
+        _, cursor = self.sync()
+        txn = Transaction.objects.filter(from_account=self.own).first()
+        txn.status = 'completed'
+        txn.save()
+        Transaction.objects.create(
+            transaction_type='transfer', amount=Decimal('1.00'), total_amount=Decimal('1.00'),
+            description='New transfer', from_account=self.other, to_account=self.own,
+        )
+
+        ids, _ = self.sync(cursor)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[0], str(txn.pk))
+
+    def test_queryset_status_update_is_a_change(self):
+        _, cursor = self.sync()
+        pk = Transaction.objects.filter(to_account=self.own).values_list('pk', flat=True).first()
+        Transaction.objects.filter(pk=pk).update(status='failed')
+        sync_activity_status([pk])
+
+        response = self.client.get('/api/banking/transactions/changes/', {'since': cursor})
+        self.assertEqual([(row['id'], row['status']) for row in response.json()['results']], [(str(pk), 'failed')])
+
+    def test_recent_changes_are_held_back(self):
+        with self.settings(DELTA_SYNC_SETTLE_SECONDS=3600):
+            ids, cursor = self.sync()
+        self.assertEqual(ids, [])
+        self.assertIsNone(cursor)
+
+
+class TransactionExportTests(BankingTestCase):
+    """Exports stream every row with its account numbers from a single query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own, cls.other = cls.create_customers('export')
+        cls.user = cls.own.user
+
+        now = timezone.now()
+        transactions = cls.seed_transactions(40, lambda index: {
+            'description': 'Seeded, "quoted" transfer',
+            'from_account': cls.own,
+            'to_account': cls.other if index % 2 else None,
+            'recipient_account_number': '' if index % 2 else '9876543210',
+        })
+        # created_at is auto_now_add, so the history is spread over past days afterwards
+        for index, txn in enumerate(transactions):
+            created_at = now - timedelta(days=index)
+            Transaction.objects.filter(pk=txn.pk).update(created_at=created_at)
+            AccountActivity.objects.filter(transaction=txn).update(created_at=created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/api/banking/transactions/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(response.streaming_content)
+        self.assertEqual(len(queries), 1)
+        return response, body
+
+    def test_csv(self):
+        today = timezone.localdate()
+        _, body = self.export(start=(today - timedelta(days=9)).isoformat(), end=today.isoformat())
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['Description'], 'Seeded, "quoted" transfer')
+        self.assertEqual({row['From Account'] for row in rows}, {self.own.account_number})
+        self.assertEqual({row['To Account'] for row in rows}, {self.other.account_number, ''})
+
+    def test_gzipped_jsonl(self):
+        response, body = self.export(output='jsonl', gzip='true', start='2000-01-01')
+        self.assertIn('.jsonl.gz', response['Content-Disposition'])
+        rows = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+        self.assertEqual(len(rows), 40)
+        self.assertEqual(rows[0]['from_account_account_number'], self.own.account_number)
+
+    def test_bad_parameters(self):
+        for params in ({'start': 'yesterday'}, {'start': '2025-02-01', 'end': '2025-01-01'}, {'output': 'xml'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/banking/transactions/export/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class TransactionChangelistStatsTests(BankingTestCase):
+    """The admin changelist statistics cost one aggregate per filter combination"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('stats', 'stats@example.com', 'x')
+        account = BankAccount.objects.create(
+            user=cls.admin, account_number=allocate_account_numbers()[0], account_name='Stats'
+        )
+        statuses = ['pending', 'completed', 'completed', 'failed']
+        cls.seed_transactions(20, lambda index: {
+            'transaction_type': 'deposit',
+            'amount': Decimal('10.00'),
+            'total_amount': Decimal('10.00'),
+            'description': 'Seeded deposit',
+            'status': statuses[index % len(statuses)],
+            'to_account': account,
+        }, activity=False)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def changelist(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/banking/transaction/', params or {})
+        self.assertEqual(response.status_code, 200)
+        aggregates = [query['sql'] for query in queries if 'SUM(' in query['sql'].upper()]
+        return response.context['transaction_stats'], aggregates
+
+    def test_one_aggregate_then_cached(self):
+        stats, aggregates = self.changelist()
+        self.assertEqual(len(aggregates), 1)
+        self.assertEqual(stats, {
+            'total_transactions': 20, 'total_amount': Decimal('200.00'),
+            'pending_count': 5, 'completed_count': 10, 'failed_count': 5,
+            'pending_amount': Decimal('50.00'), 'completed_amount': Decimal('100.00'),
+        })
+
+        cached, aggregates = self.changelist({'p': '1'})
+        self.assertEqual(aggregates, [])
+        self.assertEqual(cached, stats)
+
+    def test_filters_are_cached_separately(self):
+        self.changelist()
+        stats, aggregates = self.changelist({'status__exact': 'failed'})
+        self.assertEqual(len(aggregates), 1)
+        self.assertEqual((stats['total_transactions'], stats['failed_count']), (5, 5))
+
+
+class PostingTestCase(BankingTestCase):
+    """A payer holding 100.00, a payee, and due transfers between them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, cls.payee = cls.create_customers(cls.__name__.lower())
+        credit_account(cls.payer, Decimal('100.00'))
+
+    def transfer(self, **fields):
+        fields = {
+            'transaction_type': 'transfer',
+            'amount': Decimal('30.00'),
+            'total_amount': Decimal('30.00'),
+            'description': 'Due transfer',
+            'from_account': self.payer,
+            'to_account': self.payee,
+            'confirmation_delay_hours': 0,
+            'expected_completion_date': date.today(),
+            **fields,
+        }
+        return Transaction.objects.create(**fields)
+
+    def balances(self):
+        return [BankAccount.objects.get(pk=account.pk).balance for account in (self.payer, self.payee)]
+
+    def customer_lines(self, txn):
+        return LedgerEntry.objects.filter(transaction=txn, ledger_account='customer').count()
+
+    def change_account(self, account, meanwhile=None, **changes):
+        """Open the admin change form, let meanwhile (by default a 5.00 credit) land, then submit the form"""
+        admin_user = User.objects.create_superuser('accountadmin', 'accountadmin@example.com', 'x')
+        self.client.force_login(admin_user)
+        url = f'/admin/accounts/bankaccount/{account.pk}/change/'
+        response = self.client.get(url)
+
+        form = response.context['adminform'].form
+        values = {name: form[name].value() for name in form.fields}
+        data = {name: value for name, value in values.items() if value is not None and value is not False}
+        for inline in response.context['inline_admin_formsets']:
+            management = inline.formset.management_form
+            data.update({management.add_prefix(name): management[name].value() for name in management.fields})
+        data.update(changes)
+
+        if meanwhile is None:
+            credit_account(account, Decimal('5.00'), description='Posted while the form was open')
+        else:
+            meanwhile()
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+
+class TransactionProcessingCommandTests(PostingTestCase):
+    """The processing commands move each transaction's money exactly once"""
+
+    def run_command(self, *args, command='process_pending_transactions'):
+        out = io.StringIO()
+        call_command(command, *args, stdout=out)
+        return out.getvalue()
+
+    def test_batch_mode_posts_once_across_runs(self):
+        txn = self.transfer()
+        self.run_command('--batch-size', '10')
+        self.run_command('--batch-size', '10')
+
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'completed')
+        self.assertEqual(self.balances(), [Decimal('70.00'), Decimal('30.00')])
+        self.assertEqual(self.customer_lines(txn), 2)
+
+    def test_failed_batch_does_not_discount_committed_ones(self):
+        deposits = [
+            Transaction.objects.create(
+                transaction_type='deposit', amount=Decimal('5.00'), total_amount=Decimal('5.00'),
+                description='Due deposit', to_account=self.payee, confirmation_delay_hours=0,
+            )
+            for _ in range(3)
+        ]
+        real_batch = posting.post_transactions_batch
+        calls = []
+
+        def flaky_batch(batch, *args, **kwargs):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise RuntimeError('lock timeout')
+            return real_batch(batch, *args, **kwargs)
+
+        with mock.patch('banking.management.commands.process_transactions.post_transactions_batch', flaky_batch):
+            output = self.run_command('--batch-size', '1', command='process_transactions')
+
+        self.assertIn('Success: 2, Failed: 1', output)
+        self.assertEqual(
+            [Transaction.objects.get(pk=txn.pk).status for txn in deposits], ['completed', 'pending', 'completed']
+        )
+        self.assertEqual(self.balances()[1], Decimal('10.00'))
+
+
+class WorkerClaimTests(PostingTestCase):
+    """Workers claim each due transaction once and never repost one that already moved money"""
+
+    def test_skip_locked_claim_posts_the_chunk(self):
+        first, second = self.transfer(), self.transfer(amount=Decimal('20.00'), total_amount=Decimal('20.00'))
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            posted, failed = claim_and_post(10, 'worker-a')
+            self.assertEqual(claim_and_post(10, 'worker-b'), ([], []))
+
+        self.assertEqual({txn.pk for txn in posted}, {first.pk, second.pk})
+        self.assertEqual(failed, [])
+        self.assertEqual(self.balances(), [Decimal('50.00'), Decimal('50.00')])
+
+    def test_compare_and_swap_leaves_rows_another_worker_won(self):
+        mine, theirs = self.transfer(), self.transfer()
+        # worker-b claims one row between worker-a reading the candidates and claiming them
+        Transaction.objects.filter(pk=theirs.pk).update(
+            status='processing', claimed_by='worker-b', claimed_at=timezone.now()
+        )
+        stale_view = Transaction.objects.filter(pk__in=[mine.pk, theirs.pk]).order_by('created_at')
+
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False), \
+                mock.patch('banking.workers.due_for_processing', lambda now=None: stale_view):
+            posted, _ = claim_and_post(10, 'worker-a')
+
+        self.assertEqual([txn.pk for txn in posted], [mine.pk])
+        theirs.refresh_from_db()
+        self.assertEqual((theirs.status, theirs.claimed_by), ('processing', 'worker-b'))
+        self.assertEqual(self.customer_lines(theirs), 0)
+        self.assertEqual(self.balances(), [Decimal('70.00'), Decimal('30.00')])
+
+    def test_stale_claims_are_released(self):
+        stale, fresh, posted = self.transfer(), self.transfer(), self.transfer()
+        now = timezone.now()
+        Transaction.objects.filter(pk__in=[stale.pk, posted.pk]).update(
+            status='processing', claimed_by='worker-gone', claimed_at=now - CLAIM_LEASE * 2
+        )
+        Transaction.objects.filter(pk=posted.pk).update(processed_at=now)
+        Transaction.objects.filter(pk=fresh.pk).update(status='processing', claimed_by='worker-a', claimed_at=now)
+
+        self.assertEqual(release_stale_claims(), 1)
+        self.assertEqual(
+            [Transaction.objects.get(pk=txn.pk).status for txn in (stale, fresh, posted)],
+            ['pending', 'processing', 'processing']
+        )
+        self.assertEqual(Transaction.objects.get(pk=stale.pk).claimed_by, '')
+
+    def test_rows_debited_on_submission_are_not_claimed(self):
+        # external_transfer debits the sender up front and leaves the row pending
+        txn = self.transfer(to_account=None)
+        debit_account(self.payer, Decimal('30.00'), contra='external_clearing', transaction_obj=txn)
+
+        self.assertFalse(due_for_processing().filter(pk=txn.pk).exists())
+        for skip_locked in (True, False):
+            with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', skip_locked):
+                self.assertEqual(claim_and_post(10, 'worker-a'), ([], []))
+        self.assertEqual(post_transactions_batch([txn]), ([], []))
+        self.assertFalse(txn.process_transaction())
+
+        self.assertEqual(self.balances()[0], Decimal('70.00'))
+        self.assertEqual(self.customer_lines(txn), 1)
+
+
+class TransactionSchedulerTests(PostingTestCase):
+    """The scheduler posts each transaction at its due time and completes every due date it sees"""
+
+    def scheduler(self):
+        scheduler = TransactionScheduler()
+        scheduler.load()
+        return scheduler
+
+    def test_transactions_post_when_due(self):
+        txn = self.transfer()
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.fire_due(txn.created_at - timedelta(seconds=1)), (0, 0))
+        self.assertEqual(scheduler.fire_due(), (1, 0))
+        # Posting put today's completion back on the heap
+        scheduler.fire_due()
+
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'completed')
+        self.assertEqual(self.balances(), [Decimal('70.00'), Decimal('30.00')])
+
+    def test_rows_debited_on_submission_are_not_scheduled(self):
+        txn = self.transfer(to_account=None)
+        debit_account(self.payer, Decimal('30.00'), contra='external_clearing', transaction_obj=txn)
+        scheduler = self.scheduler()
+
+        self.assertNotIn((POST, txn.pk), scheduler._scheduled)
+        scheduler.add([txn.pk])
+        self.assertEqual(scheduler.fire_due(), (0, 0))
+        self.assertEqual(self.balances()[0], Decimal('70.00'))
+
+    def test_a_date_is_completed_again_when_it_becomes_due_again(self):
+        first = self.transfer()
+        scheduler = self.scheduler()
+        scheduler.fire_due()
+        scheduler.refresh()
+        scheduler.fire_due()
+        self.assertEqual(Transaction.objects.get(pk=first.pk).status, 'completed')
+
+        # Today's completion has run; a transfer due today after that still gets completed
+        second = self.transfer(amount=Decimal('20.00'), total_amount=Decimal('20.00'))
+        scheduler.refresh()
+        self.assertEqual(scheduler.fire_due(), (1, 0))
+        scheduler.fire_due()
+
+        self.assertEqual([Transaction.objects.get(pk=txn.pk).status for txn in (first, second)], ['completed'] * 2)
+        self.assertEqual(self.balances(), [Decimal('50.00'), Decimal('50.00')])
+        self.assertEqual([self.customer_lines(txn) for txn in (first, second)], [2, 2])
+
+    def test_unfinished_completions_are_retried(self):
+        self.transfer(status='confirmed')
+        scheduler = self.scheduler()
+        now = timezone.now()
+        with mock.patch('banking.scheduler.call_command'):
+            scheduler.fire_due(now)
+        self.assertEqual(scheduler.seconds_until_next(now), scheduler.completion_retry.total_seconds())
+
+    def test_refresh_only_reads_new_rows(self):
+        self.transfer()
+        scheduler = self.scheduler()
+        with CaptureQueriesContext(connection) as queries:
+            scheduler.refresh()
+        table = Transaction._meta.db_table
+        reads = [query['sql'] for query in queries if f'"{table}"' in query['sql']]
+        self.assertEqual(len(reads), 2)
+        for sql in reads:
+            self.assertIn(f'"{table}"."created_at" >=', sql)
+
+
+class HoldTests(PostingTestCase):
+    """Holds reserve available funds with one conditional UPDATE and always come back"""
+
+    def account(self):
+        return BankAccount.objects.get(pk=self.payer.pk)
+
+    def assertFunds(self, available, held):
+        account = self.account()
+        self.assertEqual((account.balance, account.available_balance, account.hold_balance),
+                         (Decimal(available) + Decimal(held), Decimal(available), Decimal(held)))
+
+    def test_place_and_release(self):
+        txn = self.transfer()
+        place_hold(txn)
+        self.assertFunds('70.00', '30.00')
+        self.assertEqual(Transaction.objects.get(pk=txn.pk).held_amount, Decimal('30.00'))
+
+        self.assertEqual(release_hold(txn), Decimal('30.00'))
+        self.assertEqual(release_hold(txn), Decimal('0'))
+        self.assertFunds('100.00', '0.00')
+
+    def test_posting_takes_the_hold(self):
+        txn = self.transfer()
+        place_hold(txn)
+        post_transaction(txn)
+
+        self.assertFunds('70.00', '0.00')
+        self.assertEqual(Transaction.objects.get(pk=txn.pk).held_amount, Decimal('0.00'))
+        self.assertEqual(release_hold(txn), Decimal('0'))
+        self.assertFunds('70.00', '0.00')
+
+    def test_reserve_is_refused_beyond_available_funds(self):
+        place_hold(self.transfer(amount=Decimal('80.00'), total_amount=Decimal('80.00')))
+        txn = self.transfer()
+        with self.assertRaises(InsufficientFundsError):
+            place_hold(txn)
+        self.assertFunds('20.00', '80.00')
+        self.assertEqual(Transaction.objects.get(pk=txn.pk).held_amount, Decimal('0.00'))
+
+    def test_reserves_from_stale_copies_never_overcommit(self):
+        # Two requests loaded the account while it still showed 100.00 available
+        first = self.transfer(amount=Decimal('60.00'), total_amount=Decimal('60.00'))
+        second = self.transfer(amount=Decimal('60.00'), total_amount=Decimal('60.00'))
+        first.from_account, second.from_account = self.account(), self.account()
+
+        place_hold(first)
+        with self.assertRaises(InsufficientFundsError):
+            place_hold(second)
+        self.assertFunds('40.00', '60.00')
+
+    def test_admin_edit_keeps_holds_placed_while_the_form_was_open(self):
+        txn = self.transfer()
+        self.change_account(self.payer, meanwhile=lambda: place_hold(txn), account_name='Held')
+        self.assertFunds('70.00', '30.00')
+
+        # The reserve still counts the hold, so it cannot overcommit
+        with self.assertRaises(InsufficientFundsError):
+            place_hold(self.transfer(total_amount=Decimal('80.00')))
+
+    def test_admin_status_actions_release_holds(self):
+        admin_user = User.objects.create_superuser('holds', 'holds@example.com', 'x')
+        self.client.force_login(admin_user)
+        for action in ('mark_transactions_completed', 'mark_transactions_pending', 'mark_transactions_failed'):
+            with self.subTest(action=action):
+                txn = self.transfer()
+                place_hold(txn)
+                response = self.client.post('/admin/banking/transaction/', {
+                    'action': action, '_selected_action': [str(txn.pk)],
+                })
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(Transaction.objects.get(pk=txn.pk).held_amount, Decimal('0.00'))
+                self.assertFunds('100.00', '0.00')
+
+
+class AccountActivityTests(PostingTestCase):
+    """AccountActivity mirrors every transaction's accounts and status"""
+
+    def activity(self, txn):
+        return sorted(AccountActivity.objects.filter(transaction=txn).values_list('account_id', 'direction', 'status'))
+
+    def test_rows_follow_the_transaction(self):
+        txn = self.transfer()
+        self.assertEqual(self.activity(txn), sorted([
+            (self.payer.pk, 'out', 'pending'), (self.payee.pk, 'in', 'pending'),
+        ]))
+
+        txn.status = 'completed'
+        txn.save()
+        self.assertEqual({status for _, _, status in self.activity(txn)}, {'completed'})
+
+        Transaction.objects.filter(pk=txn.pk).update(to_account=None)
+        txn.refresh_from_db()
+        rebuild_activity(txn)
+        self.assertEqual(self.activity(txn), [(self.payer.pk, 'out', 'completed')])
+
+    def test_queryset_updates_are_synced(self):
+        txn = self.transfer()
+        Transaction.objects.filter(pk=txn.pk).update(status='failed')
+        self.assertEqual(sync_activity_status([txn.pk]), 2)
+        self.assertEqual({status for _, _, status in self.activity(txn)}, {'failed'})
+
+    def test_admin_actions_sync_under_a_status_filter(self):
+        admin_user = User.objects.create_superuser('projection', 'projection@example.com', 'x')
+        self.client.force_login(admin_user)
+        txn = self.transfer()
+        response = self.client.post('/admin/banking/transaction/?status__exact=pending', {
+            'action': 'mark_transactions_completed', '_selected_action': [str(txn.pk)],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual({status for _, _, status in self.activity(txn)}, {'completed'})
+
+    def test_account_reads_come_from_the_projection(self):
+        first, second = self.transfer(), self.transfer(status='completed')
+        self.assertEqual(
+            list(recent_transactions([self.payer, self.payee], 10).values_list('pk', flat=True)),
+            [second.pk, first.pk]
+        )
+        self.assertEqual(list(account_transactions([self.payee], status='completed')), [second])
+
+
+class ConditionalDebitTests(PostingTestCase):
+    """A debit is one conditional UPDATE: it applies in full or raises and changes nothing"""
+
+    def test_insufficient_funds_change_nothing(self):
+        with self.assertRaises(InsufficientFundsError):
+            debit_account(self.payer, Decimal('100.01'))
+        self.assertEqual(self.balances()[0], Decimal('100.00'))
+        self.assertFalse(LedgerEntry.objects.filter(account=self.payer, entry_type='debit').exists())
+
+    def test_debits_from_stale_copies_never_overdraw(self):
+        first, second = BankAccount.objects.get(pk=self.payer.pk), BankAccount.objects.get(pk=self.payer.pk)
+        self.assertEqual(debit_account(first, Decimal('60.00')), (Decimal('100.00'), Decimal('40.00')))
+        with self.assertRaises(InsufficientFundsError):
+            debit_account(second, Decimal('60.00'))
+        self.assertEqual(debit_account(second, Decimal('40.00')), (Decimal('40.00'), Decimal('0.00')))
+        self.assertEqual(self.balances()[0], Decimal('0.00'))
+
+    def test_overdraft_limit_extends_the_check(self):
+        BankAccount.objects.filter(pk=self.payer.pk).update(overdraft_limit=Decimal('50.00'))
+        debit_account(self.payer, Decimal('150.00'), use_overdraft_limit=True)
+        with self.assertRaises(InsufficientFundsError):
+            debit_account(self.payer, Decimal('0.01'), use_overdraft_limit=True)
+        self.assertEqual(self.balances()[0], Decimal('-50.00'))
+
+
+
+class LedgerTests(PostingTestCase):
+    """Every posting is a balanced set of ledger lines that explains the balances"""
+
+    def assert_balanced(self):
+        nets = {}
+        for entry in LedgerEntry.objects.all():
+            nets[entry.posting_id] = nets.get(entry.posting_id, Decimal('0')) + entry.signed_amount
+        self.assertEqual({net for net in nets.values()}, {Decimal('0')})
+        for account in (self.payer, self.payee):
+            lines = LedgerEntry.objects.filter(account=account, ledger_account='customer')
+            self.assertEqual(
+                sum((entry.signed_amount for entry in lines), Decimal('0')),
+                BankAccount.objects.get(pk=account.pk).balance
+            )
+
+    def test_postings_are_double_entry(self):
+        post_transaction(self.transfer(fee=Decimal('2.00'), total_amount=Decimal('32.00')))
+        debit_account(self.payee, Decimal('10.00'))
+        self.assertEqual(self.balances(), [Decimal('68.00'), Decimal('20.00')])
+        self.assert_balanced()
+
+    def test_reversal_restores_balances(self):
+        txn = self.transfer()
+        post_transaction(txn)
+        self.assertEqual(posting.reverse_postings(txn), 2)
+        self.assertEqual(self.balances(), [Decimal('100.00'), Decimal('0.00')])
+        self.assertEqual(self.customer_lines(txn), 4)
+        self.assert_balanced()
+
+    def test_reversal_without_postings_changes_nothing(self):
+        self.assertEqual(posting.reverse_postings(self.transfer()), 0)
+        self.assertEqual(self.balances(), [Decimal('100.00'), Decimal('0.00')])
+
+    def test_open_ledger_anchors_a_balance_funded_outside_it(self):
+        BankAccount.objects.filter(pk=self.payee.pk).update(balance=Decimal('50.00'))
+        self.assertEqual(posting.open_ledger(self.payee), Decimal('50.00'))
+
+        opening = LedgerEntry.objects.get(account=self.payee)
+        self.assertEqual(
+            (opening.entry_type, opening.amount, opening.balance_after), ('credit', Decimal('50.00'), Decimal('50.00'))
+        )
+        self.assertEqual(self.balances(), [Decimal('100.00'), Decimal('50.00')])
+        self.assert_balanced()
+
+    def test_saving_a_stale_copy_keeps_posted_balances(self):
+        stale = BankAccount.objects.get(pk=self.payer.pk)
+        credit_account(self.payer, Decimal('50.00'))
+        stale.account_name = 'Renamed'
+        stale.save()
+
+        account = BankAccount.objects.get(pk=self.payer.pk)
+        self.assertEqual(
+            (account.account_name, account.balance, account.available_balance, account.ledger_sequence),
+            ('Renamed', Decimal('150.00'), Decimal('150.00'), self.payer.ledger_sequence)
+        )
+        # The sequence was not wound back, so the next posting still records its ledger line
+        credit_account(account, Decimal('1.00'))
+        self.assertEqual(self.balances()[0], Decimal('151.00'))
+        self.assert_balanced()
+
+    def test_admin_adjustment_keeps_postings_made_while_the_form_was_open(self):
+        self.change_account(self.payer, balance_adjustment='-10.00')
+        self.assertEqual(self.balances()[0], Decimal('95.00'))
+        adjustment = LedgerEntry.objects.filter(account=self.payer).latest('sequence')
+        self.assertEqual((adjustment.entry_type, adjustment.amount), ('debit', Decimal('10.00')))
+        self.assert_balanced()
+
+    def test_admin_edit_without_adjustment_keeps_the_balance(self):
+        self.change_account(self.payer, account_name='Renamed')
+        account = BankAccount.objects.get(pk=self.payer.pk)
+        self.assertEqual((account.account_name, account.balance), ('Renamed', Decimal('105.00')))
+        self.assert_balanced()
+
+
+class BusinessCalendarTests(SimpleTestCase):
+    """The precomputed tables agree with walking the calendar day by day"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.calendar = BusinessCalendar(2022, 2026)
+        cls.holidays = holidays.US(years=range(2020, 2029))
+        # A few weeks either side of the tables exercise the fallback too
+        first, last = date(2021, 12, 1), date(2027, 1, 31)
+        cls.days = [first + timedelta(days=index) for index in range((last - first).days + 1)]
+
+    def is_open(self, day):
+        return day.weekday() < 5 and day not in self.holidays
+
+    def walk_forward(self, day, days_ahead):
+        while days_ahead:
+            day += timedelta(days=1)
+            days_ahead -= self.is_open(day)
+        return day
+
+    def walk_between(self, start, end):
+        return sum(self.is_open(start + timedelta(days=index)) for index in range(1, (end - start).days + 1))
+
+    def test_tables_match_the_calendar(self):
+        running = 0
+        for index in range(len(self.calendar._open)):
+            day = self.calendar.start + timedelta(days=index)
+            self.assertEqual(bool(self.calendar._open[index]), self.is_open(day), day)
+            self.assertEqual(self.calendar._count_before[index], running, day)
+            running += self.is_open(day)
+        self.assertEqual(self.calendar._count_before[-1], running)
+        self.assertEqual(len(self.calendar._positions), running)
+
+    def test_is_business_day(self):
+        self.assertEqual(
+            [self.calendar.is_business_day(day) for day in self.days], [self.is_open(day) for day in self.days]
+        )
+
+    def test_add_business_days(self):
+        for days_ahead in (1, 2, 5, 23):
+            self.assertEqual(
+                [self.calendar.add_business_days(day, days_ahead) for day in self.days],
+                [self.walk_forward(day, days_ahead) for day in self.days],
+                days_ahead
+            )
+
+    def test_business_days_between(self):
+        for span in (-3, 0, 1, 4, 30):
+            ends = [day + timedelta(days=span) for day in self.days]
+            self.assertEqual(
+                [self.calendar.business_days_between(start, end) for start, end in zip(self.days, ends)],
+                [self.walk_between(start, end) for start, end in zip(self.days, ends)],
+                span
+            )
+
+    def test_observed_holiday_on_a_friday(self):
+        # Independence Day 2026 is a Saturday, observed on Friday the 3rd
+        self.assertFalse(self.calendar.is_business_day(date(2026, 7, 3)))
+        self.assertTrue(self.calendar.is_business_day(date(2026, 7, 6)))
+        self.assertEqual(self.calendar.add_business_days(date(2026, 7, 2)), date(2026, 7, 6))
+
+
+class TransactionFeedPaginationTests(BankingTestCase):
+    """The transaction list is a keyset feed merged from one branch per account"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.checking, cls.stranger = cls.create_customers('feed')
+        cls.user = cls.checking.user
+        cls.savings = BankAccount.objects.create(
+            user=cls.user, account_number=allocate_account_numbers()[0], account_name='Savings'
+        )
+        cls.base = timezone.now() - timedelta(days=1)
+        routes = [
+            (cls.checking, cls.stranger),
+            (cls.stranger, cls.savings),
+            # Between the user's own accounts: in both branches, listed once
+            (cls.checking, cls.savings),
+        ]
+        cls.transactions = cls.seed_transactions(12, lambda index: {
+            'from_account': routes[index % 3][0],
+            'to_account': routes[index % 3][1],
+            # Rows 6 onwards share a timestamp and are ordered by id
+            'created_at': cls.base - timedelta(minutes=min(index, 6)),
+        })
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected_order(self):
+        return [
+            str(pk) for _, pk in sorted(
+                Transaction.objects.filter(
+                    Q(from_account__user=self.user) | Q(to_account__user=self.user)
+                ).values_list('created_at', 'id'),
+                reverse=True
+            )
+        ]
+
+    def pages(self, page_size=5, between_pages=None):
+        url, pages = f'/api/banking/transactions/?page_size={page_size}', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(set(body), {'next', 'results'})
+            pages.append([row['id'] for row in body['results']])
+            url = body['next']
+            if between_pages and url:
+                between_pages(len(pages))
+        return pages
+
+    def test_branches_merge_newest_first_without_duplicates(self):
+        pages = self.pages()
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual([pk for page in pages for pk in page], self.expected_order())
+
+    def test_cursor_is_stable_under_concurrent_inserts(self):
+        served = set(self.expected_order())
+        late = []
+
+        def insert(page_number):
+            # A new transaction lands ahead of the feed, another behind the cursor
+            late.extend(self.seed_transactions(2, lambda index: {
+                'from_account': self.checking,
+                'to_account': self.stranger,
+                'created_at': timezone.now() if index == 0 else self.base - timedelta(hours=page_number),
+            }))
+
+        pages = self.pages(between_pages=insert)
+        listed = [pk for page in pages for pk in page]
+        self.assertEqual(len(listed), len(set(listed)))
+        # Nothing served before the inserts is skipped or repeated
+        self.assertTrue(served <= set(listed))
+        newer = {str(txn.pk) for txn in late if txn.created_at > self.base}
+        older = {str(txn.pk) for txn in late if txn.created_at < self.base}
+        self.assertFalse(newer & set(listed))
+        self.assertEqual(older - set(listed), set())
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/banking/transactions/', {'cursor': 'nonsense'}).status_code, 404)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@idempotent
+def _idempotent_deposit(request):
+    if request.data.get('explode'):
+        Transaction.objects.create(
+            transaction_type='deposit', amount=Decimal('1.00'), total_amount=Decimal('1.00'),
+            description='Half-done deposit', to_account=BankAccount.objects.get(user=request.user),
+        )
+        raise RuntimeError('processor timed out')
+    txn = Transaction.objects.create(
+        transaction_type='deposit', amount=Decimal(request.data['amount']), total_amount=Decimal(request.data['amount']),
+        description='Idempotent deposit', to_account=BankAccount.objects.get(user=request.user),
+    )
+    return Response({'reference': txn.reference}, status=201)
+
+
+class IdempotencyKeyTests(PostingTestCase):
+    """A repeated Idempotency-Key runs the view once and replays its response"""
+
+    def call(self, data, key='key-1'):
+        request = APIRequestFactory().post('/deposit/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user=self.payee.user)
+        return _idempotent_deposit(request)
+
+    def deposits(self):
+        return Transaction.objects.filter(to_account=self.payee, transaction_type='deposit').count()
+
+    def test_retry_replays_the_response(self):
+        first = self.call({'amount': '5.00', 'pin': '1234'})
+        second = self.call({'amount': '5.00', 'pin': '1234'})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.data), (201, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.deposits(), 1)
+
+    def test_key_reused_for_another_body_is_refused(self):
+        self.call({'amount': '5.00'})
+        self.assertEqual(self.call({'amount': '6.00'}).status_code, 422)
+        self.assertEqual(self.deposits(), 1)
+
+    def test_stored_hash_is_keyed(self):
+        self.call({'amount': '5.00', 'pin': '1234'})
+        stored = IdempotencyKey.objects.get().request_hash
+        with self.settings(SECRET_KEY='another-secret-key-for-the-idempotency-test'):
+            self.call({'amount': '5.00', 'pin': '1234'}, key='key-2')
+        self.assertNotEqual(IdempotencyKey.objects.get(key='key-2').request_hash, stored)
+
+    def test_concurrent_duplicate_waits_for_the_first_response(self):
+        self.call({'amount': '5.00'})
+        # Put the key back in flight, as seen by a duplicate arriving mid-request
+        record = IdempotencyKey.objects.get()
+        stored_status, stored_body = record.response_status, record.response_body
+        IdempotencyKey.objects.filter(pk=record.pk).update(response_status=None, response_body=None)
+
+        def first_request_finishes(seconds):
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                response_status=stored_status, response_body=stored_body
+            )
+
+        with mock.patch('banking.idempotency.time.sleep', side_effect=first_request_finishes) as sleep:
+            response = self.call({'amount': '5.00'})
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(self.deposits(), 1)
+
+    def test_duplicate_runs_the_view_when_the_first_gives_up_its_key(self):
+        self.call({'amount': '5.00'})
+        IdempotencyKey.objects.update(response_status=None, response_body=None)
+
+        with mock.patch('banking.idempotency.time.sleep',
+                        side_effect=lambda seconds: IdempotencyKey.objects.all().delete()):
+            response = self.call({'amount': '5.00'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.deposits(), 2)
+
+    def test_duplicate_gets_409_while_the_first_is_still_running(self):
+        self.call({'amount': '5.00'})
+        IdempotencyKey.objects.update(response_status=None, response_body=None)
+
+        with self.settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            response = self.call({'amount': '5.00'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.deposits(), 1)
+
+    def test_key_of_a_request_that_died_reports_an_unknown_outcome(self):
+        self.call({'amount': '5.00'})
+        # The worker was killed before it stored the response
+        IdempotencyKey.objects.update(
+            response_status=None, response_body=None, created_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        with mock.patch('banking.idempotency.time.sleep') as sleep:
+            response = self.call({'amount': '5.00'})
+            replayed = self.call({'amount': '5.00'})
+        sleep.assert_not_called()
+        self.assertEqual((response.status_code, response.data['outcome']), (500, 'unknown'))
+        self.assertEqual((replayed.status_code, replayed.data), (500, response.data))
+        self.assertEqual(self.deposits(), 1)
+
+    def test_failed_request_is_not_run_again(self):
+        with self.assertRaises(RuntimeError):
+            self.call({'explode': True})
+        response = self.call({'explode': True})
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (500, 'true'))
+        self.assertEqual(self.deposits(), 1)
+
+    def test_expired_keys_are_evicted(self):
+        self.call({'amount': '5.00'})
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.call({'amount': '5.00'}).status_code, 201)
+        self.assertEqual(self.deposits(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
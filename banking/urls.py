@@ -8,6 +8,8 @@ urlpatterns = [
     path('transactions/<uuid:pk>/', views.TransactionDetailView.as_view(), name='transaction-detail'),
     path('transactions/<uuid:transaction_id>/status/', views.transaction_status, name='transaction-status'),
     path('transactions/pending/', views.pending_transactions, name='pending-transactions'),
+    path('transactions/changes/', views.transaction_changes, name='transaction-changes'),
+    path('transactions/export/', views.export_transactions, name='transaction-export'),
     
     # Admin-only transaction management
     path('admin/transactions/pending/', views.admin_pending_transactions, name='admin-pending-transactions'),
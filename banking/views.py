@@ -5,17 +5,27 @@ from rest_framework.response import Response
 from django.db import transaction
 from django.db.models import Q, Sum
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.conf import settings
+from datetime import datetime, time, timedelta
 from django.contrib.auth.hashers import check_password
 from decimal import Decimal
 import re
-from .models import Transaction, TransferRequest, Card, DepositRequest
+from .models import Transaction, TransferRequest, Card, DepositRequest, AccountActivity
 from accounts.models import BankAccount, UserProfile
+from accounts.fieldsets import SparseFieldsetViewMixin
 from .serializers import (
-    TransactionSerializer, TransferRequestSerializer, CardSerializer,
+    TRANSACTION_RELATED, TransactionSerializer, TransferRequestSerializer, CardSerializer,
     CreateTransferSerializer, DepositSerializer, WithdrawalSerializer,
     CreateCardSerializer, ExternalTransferSerializer
 )
 from .external_processors import get_payment_processor, get_compliance_checker
+from .posting import debit_account, credit_account, place_hold, InsufficientFundsError
+from .idempotency import idempotent
+from .pagination import TransactionCursorPagination, encode_cursor, decode_cursor
+from .activity import account_transactions, changed_transactions
+from .exports import EXPORT_FORMATS, stream_transactions
+from .representations import get_representations, load_with_cached
 
 
 def determine_transfer_type(transfer_data, to_account_number, to_account=None):
@@ -52,17 +62,29 @@ def determine_transfer_type(transfer_data, to_account_number, to_account=None):
     return 'external'
 
 
-class TransactionListView(generics.ListAPIView):
-    """List user's transactions"""
+class TransactionListView(SparseFieldsetViewMixin, generics.ListAPIView):
+    """List user's transactions, newest first, a cursor page at a time"""
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TransactionCursorPagination
     
     def get_queryset(self):
         user_accounts = BankAccount.objects.filter(user=self.request.user)
         return Transaction.objects.filter(
             Q(from_account__in=user_accounts) | 
             Q(to_account__in=user_accounts)
-        ).distinct().order_by('-created_at')
+        ).select_related(*TRANSACTION_RELATED).distinct().order_by('-created_at')
+    
+    feed_id_field = 'transaction_id'
+    
+    def get_feed_branches(self):
+        """One activity index range scan per account instead of an OR with DISTINCT"""
+        account_ids = BankAccount.objects.filter(user=self.request.user).values_list('pk', flat=True)
+        return [AccountActivity.objects.filter(account_id=account_id) for account_id in account_ids]
+    
+    def get_feed_objects(self, queryset, ids):
+        """The page's ids come from the user's own activity, so cached renderings can be used as they are"""
+        return load_with_cached(queryset, ids)
 
 
 class TransactionDetailView(generics.RetrieveAPIView):
@@ -76,10 +98,20 @@ class TransactionDetailView(generics.RetrieveAPIView):
             Q(from_account__in=user_accounts) | 
             Q(to_account__in=user_accounts)
         ).distinct()
+    
+    def retrieve(self, request, *args, **kwargs):
+        # A cached terminal transaction only needs the ownership check
+        cached = get_representations([kwargs['pk']]).get(kwargs['pk'])
+        if cached is not None and AccountActivity.objects.filter(
+            transaction_id=kwargs['pk'], account__user=request.user
+        ).exists():
+            return Response(cached)
+        return super().retrieve(request, *args, **kwargs)
 
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def transfer_funds(request):
     """Transfer funds between accounts - now creates pending transaction"""
     serializer = CreateTransferSerializer(data=request.data)
@@ -118,18 +150,10 @@ def transfer_funds(request):
     amount = serializer.validated_data['amount']
     description = serializer.validated_data.get('description', '')
     
-    # Check if user has sufficient balance (including pending and processing transactions)
-    from django.db.models import Sum
-    pending_debits = Transaction.objects.filter(
-        from_account=from_account,
-        status__in=['pending', 'confirmed', 'processing']
-    ).aggregate(total=Sum('total_amount'))['total'] or 0
-    
-    available_balance = from_account.balance - pending_debits
-    
-    if available_balance < amount:
+    # Check if user has sufficient balance (funds held for pending transactions are excluded)
+    if from_account.available_balance < amount:
         return Response({
-            'error': f'Insufficient balance. Available: {available_balance}'
+            'error': f'Insufficient balance. Available: {from_account.available_balance}'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Determine transfer type and processing delay
@@ -141,53 +165,63 @@ def transfer_funds(request):
         processing_delay = 2  # Different users - 2 days minimum
     
     # Create pending transaction and transfer request
-    with transaction.atomic():
-        # Create transaction record as processing (funds will be deducted)
-        transfer_transaction = Transaction.objects.create(
-            from_account=from_account,
-            to_account=to_account,
-            transaction_type='transfer',
-            amount=amount,
-            description=description,
-            status='processing',  # Processing status indicates funds are deducted
-            from_balance_before=from_account.balance,
-            to_balance_before=to_account.balance if to_account else None,
-            recipient_name=to_account.account_name or to_account.user.get_full_name() if to_account else '',
-            recipient_account_number=to_account.account_number if to_account else '',
-            channel='online',
-            status_message=f'Internal transfer to {to_account.account_name or to_account.user.get_full_name() if to_account else "external account"}'
-        )
+    try:
+        with transaction.atomic():
+            # Create transaction record as processing (funds will be deducted)
+            transfer_transaction = Transaction.objects.create(
+                from_account=from_account,
+                to_account=to_account,
+                transaction_type='transfer',
+                amount=amount,
+                description=description,
+                status='processing',  # Processing status indicates funds are deducted
+                from_balance_before=from_account.balance,
+                to_balance_before=to_account.balance if to_account else None,
+                recipient_name=to_account.account_name or to_account.user.get_full_name() if to_account else '',
+                recipient_account_number=to_account.account_number if to_account else '',
+                channel='online',
+                status_message=f'Internal transfer to {to_account.account_name or to_account.user.get_full_name() if to_account else "external account"}'
+            )
         
-        # Process the transaction immediately to deduct funds
-        transfer_transaction.process_transaction()
+            # Process the transaction immediately to deduct funds
+            transfer_transaction.process_transaction()
         
-        # Create transfer request record
-        transfer_request = TransferRequest.objects.create(
-            from_account=from_account,
-            to_account_number=to_account.account_number if to_account else serializer.validated_data.get('to_account_number', ''),
-            to_account=to_account,
-            amount=amount,
-            description=description,
-            status='processing',  # Processing status indicates funds are being processed
-            transfer_type=transfer_type,
-            processing_delay_days=processing_delay,
-            beneficiary_name=to_account.account_name or to_account.user.get_full_name() if to_account else serializer.validated_data.get('beneficiary_name', ''),
-            transaction=transfer_transaction
-        )
+            # Reserve the transfer amount until the transfer completes
+            place_hold(transfer_transaction, amount)
         
-        # Calculate and apply transfer fees
-        transfer_request.transfer_fee = transfer_request.get_transfer_fee()
-        transfer_request.save()
+            # Create transfer request record
+            transfer_request = TransferRequest.objects.create(
+                from_account=from_account,
+                to_account_number=to_account.account_number if to_account else serializer.validated_data.get('to_account_number', ''),
+                to_account=to_account,
+                amount=amount,
+                description=description,
+                status='processing',  # Processing status indicates funds are being processed
+                transfer_type=transfer_type,
+                processing_delay_days=processing_delay,
+                beneficiary_name=to_account.account_name or to_account.user.get_full_name() if to_account else serializer.validated_data.get('beneficiary_name', ''),
+                transaction=transfer_transaction
+            )
         
-        # Update transaction with fees and deduct fee amount
-        if transfer_request.transfer_fee > 0:
-            transfer_transaction.fee = transfer_request.transfer_fee
-            transfer_transaction.total_amount = amount + transfer_request.transfer_fee
-            transfer_transaction.save()
+            # Calculate and apply transfer fees
+            transfer_request.transfer_fee = transfer_request.get_transfer_fee()
+            transfer_request.save()
+        
+            # Update transaction with fees and deduct fee amount
+            if transfer_request.transfer_fee > 0:
+                transfer_transaction.fee = transfer_request.transfer_fee
+                transfer_transaction.total_amount = amount + transfer_request.transfer_fee
+                transfer_transaction.save()
             
-            # Deduct the fee from account balance (amount was already deducted by process_transaction)
-            from_account.balance -= transfer_request.transfer_fee
-            from_account.save()
+                # Deduct the fee from account balance (amount was already deducted by process_transaction)
+                debit_account(
+                    from_account, transfer_request.transfer_fee, contra='fee_income',
+                    transaction_obj=transfer_transaction, description='Transfer fee'
+                )
+    except InsufficientFundsError:
+        return Response({
+            'error': f'Insufficient balance. Available: {from_account.available_balance}'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Send notification after successful transfer
     def send_notification_after_commit():
@@ -310,19 +344,83 @@ def admin_confirm_transaction(request, transaction_id):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def transaction_changes(request):
+    """
+    Transactions inserted or changed since ?since=<cursor>, oldest change first
+    
+    Returns the changes and the cursor to send next time; has_more means
+    another page is waiting. Without since, every transaction is sent, which
+    gives a client its initial copy. Changes from the last
+    DELTA_SYNC_SETTLE_SECONDS are held back, so a transaction that commits
+    after a later one is not skipped.
+    """
+    since = request.query_params.get('since')
+    page_size = TransactionCursorPagination().get_page_size(request)
+    until = timezone.now() - timedelta(seconds=getattr(settings, 'DELTA_SYNC_SETTLE_SECONDS', 5))
+    account_ids = BankAccount.objects.filter(user=request.user).values_list('pk', flat=True)
+    
+    keys = changed_transactions(account_ids, decode_cursor(since) if since else None, page_size, until)
+    has_more = len(keys) > page_size
+    keys = keys[:page_size]
+    rows = load_with_cached(
+        Transaction.objects.select_related(*TRANSACTION_RELATED), [pk for _, pk in keys]
+    )
+    
+    return Response({
+        'results': TransactionSerializer(rows, many=True).data,
+        'cursor': encode_cursor(*keys[-1]) if keys else since,
+        'has_more': has_more,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_transactions(request):
+    """
+    Stream the user's transactions between ?start= and ?end= (YYYY-MM-DD, inclusive)
+    
+    ?output= is csv (default) or jsonl; ?gzip=true compresses the stream.
+    end defaults to today and start to 30 days before end.
+    """
+    try:
+        end = parse_date(request.query_params['end']) if request.query_params.get('end') else timezone.localdate()
+        start = parse_date(request.query_params['start']) if request.query_params.get('start') else end - timedelta(days=30)
+    except ValueError:
+        start = end = None
+    if start is None or end is None or start > end:
+        return Response({'error': 'start and end must be YYYY-MM-DD dates with start on or before end'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    output = request.query_params.get('output', 'csv')
+    if output not in EXPORT_FORMATS:
+        return Response({'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    # Whole local days as a half-open range, so the activity index is range-scanned per account
+    activity = AccountActivity.objects.filter(
+        account__in=BankAccount.objects.filter(user=request.user),
+        created_at__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+    transactions = Transaction.objects.filter(pk__in=activity.values('transaction_id')).order_by('created_at')
+    return stream_transactions(
+        transactions, output, compress=compress, filename=f'transactions-{start.isoformat()}-{end.isoformat()}'
+    )
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def pending_transactions(request):
     """Get user's pending transactions (read-only for users)"""
     user_accounts = BankAccount.objects.filter(user=request.user)
-    pending_txns = Transaction.objects.filter(
-        Q(from_account__in=user_accounts) | Q(to_account__in=user_accounts),
-        status='pending'
-    ).distinct().order_by('-created_at')
+    pending_txns = TransactionSerializer(account_transactions(user_accounts, status='pending'), many=True).data
     
     return Response({
-        'pending_transactions': TransactionSerializer(pending_txns, many=True).data,
-        'count': pending_txns.count(),
+        'pending_transactions': pending_txns,
+        'count': len(pending_txns),
         'note': 'Transactions will be automatically processed by our system within 1-5 business days'
     })
 
@@ -411,8 +509,10 @@ def admin_add_deposit(request):
             
             # If auto-approve, immediately credit the account
             if auto_approve:
-                target_account.balance += amount
-                target_account.save()
+                credit_account(
+                    target_account, amount, transaction_obj=deposit_transaction,
+                    description=deposit_transaction.description
+                )
         
         # Send notification to the user after successful admin deposit (only if auto-approved)
         if auto_approve:
@@ -507,6 +607,7 @@ def admin_pending_transactions(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def deposit_funds(request):
     """Deposit funds to user's account - creates pending transaction with automatic processing"""
     serializer = DepositSerializer(data=request.data)
@@ -593,6 +694,7 @@ def deposit_funds(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def withdraw_funds(request):
     """Withdraw funds from user's account - creates pending transaction with automatic processing"""
     serializer = WithdrawalSerializer(data=request.data)
@@ -620,36 +722,36 @@ def withdraw_funds(request):
     amount = serializer.validated_data['amount']
     description = serializer.validated_data.get('description', 'Withdrawal')
     
-    # Check if user has sufficient balance (including pending transactions)
-    from django.db import models
-    pending_debits = Transaction.objects.filter(
-        from_account=account,
-        status__in=['pending', 'processing']
-    ).aggregate(total=models.Sum('total_amount'))['total'] or Decimal('0')
-    
-    available_balance = account.balance - pending_debits
-    
-    if available_balance < amount:
+    # Check if user has sufficient balance (funds held for pending transactions are excluded)
+    if account.available_balance < amount:
         return Response({
-            'error': f'Insufficient balance. Available: ${available_balance}'
+            'error': f'Insufficient balance. Available: ${account.available_balance}'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Create pending withdrawal transaction
-    with transaction.atomic():
-        # Create transaction record as pending
-        withdrawal_transaction = Transaction.objects.create(
-            from_account=account,
-            transaction_type='withdrawal',
-            amount=amount,
-            description=description,
-            status='pending',
-            auto_confirm=True,
-            confirmation_delay_hours=1,  # Auto-confirm after 1 hour
-            channel='mobile'
-        )
+    try:
+        with transaction.atomic():
+            # Create transaction record as pending
+            withdrawal_transaction = Transaction.objects.create(
+                from_account=account,
+                transaction_type='withdrawal',
+                amount=amount,
+                description=description,
+                status='pending',
+                auto_confirm=True,
+                confirmation_delay_hours=1,  # Auto-confirm after 1 hour
+                channel='mobile'
+            )
         
-        # Process immediately for demonstration (in production, this would be handled by a background task)
-        withdrawal_transaction.process_transaction()
+            # Reserve the funds; processing below consumes the hold
+            place_hold(withdrawal_transaction)
+        
+            # Process immediately for demonstration (in production, this would be handled by a background task)
+            withdrawal_transaction.process_transaction()
+    except InsufficientFundsError:
+        return Response({
+            'error': f'Insufficient balance. Available: ${account.available_balance}'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Send notification after successful withdrawal
     def send_notification_after_commit():
@@ -695,11 +797,9 @@ def withdraw_funds(request):
 def transaction_status(request, transaction_id):
     """Get detailed status of a specific transaction"""
     try:
-        user_accounts = BankAccount.objects.filter(user=request.user)
         transaction_obj = Transaction.objects.filter(
-            id=transaction_id
-        ).filter(
-            Q(from_account__in=user_accounts) | Q(to_account__in=user_accounts)
+            id=transaction_id,
+            activity__account__user=request.user
         ).first()
         
         if not transaction_obj:
@@ -728,7 +828,7 @@ def transaction_status(request, transaction_id):
     })
 
 
-class CardListView(generics.ListCreateAPIView):
+class CardListView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """List user's cards or create new card"""
     serializer_class = CardSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -889,6 +989,7 @@ def get_card_fees(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def external_transfer(request):
     """External bank transfer to other banks (ACH/SWIFT)"""
     serializer = ExternalTransferSerializer(data=request.data)
@@ -920,14 +1021,9 @@ def external_transfer(request):
     beneficiary_name = data['beneficiary_name']
     description = data.get('description', f'External transfer to {beneficiary_name}')
     
-    # Check if user has sufficient balance (including pending transactions)
-    from django.db import models
-    pending_debits = Transaction.objects.filter(
-        from_account=from_account,
-        status__in=['pending', 'confirmed', 'processing']
-    ).aggregate(total=models.Sum('total_amount'))['total'] or 0
-    
-    available_balance = from_account.balance - pending_debits
+    # Check if user has sufficient balance (funds held for pending transactions are excluded).
+    # The debit below is conditional on the balance, so this is only an early rejection.
+    available_balance = from_account.available_balance
     
     # Estimate total cost with fees
     estimated_fee = Decimal('15.00') if transfer_type == 'domestic_external' else Decimal('45.00')
@@ -1065,8 +1161,16 @@ def external_transfer(request):
     
     # DEDUCT TOTAL AMOUNT (transfer + fees) FROM BALANCE
     total_deduction = amount + transfer_request.transfer_fee
-    from_account.balance -= total_deduction
-    from_account.save()
+    try:
+        debit_account(
+            from_account, total_deduction, contra='external_clearing', fee=transfer_request.transfer_fee,
+            transaction_obj=transfer_transaction, description=description
+        )
+    except InsufficientFundsError:
+        transfer_transaction.fail_transaction('Insufficient funds')
+        return Response({
+            'error': f'Insufficient balance. Required: {total_deduction}'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Send notification after successful external transfer
     def send_notification_after_commit():
@@ -1133,6 +1237,7 @@ def external_transfer(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def transfer_with_pin(request):
     """Transfer funds with PIN verification"""
     from accounts.models import UserProfile
@@ -1239,14 +1344,8 @@ def transfer_with_pin(request):
     if to_account:
         beneficiary_name = to_account.account_name or to_account.user.get_full_name()
     
-    # Check balance
-    from django.db import models
-    pending_debits = Transaction.objects.filter(
-        from_account=from_account,
-        status__in=['pending', 'confirmed', 'processing']
-    ).aggregate(total=models.Sum('total_amount'))['total'] or 0
-    
-    available_balance = from_account.balance - pending_debits
+    # Check balance (funds held for pending transactions are excluded; the debit below is conditional)
+    available_balance = from_account.available_balance
     
     if available_balance < amount:
         return Response({
@@ -1339,8 +1438,18 @@ def transfer_with_pin(request):
             
             # DEDUCT TOTAL AMOUNT (transfer + fees) FROM BALANCE
             total_deduction = amount + transfer_request.transfer_fee
-            from_account.balance -= total_deduction
-            from_account.save()
+            try:
+                debit_account(
+                    from_account, total_deduction, contra='external_clearing', fee=transfer_request.transfer_fee,
+                    transaction_obj=transfer_transaction, description=description or 'Transfer'
+                )
+            except InsufficientFundsError:
+                # Nothing was debited: clear the snapshots so fail_transaction has no funds to restore
+                transfer_transaction.from_balance_before = transfer_transaction.to_balance_before = None
+                transfer_transaction.fail_transaction('Insufficient funds')
+                return Response({
+                    'error': f'Insufficient balance. Required: {total_deduction}'
+                }, status=status.HTTP_400_BAD_REQUEST)
             print(f"DEBUG: Total funds deducted (amount + fees): {total_deduction}. New balance: {from_account.balance}")
             
             # Schedule notification to be sent after transaction commits successfully
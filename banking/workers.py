@@ -0,0 +1,216 @@
+"""
+Parallel transaction workers
+
+Workers claim disjoint chunks of due pending transactions and post them
+through the batch engine in banking.posting. On databases with
+SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, MySQL 8, Oracle) a worker locks
+its chunk and posts it inside the same database transaction, so workers on
+any number of hosts step over each other's rows instead of waiting on them.
+Elsewhere (SQLite) a chunk is claimed with a single compare-and-swap UPDATE
+from 'pending' to 'processing' tagged with the worker's id, and only the rows
+carrying that tag are posted.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+from datetime import timedelta
+
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import F, Value, ExpressionWrapper, DurationField, DateTimeField
+from django.utils import timezone
+
+from .models import Transaction
+from .activity import sync_activity_status
+from .posting import has_postings, post_transactions_batch
+
+logger = logging.getLogger(__name__)
+
+# Claims older than this whose posting never ran are handed back to the queue
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def scheduled_transactions():
+    """
+    Pending auto-confirm transactions annotated with the time they become due.
+
+    Rows that already have ledger lines (external transfers are debited when
+    they are submitted) are left out, so they are never posted a second time.
+    """
+    delay = ExpressionWrapper(
+        F('confirmation_delay_hours') * Value(timedelta(hours=1)),
+        output_field=DurationField()
+    )
+    return Transaction.objects.annotate(
+        due_at=ExpressionWrapper(F('created_at') + delay, output_field=DateTimeField())
+    ).filter(status='pending', auto_confirm=True).filter(~has_postings()).order_by('created_at')
+
+
+def due_for_processing(now=None):
+    """Pending auto-confirm transactions whose confirmation delay has passed"""
+    return scheduled_transactions().filter(due_at__lte=now or timezone.now())
+
+
+def worker_id(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def claim_and_post(chunk_size, claimed_by, use_overdraft_limit=False):
+    """Claim one chunk of due transactions and post it; returns (posted, failed) lists"""
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            chunk = list(
+                due_for_processing().select_for_update(skip_locked=True)[:chunk_size]
+            )
+            return post_transactions_batch(chunk, use_overdraft_limit=use_overdraft_limit)
+
+    now = timezone.now()
+    candidates = list(due_for_processing(now).values_list('pk', flat=True)[:chunk_size])
+    if not candidates:
+        return [], []
+
+    # Only rows still pending take the claim; rows another worker won are left alone
+    Transaction.objects.filter(pk__in=candidates, status='pending').update(
+        status='processing', claimed_by=claimed_by, claimed_at=now
+    )
+    sync_activity_status(candidates)
+    claimed = list(Transaction.objects.filter(pk__in=candidates, status='processing', claimed_by=claimed_by))
+    try:
+        return post_transactions_batch(claimed, use_overdraft_limit=use_overdraft_limit, claimed_by=claimed_by)
+    except Exception:
+        # Hand the chunk straight back rather than waiting for the lease to run out
+        Transaction.objects.filter(
+            pk__in=candidates, status='processing', claimed_by=claimed_by, processed_at__isnull=True
+        ).update(status='pending', claimed_by='', claimed_at=None)
+        sync_activity_status(candidates)
+        raise
+
+
+def release_stale_claims(lease=CLAIM_LEASE):
+    """Return claimed-but-never-posted transactions to the queue"""
+    stale = list(Transaction.objects.filter(
+        status='processing',
+        processed_at__isnull=True,
+        claimed_at__lt=timezone.now() - lease
+    ).exclude(claimed_by='').values_list('pk', flat=True))
+    released = Transaction.objects.filter(pk__in=stale, status='processing', processed_at__isnull=True).update(
+        status='pending', claimed_by='', claimed_at=None
+    )
+    sync_activity_status(stale)
+    return released
+
+
+def run_worker(index, chunk_size=200, once=False, poll_interval=5.0, max_transactions=0,
+               report_interval=60.0, results=None):
+    """Claim and post chunks until the queue is empty (once) or the worker is stopped"""
+    # A forked worker must never reuse the parent's database connection
+    connections.close_all()
+
+    claimed_by = worker_id(index)
+    stopping = []
+    if multiprocessing.current_process().name != 'MainProcess':
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    stats = {'worker': claimed_by, 'posted': 0, 'failed': 0, 'chunks': 0}
+    release_stale_claims()
+    started = last_report = time.monotonic()
+
+    while not stopping:
+        if max_transactions and stats['posted'] + stats['failed'] >= max_transactions:
+            break
+
+        size = chunk_size
+        if max_transactions:
+            size = min(chunk_size, max_transactions - stats['posted'] - stats['failed'])
+
+        try:
+            posted, failed = claim_and_post(size, claimed_by)
+        except OperationalError as e:
+            # Lock timeouts under contention - back off and try the next chunk
+            logger.warning(f'Worker {claimed_by} could not claim a chunk: {str(e)}')
+            time.sleep(min(poll_interval, 1.0))
+            continue
+
+        if posted or failed:
+            stats['posted'] += len(posted)
+            stats['failed'] += len(failed)
+            stats['chunks'] += 1
+        elif once:
+            if not due_for_processing().exists():
+                break
+            # Everything left is claimed by other workers right now
+            time.sleep(0.1)
+        else:
+            release_stale_claims()
+            time.sleep(poll_interval)
+
+        if report_interval and time.monotonic() - last_report >= report_interval:
+            last_report = time.monotonic()
+            logger.info(format_worker_stats(stats, last_report - started))
+
+    stats['elapsed_seconds'] = time.monotonic() - started
+    connections.close_all()
+    if results is not None:
+        results.put(stats)
+    return stats
+
+
+def format_worker_stats(stats, elapsed=None):
+    elapsed = stats.get('elapsed_seconds', elapsed) or 0.0
+    processed = stats['posted'] + stats['failed']
+    rate = processed / elapsed if elapsed else 0.0
+    return (
+        f"Worker {stats['worker']}: {stats['posted']} posted, {stats['failed']} failed "
+        f"in {stats['chunks']} chunks, {elapsed:.1f}s ({rate:.1f} tx/s)"
+    )
+
+
+def run_worker_pool(workers, chunk_size=200, once=False, poll_interval=5.0, max_transactions=0,
+                    report_interval=60.0):
+    """
+    Run workers in separate processes and return each worker's stats.
+
+    A single worker runs in the current process.
+    """
+    options = {
+        'chunk_size': chunk_size,
+        'once': once,
+        'poll_interval': poll_interval,
+        'max_transactions': max_transactions,
+        'report_interval': report_interval,
+    }
+    if workers <= 1:
+        return [run_worker(0, **options)]
+
+    # Children are forked with the configured Django app; close our connection first
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(index,), kwargs={**options, 'results': results},
+                        name=f'transaction-worker-{index}')
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    stats = []
+    while len(stats) < len(processes):
+        try:
+            stats.append(results.get(timeout=1.0))
+        except queue.Empty:
+            # A worker that died without reporting leaves nothing to wait for
+            if not any(process.is_alive() for process in processes) and results.empty():
+                break
+        except KeyboardInterrupt:
+            # Workers finish their current chunk and report before exiting
+            for process in processes:
+                process.terminate()
+
+    for process in processes:
+        process.join()
+    return stats
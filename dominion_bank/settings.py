@@ -246,6 +246,22 @@ KYC_DOCUMENT_RETENTION_DAYS = int(os.getenv('KYC_DOCUMENT_RETENTION_DAYS', '2555
 # Banking-specific settings
 ACCOUNT_NUMBER_LENGTH = int(os.getenv('ACCOUNT_NUMBER_LENGTH', '10'))
 TRANSACTION_REFERENCE_LENGTH = int(os.getenv('TRANSACTION_REFERENCE_LENGTH', '12'))
+IDENTIFIER_BLOCK_SIZE = int(os.getenv('IDENTIFIER_BLOCK_SIZE', '100'))  # Identifiers reserved per database round trip
+BUSINESS_CALENDAR_YEARS_BACK = int(os.getenv('BUSINESS_CALENDAR_YEARS_BACK', '2'))  # Years precomputed in the business-day calendar
+BUSINESS_CALENDAR_YEARS_AHEAD = int(os.getenv('BUSINESS_CALENDAR_YEARS_AHEAD', '5'))
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '300'))  # Seconds a cached dashboard payload lives; changes retire it sooner
+TRANSACTION_REPRESENTATION_TIMEOUT = int(os.getenv('TRANSACTION_REPRESENTATION_TIMEOUT', '86400'))  # Seconds a rendered terminal transaction is cached
+DELTA_SYNC_SETTLE_SECONDS = int(os.getenv('DELTA_SYNC_SETTLE_SECONDS', '5'))  # Newest changes held back from transactions/changes/ until concurrent commits land
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))  # Rows fetched per round trip by streaming exports
+ADMIN_STATS_CACHE_TIMEOUT = int(os.getenv('ADMIN_STATS_CACHE_TIMEOUT', '60'))  # Seconds transaction changelist statistics are reused per filter
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))  # Unfiltered changelists above this size use planner estimates (PostgreSQL)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))  # How long a key replays its response
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '10'))  # How long a duplicate request waits for the first one's response before answering 409
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '120'))  # After this long without a response, a key's request is presumed dead and its outcome reported as unknown
+NOTIFICATION_OUTBOX_ENABLED = os.getenv('NOTIFICATION_OUTBOX_ENABLED', 'True').lower() in ('true', '1', 'yes', 'on')  # Queue notifications for run_notification_dispatcher instead of sending inline
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_OUTBOX_MAX_ATTEMPTS', '5'))  # Deliveries tried before an outbox row is marked failed
+NOTIFICATION_DISPATCHER_CONCURRENCY = int(os.getenv('NOTIFICATION_DISPATCHER_CONCURRENCY', '4'))  # Notifications a dispatcher delivers at the same time
+NOTIFICATION_PREFERENCE_CACHE_TIMEOUT = int(os.getenv('NOTIFICATION_PREFERENCE_CACHE_TIMEOUT', '3600'))  # Seconds compiled notification preferences are cached; changes drop them sooner
 
 # Security Settings
 SECURE_BROWSER_XSS_FILTER = os.getenv('SECURE_BROWSER_XSS_FILTER', 'True').lower() in ('true', '1', 'yes', 'on')
@@ -266,11 +282,23 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() in ('true', '1', 'ye
 EMAIL_USE_SSL = os.getenv('EMAIL_USE_SSL', 'False').lower() in ('true', '1', 'yes', 'on')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_POOL_SIZE = int(os.getenv('EMAIL_POOL_SIZE', '4'))  # Persistent SMTP connections per process
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '50'))  # Queued emails a connection takes at a time
+EMAIL_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('EMAIL_MAX_MESSAGES_PER_CONNECTION', '100'))  # Reconnect after this many (servers cap messages per session)
+EMAIL_POOL_IDLE_TIMEOUT = int(os.getenv('EMAIL_POOL_IDLE_TIMEOUT', '30'))  # Seconds an unused SMTP connection stays open
+EMAIL_DELIVERY_TIMEOUT = int(os.getenv('EMAIL_DELIVERY_TIMEOUT', '60'))  # Seconds a notification waits for its email to go out
 
 # Twilio SMS Settings
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', 'your_account_sid_here')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', 'your_auth_token_here')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER', '+1234567890')
+SMS_TRANSPORT = os.getenv('SMS_TRANSPORT', 'notifications.sms.TwilioTransport')  # notifications.sms.FakeSMSTransport for development and load tests
+SMS_FAKE_LATENCY = float(os.getenv('SMS_FAKE_LATENCY', '0'))  # Seconds FakeSMSTransport waits per message
+SMS_RATE_LIMIT = float(os.getenv('SMS_RATE_LIMIT', '1'))  # Messages per second the provider accepts
+SMS_RATE_BURST = int(os.getenv('SMS_RATE_BURST', '1'))
+SMS_URGENT_THREADS = int(os.getenv('SMS_URGENT_THREADS', '1'))  # Senders reserved for 2FA codes
+SMS_BULK_THREADS = int(os.getenv('SMS_BULK_THREADS', '4'))
+SMS_DELIVERY_TIMEOUT = int(os.getenv('SMS_DELIVERY_TIMEOUT', '30'))  # Seconds a notification waits for its SMS to go out
 
 # Session Configuration
 SESSION_COOKIE_SECURE = os.getenv('SESSION_COOKIE_SECURE', 'False').lower() in ('true', '1', 'yes', 'on')
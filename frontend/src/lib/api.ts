@@ -499,8 +499,24 @@ class ApiClient {
   }
 
   // Transaction endpoints
+  async getTransactionsPage(cursor?: string | null, pageSize?: number): Promise<{ results: Transaction[]; next: string | null }> {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    if (pageSize) params.set('page_size', String(pageSize));
+    const query = params.toString();
+    return this.request(`/api/banking/transactions/${query ? `?${query}` : ''}`);
+  }
+
+  // Follows the cursor through every page of the feed
   async getTransactions(): Promise<Transaction[]> {
-    return this.request<Transaction[]>('/api/banking/transactions/');
+    const transactions: Transaction[] = [];
+    let cursor: string | null = null;
+    do {
+      const page: { results: Transaction[]; next: string | null } = await this.getTransactionsPage(cursor, 100);
+      transactions.push(...page.results);
+      cursor = page.next ? new URL(page.next).searchParams.get('cursor') : null;
+    } while (cursor);
+    return transactions;
   }
 
   async getTransaction(id: string): Promise<Transaction> {
@@ -4,9 +4,10 @@ from django.urls import reverse
 from django.utils.safestring import mark_safe
 from .models import (
     NotificationTemplate, NotificationPreference, Notification, 
-    NotificationBatch, NotificationLog, TwoFactorAuth, TwoFactorCode,
+    NotificationBatch, NotificationLog, NotificationOutbox, TwoFactorAuth, TwoFactorCode,
     TrustedDevice, SecurityEvent
 )
+from .template_cache import invalidate_templates
 
 
 @admin.register(NotificationTemplate)
@@ -30,11 +31,13 @@ class NotificationTemplateAdmin(admin.ModelAdmin):
     
     def activate_templates(self, request, queryset):
         updated = queryset.update(is_active=True)
+        invalidate_templates()
         self.message_user(request, f'{updated} templates activated.')
     activate_templates.short_description = 'Activate selected templates'
     
     def deactivate_templates(self, request, queryset):
         updated = queryset.update(is_active=False)
+        invalidate_templates()
         self.message_user(request, f'{updated} templates deactivated.')
     deactivate_templates.short_description = 'Deactivate selected templates'
     
@@ -178,6 +181,29 @@ class NotificationBatchAdmin(admin.ModelAdmin):
         return super().get_queryset(request)
 
 
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ['template_type', 'user', 'notification_type', 'status', 'attempts', 'available_at', 'created_at', 'processed_at']
+    list_filter = ['status', 'notification_type', 'created_at']
+    search_fields = ['user__username', 'user__email', 'template_type', 'last_error']
+    readonly_fields = ['created_at', 'processed_at', 'claimed_by', 'claimed_at', 'last_error']
+    ordering = ['-id']
+    
+    actions = ['requeue_entries']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+    
+    def requeue_entries(self, request, queryset):
+        """Hand failed or stuck rows back to the dispatcher"""
+        from django.utils import timezone
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, available_at=timezone.now(), claimed_by='', claimed_at=None
+        )
+        self.message_user(request, f'{updated} outbox entries queued for delivery.')
+    requeue_entries.short_description = "Queue selected entries for delivery again"
+
+
 @admin.register(NotificationLog)
 class NotificationLogAdmin(admin.ModelAdmin):
     list_display = ['notification', 'event_type', 'message', 'created_at']
@@ -0,0 +1,211 @@
+"""
+Notification outbox dispatcher
+
+Request handlers and signal receivers only INSERT a NotificationOutbox row in
+their own database transaction (NotificationService.send_notification). The
+dispatcher drains the outbox: it claims a batch of due rows, renders and sends
+them on a pool of threads bounded by the concurrency limit, and records the
+outcome on each row.
+
+A batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it, so several dispatchers can run side by side; elsewhere (SQLite)
+with a compare-and-swap UPDATE from 'pending' to 'processing' tagged with the
+dispatcher's id. Rows are delivered after the claim commits, so a slow SMTP or
+SMS provider never holds a database lock. Failed rows are retried with
+exponential backoff up to NOTIFICATION_OUTBOX_MAX_ATTEMPTS times; a row some
+of whose channels went out is retried on the failed channels only.
+"""
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, transaction, OperationalError
+from django.utils import timezone
+
+from .models import NotificationOutbox
+from .preference_cache import resolve_preferences
+from .template_cache import load_templates
+
+logger = logging.getLogger(__name__)
+
+# Claims older than this whose delivery never finished are handed back to the outbox
+CLAIM_LEASE = timedelta(minutes=10)
+
+# First retry delay; doubled on every further attempt
+RETRY_BACKOFF = timedelta(minutes=1)
+
+
+def dispatcher_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _max_attempts():
+    return getattr(settings, 'NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def due_entries(now=None):
+    return NotificationOutbox.objects.filter(
+        status='pending', available_at__lte=now or timezone.now()
+    ).order_by('available_at', 'id')
+
+
+def release_stale_claims():
+    """Hand back rows whose dispatcher died before recording the outcome"""
+    released = NotificationOutbox.objects.filter(
+        status='processing', claimed_at__lt=timezone.now() - CLAIM_LEASE
+    ).update(status='pending', claimed_by='', claimed_at=None)
+    if released:
+        logger.warning(f'Released {released} stale notification outbox claims')
+    return released
+
+
+def claim_batch(size, claimed_by):
+    """Mark up to size due rows as processing by claimed_by and return them"""
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                due_entries(now).select_for_update(skip_locked=True).values_list('id', flat=True)[:size]
+            )
+            if ids:
+                NotificationOutbox.objects.filter(id__in=ids).update(
+                    status='processing', claimed_by=claimed_by, claimed_at=now
+                )
+    else:
+        candidates = list(due_entries(now).values_list('id', flat=True)[:size])
+        if candidates:
+            # Compare-and-swap: rows another dispatcher took in the meantime are no longer pending
+            NotificationOutbox.objects.filter(id__in=candidates, status='pending').update(
+                status='processing', claimed_by=claimed_by, claimed_at=now
+            )
+        ids = candidates
+
+    if not ids:
+        return []
+    return list(
+        NotificationOutbox.objects.select_related('user')
+        .filter(id__in=ids, status='processing', claimed_by=claimed_by)
+        .order_by('id')
+    )
+
+
+def deliver(entry, service=None, preferences=None):
+    """Render and send one claimed row, then record the outcome; returns True when sent"""
+    from .services import NotificationDeliveryError, NotificationService
+    service = service or NotificationService()
+    attempts = entry.attempts + 1
+    try:
+        service.deliver_notification(
+            entry.user, entry.notification_type, entry.template_type, entry.context_data, entry.channels,
+            preferences=preferences, raise_on_failure=True
+        )
+    except Exception as e:
+        logger.error(f'Failed to deliver outbox notification {entry.pk}: {str(e)}')
+        if attempts >= _max_attempts():
+            updates = {'status': 'failed', 'processed_at': timezone.now()}
+        else:
+            updates = {
+                'status': 'pending',
+                'available_at': timezone.now() + RETRY_BACKOFF * (2 ** (attempts - 1)),
+            }
+            if isinstance(e, NotificationDeliveryError):
+                # The channels that went out are not sent again
+                updates['channels'] = list(e.failures)
+        NotificationOutbox.objects.filter(pk=entry.pk).update(
+            attempts=attempts, last_error=str(e), claimed_by='', claimed_at=None, **updates
+        )
+        return False
+
+    NotificationOutbox.objects.filter(pk=entry.pk).update(
+        status='sent', attempts=attempts, processed_at=timezone.now()
+    )
+    return True
+
+
+def _deliver_in_thread(entry, preferences):
+    try:
+        return deliver(entry, preferences=preferences)
+    finally:
+        # Each pool thread has its own connection; don't leave it open between batches
+        connections.close_all()
+
+
+def dispatch_batch(entries, executor=None):
+    """Deliver claimed rows, on executor's threads when given; returns (sent, failed)"""
+    # One lookup for the whole batch instead of one per notification
+    preferences = resolve_preferences(entry.user_id for entry in entries)
+    batch_preferences = [preferences.get(entry.user_id) for entry in entries]
+    if executor is None:
+        results = [deliver(entry, preferences=prefs) for entry, prefs in zip(entries, batch_preferences)]
+    else:
+        results = list(executor.map(_deliver_in_thread, entries, batch_preferences))
+    sent = sum(1 for result in results if result)
+    return sent, len(results) - sent
+
+
+def run_dispatcher(concurrency=4, batch_size=100, once=False, poll_interval=1.0, max_notifications=0):
+    """
+    Drain the outbox until stopped (or until it is empty with once) and return stats.
+
+    Up to concurrency notifications are delivered at a time.
+    """
+    claimed_by = dispatcher_id()
+    stopping = []
+    if not once:
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    stats = {'dispatcher': claimed_by, 'sent': 0, 'failed': 0, 'batches': 0}
+    release_stale_claims()
+    # Compile the notification templates before the first batch rather than inside it
+    load_templates()
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+
+    try:
+        while not stopping:
+            size = batch_size
+            if max_notifications:
+                remaining = max_notifications - stats['sent'] - stats['failed']
+                if remaining <= 0:
+                    break
+                size = min(batch_size, remaining)
+
+            try:
+                entries = claim_batch(size, claimed_by)
+            except OperationalError as e:
+                logger.warning(f'Dispatcher {claimed_by} could not claim a batch: {str(e)}')
+                time.sleep(min(poll_interval, 1.0))
+                continue
+
+            if entries:
+                sent, failed = dispatch_batch(entries, executor)
+                stats['sent'] += sent
+                stats['failed'] += failed
+                stats['batches'] += 1
+            elif once:
+                break
+            else:
+                release_stale_claims()
+                time.sleep(poll_interval)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    stats['elapsed_seconds'] = time.monotonic() - started
+    return stats
+
+
+def format_dispatcher_stats(stats):
+    elapsed = stats.get('elapsed_seconds') or 0.0
+    processed = stats['sent'] + stats['failed']
+    rate = processed / elapsed if elapsed else 0.0
+    return (
+        f"Dispatcher {stats['dispatcher']}: {stats['sent']} sent, {stats['failed']} failed "
+        f"in {stats['batches']} batches, {elapsed:.1f}s ({rate:.1f} notifications/s)"
+    )
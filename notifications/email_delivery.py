@@ -0,0 +1,172 @@
+"""
+Pooled SMTP delivery
+
+Opening an SMTP connection costs a TCP connect, the TLS handshake and a login,
+which used to be paid for every email. EmailDeliveryEngine keeps a small pool
+of sender threads, each holding one persistent connection. Emails submitted
+from any thread go onto a shared queue. A sender takes whatever is waiting, up
+to EMAIL_BATCH_SIZE messages, and sends them back to back over its connection.
+
+A connection is replaced after EMAIL_MAX_MESSAGES_PER_CONNECTION messages
+(servers cap this) or when it drops. The message that found it dropped is
+retried once on a fresh connection. A connection idle for
+EMAIL_POOL_IDLE_TIMEOUT seconds is closed, so the pool holds nothing open
+between bursts.
+
+submit() returns a Future per message, so a caller can wait for its own email
+(EmailNotificationService does) or hand over thousands at once with
+send_messages().
+"""
+import logging
+import queue
+import smtplib
+import socket
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the connection is gone rather than that the message was refused
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, socket.timeout)
+
+_STOP = object()
+
+
+class EmailDeliveryEngine:
+    """Pool of persistent SMTP connections fed from one queue"""
+
+    def __init__(self, pool_size=None, batch_size=None, max_messages_per_connection=None, idle_timeout=None,
+                 connection_factory=None):
+        self.pool_size = pool_size or getattr(settings, 'EMAIL_POOL_SIZE', 4)
+        self.batch_size = batch_size or getattr(settings, 'EMAIL_BATCH_SIZE', 50)
+        self.max_messages_per_connection = (
+            max_messages_per_connection or getattr(settings, 'EMAIL_MAX_MESSAGES_PER_CONNECTION', 100)
+        )
+        self.idle_timeout = idle_timeout or getattr(settings, 'EMAIL_POOL_IDLE_TIMEOUT', 30)
+        self.connection_factory = connection_factory or (lambda: get_connection(fail_silently=False))
+        self._queue = queue.Queue()
+        self._senders = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._senders:
+                return
+            for index in range(self.pool_size):
+                sender = threading.Thread(target=self._run, name=f'email-sender-{index}', daemon=True)
+                sender.start()
+                self._senders.append(sender)
+
+    def submit(self, message):
+        """Queue an EmailMessage; the returned Future resolves to the number sent (1, or 0 without recipients)"""
+        self._start()
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def send_messages(self, messages, timeout=None):
+        """Send many messages through the pool and return how many went out"""
+        futures = [self.submit(message) for message in messages]
+        sent = 0
+        for future in futures:
+            try:
+                sent += future.result(timeout)
+            except Exception as e:
+                logger.error(f'Failed to send email: {str(e)}')
+        return sent
+
+    def close(self):
+        """Stop the senders once the queue is drained and close their connections"""
+        with self._lock:
+            senders, self._senders = self._senders, []
+        for _ in senders:
+            self._queue.put(_STOP)
+        for sender in senders:
+            sender.join()
+
+    def _open(self):
+        connection = self.connection_factory()
+        connection.open()
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _next_batch(self):
+        """Block for the first message, then take what else is already waiting"""
+        first = self._queue.get(timeout=self.idle_timeout)
+        if first is _STOP:
+            return None
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Let the next sender see it; this one stops after the batch
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        connection, sent_on_connection = None, 0
+        while True:
+            try:
+                batch = self._next_batch()
+            except queue.Empty:
+                if connection is not None:
+                    self._close(connection)
+                    connection = None
+                continue
+            if batch is None:
+                break
+
+            for message, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if connection is not None and sent_on_connection >= self.max_messages_per_connection:
+                        self._close(connection)
+                        connection = None
+                    if connection is None:
+                        connection, sent_on_connection = self._open(), 0
+                    try:
+                        sent = connection.send_messages([message])
+                    except CONNECTION_ERRORS as e:
+                        logger.warning(f'SMTP connection lost, reconnecting: {str(e)}')
+                        self._close(connection)
+                        connection = None
+                        connection, sent_on_connection = self._open(), 0
+                        sent = connection.send_messages([message])
+                except Exception as e:
+                    if isinstance(e, CONNECTION_ERRORS) and connection is not None:
+                        self._close(connection)
+                        connection = None
+                    future.set_exception(e)
+                    continue
+                sent_on_connection += 1
+                future.set_result(sent)
+
+        if connection is not None:
+            self._close(connection)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_email_engine():
+    """The process-wide EmailDeliveryEngine, started on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = EmailDeliveryEngine()
+        return _engine
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from notifications.dispatcher import run_dispatcher, format_dispatcher_stats
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notifications from the notification outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'NOTIFICATION_DISPATCHER_CONCURRENCY', 4),
+            help='Maximum number of notifications delivered at the same time',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of outbox rows claimed at a time',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when no due notifications are left instead of polling for more',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds an idle dispatcher waits before checking the outbox again',
+        )
+        parser.add_argument(
+            '--max-notifications',
+            type=int,
+            default=0,
+            help='Stop after this many notifications (0 = no limit)',
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        batch_size = options['batch_size']
+
+        if concurrency < 1 or batch_size < 1:
+            raise CommandError('--concurrency and --batch-size must be at least 1')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Starting notification dispatcher with concurrency {concurrency} '
+                f'({"until the outbox is empty" if options["once"] else "press Ctrl+C to stop"})'
+            )
+        )
+
+        stats = run_dispatcher(
+            concurrency=concurrency,
+            batch_size=batch_size,
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            max_notifications=options['max_notifications'],
+        )
+        self.stdout.write(self.style.SUCCESS(format_dispatcher_stats(stats)))
+        logger.info(format_dispatcher_stats(stats))
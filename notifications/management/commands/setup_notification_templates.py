@@ -170,7 +170,7 @@ class Command(BaseCommand):
         notification_service = NotificationService()
         
         # Test transaction notification
-        notifications = notification_service.send_notification(
+        notifications = notification_service.deliver_notification(
             user=user,
             notification_type='transaction',
             template_type='transaction_created',
@@ -192,7 +192,7 @@ class Command(BaseCommand):
         self.stdout.write(f'Sent {len(notifications)} transaction notifications')
         
         # Test security alert
-        notifications = notification_service.send_notification(
+        notifications = notification_service.deliver_notification(
             user=user,
             notification_type='security',
             template_type='security_alert',
@@ -208,7 +208,7 @@ class Command(BaseCommand):
             notification_service = NotificationService()
             
             # Test security alert SMS
-            notifications = notification_service.send_notification(
+            notifications = notification_service.deliver_notification(
                 user=user,
                 notification_type='security',
                 template_type='security_alert',
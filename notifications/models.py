@@ -585,4 +585,50 @@ class NotificationLog(models.Model):
     
     def __str__(self):
         return f"{self.event_type} - {self.notification.title}" 
- 
\ No newline at end of file
+ 
+
+class NotificationOutbox(models.Model):
+    """
+    Notifications waiting to be delivered.
+
+    A row is written in the same database transaction as the change it
+    announces, so it exists exactly when that change committed. The
+    run_notification_dispatcher command renders and sends it later.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_outbox')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    template_type = models.CharField(max_length=50)
+    context_data = models.JSONField(default=dict, blank=True)
+    channels = models.JSONField(null=True, blank=True)  # None = the user's default channels
+
+    # Delivery state
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not picked up before this (retry backoff)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['available_at', 'id'], name='outbox_pending_idx',
+                condition=models.Q(status='pending')
+            ),
+            models.Index(fields=['status', 'claimed_at'], name='outbox_claimed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.template_type} for {self.user.username} ({self.status})"
@@ -0,0 +1,158 @@
+"""
+Compiled notification preferences
+
+A NotificationPreference row is reduced to a bitmask with one bit per
+(channel, notification type) the user accepts, one bit per enabled channel,
+and the quiet-hours window. The result is kept in the default cache under the
+user's id. Deciding where a notification goes is then a few bit tests rather
+than a query and a getattr() per channel.
+
+resolve_preferences() serves any number of users from two cache round trips
+and, for users not cached, one query. Users without a row get one created
+with the defaults, as before.
+
+The cached form is stored under a per-user version number, as the dashboard
+cache does. Saving or deleting a row bumps the version once the change
+commits. A reader takes the version before it queries, so a form compiled
+from a row read just before a save commits lands under the version that save
+retires and is never served. A version that was evicted restarts from the
+clock, so it cannot match forms that may still be cached.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Notification, NotificationPreference
+
+CHANNELS = ('email', 'sms', 'in_app', 'push')
+NOTIFICATION_TYPES = tuple(notification_type for notification_type, _ in Notification.NOTIFICATION_TYPES)
+
+# Notification types for which the user's enabled channels are used when none are given
+DEFAULT_CHANNEL_TYPES = ('transaction', 'security', 'account')
+
+KEY = 'notification_preferences:{user_id}:{version}'
+VERSION_KEY = 'notification_preferences:version:{user_id}'
+
+# Bit of each (channel, notification type), followed by one "channel enabled" bit per channel
+_TYPE_BITS = {
+    (channel, notification_type): 1 << (channel_index * len(NOTIFICATION_TYPES) + type_index)
+    for channel_index, channel in enumerate(CHANNELS)
+    for type_index, notification_type in enumerate(NOTIFICATION_TYPES)
+}
+_CHANNEL_BITS = {
+    channel: 1 << (len(CHANNELS) * len(NOTIFICATION_TYPES) + channel_index)
+    for channel_index, channel in enumerate(CHANNELS)
+}
+
+
+class ResolvedPreferences:
+    """What a NotificationPreference row allows, as bits plus the quiet-hours window"""
+    __slots__ = ('mask', 'quiet_hours')
+
+    def __init__(self, mask, quiet_hours=None):
+        self.mask = mask
+        self.quiet_hours = quiet_hours  # (start, end) times, or None when disabled
+
+    @classmethod
+    def compile(cls, preferences):
+        mask = 0
+        for channel in CHANNELS:
+            if not getattr(preferences, f'{channel}_enabled'):
+                continue
+            mask |= _CHANNEL_BITS[channel]
+            for notification_type in NOTIFICATION_TYPES:
+                # Types without a field of their own are allowed whenever the channel is
+                if getattr(preferences, f'{channel}_{notification_type}', True):
+                    mask |= _TYPE_BITS[(channel, notification_type)]
+        quiet_hours = None
+        if preferences.quiet_hours_enabled:
+            quiet_hours = (preferences.quiet_hours_start, preferences.quiet_hours_end)
+        return cls(mask, quiet_hours)
+
+    def channel_enabled(self, channel):
+        return bool(self.mask & _CHANNEL_BITS[channel])
+
+    def allows(self, channel, notification_type):
+        """Whether channel is enabled and accepts notification_type (quiet hours aside)"""
+        if channel not in CHANNELS:
+            return True
+        if notification_type not in NOTIFICATION_TYPES:
+            return self.channel_enabled(channel)
+        return bool(self.mask & _TYPE_BITS[(channel, notification_type)])
+
+    def default_channels(self, notification_type):
+        if notification_type not in DEFAULT_CHANNEL_TYPES:
+            return []
+        return [channel for channel in ('email', 'sms', 'in_app') if self.channel_enabled(channel)]
+
+    def in_quiet_hours(self, current_time):
+        if self.quiet_hours is None:
+            return False
+        start_time, end_time = self.quiet_hours
+        if start_time <= end_time:
+            return start_time <= current_time <= end_time
+        return current_time >= start_time or current_time <= end_time
+
+
+def _key(user_id, version):
+    return KEY.format(user_id=user_id, version=version)
+
+
+def _versions(user_ids):
+    """{user_id: current version}, starting a version for users without one"""
+    keys = {user_id: VERSION_KEY.format(user_id=user_id) for user_id in user_ids}
+    found = cache.get_many(list(keys.values()))
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        start = time.time_ns()
+        for key in missing:
+            cache.add(key, start, None)
+        # Another reader may have started the version first; ours stands if it was evicted again
+        found.update(dict.fromkeys(missing, start))
+        found.update(cache.get_many(missing))
+    return {user_id: found[key] for user_id, key in keys.items()}
+
+
+def _bump_versions(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(VERSION_KEY.format(user_id=user_id))
+        except ValueError:
+            # No version yet: the next read starts a fresh one
+            pass
+
+
+def resolve_preferences(user_ids):
+    """{user_id: ResolvedPreferences} for these users, reading the database only for uncached ones"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    # Versions are read before the rows, so a save committing in between retires what is stored below
+    versions = _versions(user_ids)
+    keys = {user_id: _key(user_id, version) for user_id, version in versions.items()}
+    found = cache.get_many(list(keys.values()))
+    resolved = {user_id: found[key] for user_id, key in keys.items() if key in found}
+
+    missing = user_ids - resolved.keys()
+    if missing:
+        rows = {row.user_id: row for row in NotificationPreference.objects.filter(user_id__in=missing)}
+        absent = [NotificationPreference(user_id=user_id) for user_id in missing if user_id not in rows]
+        if absent:
+            NotificationPreference.objects.bulk_create(absent, ignore_conflicts=True)
+            rows.update((row.user_id, row) for row in absent)
+        compiled = {user_id: ResolvedPreferences.compile(row) for user_id, row in rows.items()}
+        cache.set_many(
+            {keys[user_id]: value for user_id, value in compiled.items()},
+            getattr(settings, 'NOTIFICATION_PREFERENCE_CACHE_TIMEOUT', 3600)
+        )
+        resolved.update(compiled)
+    return resolved
+
+
+def forget_preferences(user_ids):
+    """Retire the cached preferences of these users once the current transaction commits"""
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: _bump_versions(user_ids))
@@ -5,9 +5,13 @@ from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import User
 from .models import (
-    Notification, NotificationTemplate, NotificationPreference, NotificationLog,
+    Notification, NotificationLog, NotificationOutbox,
     TwoFactorAuth, TwoFactorCode, TrustedDevice, SecurityEvent
 )
+from .email_delivery import get_email_engine
+from .preference_cache import resolve_preferences
+from .sms import BULK, get_sms_sender, lane_for
+from .template_cache import get_compiled_template
 import logging
 import requests
 import secrets
@@ -15,11 +19,21 @@ import string
 from typing import Dict, List, Optional
 from decimal import Decimal
 import json
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime, time, timedelta
 
 logger = logging.getLogger(__name__)
 
 
+class NotificationDeliveryError(Exception):
+    """Raised when some channels of a notification could not be delivered"""
+
+    def __init__(self, failures):
+        # Channel -> reason, for the channels that failed
+        self.failures = failures
+        super().__init__('; '.join(f'{channel}: {reason}' for channel, reason in failures.items()))
+
+
 class NotificationService:
     """Main service for handling all notification types"""
     
@@ -70,18 +84,52 @@ class NotificationService:
             return False
 
     def send_notification(self, user, notification_type, template_type, context_data=None, channels=None):
-        """Send notification through specified channels"""
+        """
+        Queue a notification in the outbox, in the caller's database transaction.
+
+        run_notification_dispatcher delivers it once that transaction commits.
+        With NOTIFICATION_OUTBOX_ENABLED off it is delivered straight away and
+        the sent notifications are returned, as deliver_notification() does.
+        """
+        if not getattr(settings, 'NOTIFICATION_OUTBOX_ENABLED', True):
+            return self.deliver_notification(user, notification_type, template_type, context_data, channels)
+
+        NotificationOutbox.objects.create(
+            user=user,
+            notification_type=notification_type,
+            template_type=template_type,
+            context_data=self._sanitize_context_data(context_data),
+            channels=list(channels) if channels is not None else None,
+        )
+        return []
+
+    def deliver_notification(self, user, notification_type, template_type, context_data=None, channels=None,
+                             preferences=None, raise_on_failure=False):
+        """
+        Send notification through specified channels
+
+        preferences may be passed in when they were resolved in bulk (see
+        notifications.preference_cache.resolve_preferences). With
+        raise_on_failure, channels that failed raise NotificationDeliveryError
+        once the others have been sent; otherwise failures are only logged.
+        """
         if context_data is None:
             context_data = {}
         
         # Get user preferences
-        preferences = self._get_user_preferences(user)
+        if preferences is None:
+            preferences = self._get_user_preferences(user)
         
         # Determine channels to use
         if channels is None:
             channels = self._get_default_channels(notification_type, preferences)
         
         notifications_sent = []
+        failures = {}
+        
+        # Quiet hours hold back every channel, so they are checked once
+        if preferences.in_quiet_hours(timezone.now().time()):
+            return notifications_sent
         
         for channel in channels:
             if self._should_send_to_channel(channel, notification_type, preferences):
@@ -97,64 +145,28 @@ class NotificationService:
                         notifications_sent.append(notification)
                     else:
                         notification.mark_as_failed("Failed to send via channel")
+                        failures[channel] = "Failed to send via channel"
                         
                 except Exception as e:
                     logger.error(f"Failed to send {channel} notification to {user.username}: {str(e)}")
+                    failures[channel] = str(e)
+        
+        if failures and raise_on_failure:
+            raise NotificationDeliveryError(failures)
         
         return notifications_sent
     
     def _get_user_preferences(self, user):
-        """Get user notification preferences"""
-        try:
-            return user.notification_preferences
-        except NotificationPreference.DoesNotExist:
-            # Create default preferences
-            return NotificationPreference.objects.create(user=user)
+        """Get the user's compiled notification preferences, creating default preferences if needed"""
+        return resolve_preferences([user.pk])[user.pk]
     
     def _get_default_channels(self, notification_type, preferences):
         """Get default channels for notification type"""
-        channels = []
-        
-        if notification_type in ['transaction', 'security', 'account']:
-            if preferences.email_enabled:
-                channels.append('email')
-            if preferences.sms_enabled:
-                channels.append('sms')
-            if preferences.in_app_enabled:
-                channels.append('in_app')
-        
-        return channels
+        return preferences.default_channels(notification_type)
     
     def _should_send_to_channel(self, channel, notification_type, preferences):
-        """Check if notification should be sent to specific channel"""
-        if not self._is_within_quiet_hours(preferences):
-            return False
-        
-        # Channel-specific checks
-        if channel == 'email':
-            return preferences.email_enabled and getattr(preferences, f'email_{notification_type}', True)
-        elif channel == 'sms':
-            return preferences.sms_enabled and getattr(preferences, f'sms_{notification_type}', True)
-        elif channel == 'in_app':
-            return preferences.in_app_enabled and getattr(preferences, f'in_app_{notification_type}', True)
-        elif channel == 'push':
-            return preferences.push_enabled and getattr(preferences, f'push_{notification_type}', True)
-        
-        return True
-    
-    def _is_within_quiet_hours(self, preferences):
-        """Check if current time is within quiet hours"""
-        if not preferences.quiet_hours_enabled:
-            return True
-        
-        current_time = timezone.now().time()
-        start_time = preferences.quiet_hours_start
-        end_time = preferences.quiet_hours_end
-        
-        if start_time <= end_time:
-            return not (start_time <= current_time <= end_time)
-        else:
-            return not (current_time >= start_time or current_time <= end_time)
+        """Check if notification should be sent to specific channel (quiet hours aside)"""
+        return preferences.allows(channel, notification_type)
     
     def _sanitize_context_data(self, context_data):
         """
@@ -183,13 +195,13 @@ class NotificationService:
         # Sanitize context data to ensure JSON compatibility
         sanitized_context_data = self._sanitize_context_data(context_data)
         
-        template = self._get_template(template_type, channel)
+        compiled = get_compiled_template(template_type, channel)
         
-        if template:
-            title = self._render_template(template.subject or template.title, context_data)
-            message = self._render_template(template.body_template, context_data)
-            html_message = self._render_template(template.html_template, context_data) if template.html_template else ""
+        if compiled:
+            template = compiled.template
+            title, message, html_message = compiled.render(context_data)
         else:
+            template = None
             title = f"Notification: {template_type}"
             message = "You have a new notification"
             html_message = ""
@@ -218,23 +230,6 @@ class NotificationService:
         
         return False
     
-    def _get_template(self, template_type, channel):
-        """Get notification template"""
-        try:
-            return NotificationTemplate.objects.get(
-                template_type=template_type,
-                channel=channel,
-                is_active=True
-            )
-        except NotificationTemplate.DoesNotExist:
-            return None
-    
-    def _render_template(self, template_content, context):
-        """Render template with context"""
-        from django.template import Context, Template
-        template = Template(template_content)
-        return template.render(Context(context))
-    
     def _log_notification(self, user, notification_type, channel, status, details):
         """Log notification event"""
         try:
@@ -308,8 +303,28 @@ class EmailNotificationService:
             # Attach HTML version
             email.attach_alternative(html_content, "text/html")
             
-            # Send email
-            email.send()
+            # Send over a pooled SMTP connection instead of opening one per email
+            future = get_email_engine().submit(email)
+            try:
+                future.result(getattr(settings, 'EMAIL_DELIVERY_TIMEOUT', 60))
+            except FuturesTimeoutError:
+                # Still queued: withdrawn, so it is a plain failure the dispatcher may retry
+                if future.cancel():
+                    raise
+                if not future.done():
+                    # A sender is already talking to the server and the email may still go out,
+                    # so reporting a failure would get it retried and delivered twice
+                    logger.warning(f"Email to {user.email} still in flight after the delivery timeout: {notification.title}")
+                    self._log_notification(
+                        user=user,
+                        notification_type='email',
+                        channel='email',
+                        status='unknown',
+                        details=f'Email to {user.email} handed to SMTP, delivery not confirmed'
+                    )
+                    return True
+                # Finished between the timeout and the cancel; raises if it failed
+                future.result()
             
             # Log success
             self._log_notification(
@@ -503,10 +518,11 @@ class SMSNotificationService:
             except:
                 phone_number = ''
             
-            # Send SMS via Twilio
+            # Send SMS via the configured transport; 2FA codes take the urgent lane
             response = self._send_sms_via_provider(
                 phone_number=phone_number,
-                message=notification.message
+                message=notification.message,
+                lane=lane_for(notification.notification_type)
             )
             
             if response.get('success'):
@@ -523,32 +539,17 @@ class SMSNotificationService:
             self._log_notification(notification, 'failed', error_msg)
             return False
     
-    def _send_sms_via_provider(self, phone_number, message):
-        """Send SMS via Twilio"""
+    def _send_sms_via_provider(self, phone_number, message, lane=BULK):
+        """Send SMS through the shared rate-limited sender"""
         try:
-            from twilio.rest import Client
-            
             if not phone_number:
                 return {'success': False, 'error': 'No phone number provided'}
             
-            # Initialize Twilio client
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-            
-            # Send SMS
-            message_instance = client.messages.create(
-                body=message,
-                from_=settings.TWILIO_PHONE_NUMBER,
-                to=phone_number
-            )
-            
-            return {
-                'success': True,
-                'message_id': message_instance.sid,
-                'status': message_instance.status
-            }
+            future = get_sms_sender().submit(phone_number, message, lane=lane)
+            return future.result(getattr(settings, 'SMS_DELIVERY_TIMEOUT', 30))
             
         except Exception as e:
-            logger.error(f"Twilio SMS error: {str(e)}")
+            logger.error(f"SMS error: {str(e)}")
             return {
                 'success': False,
                 'error': str(e)
@@ -652,23 +653,6 @@ class PushNotificationService:
             message=message
         )
     
-    def _get_template(self, template_type, channel):
-        """Get notification template"""
-        try:
-            return NotificationTemplate.objects.get(
-                template_type=template_type,
-                channel=channel,
-                is_active=True
-            )
-        except NotificationTemplate.DoesNotExist:
-            return None
-    
-    def _render_template(self, template_content, context):
-        """Render template with context"""
-        from django.template import Context, Template
-        template = Template(template_content)
-        return template.render(Context(context))
-    
     def _send_push_via_provider(self, user, title, message):
         """Send push notification via external provider (mock implementation)"""
         # This is a mock implementation - replace with actual push provider
@@ -1013,7 +997,8 @@ class TwoFactorService:
         else:
             channels = ['email']  # Default fallback
         
-        self.notification_service.send_notification(
+        # The user is waiting for this code, so it skips the outbox
+        self.notification_service.deliver_notification(
             user=user,
             notification_type='two_factor',
             template_type='two_factor_code',
@@ -1,13 +1,14 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django import db
 from banking.models import Transaction, Card
 from accounts.models import UserProfile
 from .services import NotificationService, SecurityService, TwoFactorService
-from .models import NotificationPreference, SecurityEvent
+from .models import NotificationPreference, NotificationTemplate, SecurityEvent
+from .preference_cache import forget_preferences
+from .template_cache import invalidate_templates
 import logging
 
 logger = logging.getLogger(__name__)
@@ -85,14 +86,18 @@ def user_logout_notification(sender, request, user, **kwargs):
 
 @receiver(post_save, sender=Transaction)
 def transaction_created_notification(sender, instance, created, **kwargs):
-    """Send notification when a transaction is created"""
+    """Send notification when a transaction is created or its status changed"""
     if created:
-        # Use transaction.on_commit to ensure notifications are sent after the transaction completes
-        db.transaction.on_commit(lambda: _send_transaction_notification(instance))
+        # Queued in the transaction that creates it, so it is only delivered if that commits
+        _send_transaction_notification(instance)
+    else:
+        template_type = instance.__dict__.pop('_status_notification', None)
+        if template_type:
+            _send_status_change_notification(instance, template_type)
 
 
 def _send_transaction_notification(instance):
-    """Helper function to send transaction notification outside of atomic transaction"""
+    """Helper function to queue the transaction created notification"""
     try:
         # Determine notification type based on transaction
         if instance.transaction_type == 'deposit':
@@ -154,8 +159,8 @@ def transaction_status_changed_notification(sender, instance, **kwargs):
                 else:
                     return  # Don't send notification for other status changes
                 
-                # Use transaction.on_commit to ensure notifications are sent after the transaction completes
-                db.transaction.on_commit(lambda: _send_status_change_notification(instance, template_type))
+                # Queued by transaction_created_notification once the save has gone through
+                instance._status_notification = template_type
                 
         except Transaction.DoesNotExist:
             pass
@@ -164,7 +169,7 @@ def transaction_status_changed_notification(sender, instance, **kwargs):
 
 
 def _send_status_change_notification(instance, template_type):
-    """Helper function to send transaction status change notification outside of atomic transaction"""
+    """Helper function to queue the transaction status change notification"""
     try:
         # Get the account for notification (from_account for transfers, to_account for deposits)
         account = instance.from_account or instance.to_account
@@ -371,4 +376,18 @@ def security_event_notification(sender, instance, created, **kwargs):
             
         except Exception as e:
             logger.error(f"Failed to send security event notification: {str(e)}") 
- 
\ No newline at end of file
+ 
+
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def notification_template_changed(sender, instance, **kwargs):
+    """Have every process recompile its notification templates"""
+    invalidate_templates()
+
+
+@receiver(post_save, sender=NotificationPreference)
+@receiver(post_delete, sender=NotificationPreference)
+def notification_preference_changed(sender, instance, **kwargs):
+    """Drop the user's compiled notification preferences"""
+    forget_preferences([instance.user_id])
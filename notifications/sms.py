@@ -0,0 +1,195 @@
+"""
+SMS transports and the rate-limited sender
+
+Text messages go out through a transport named by SMS_TRANSPORT. Two are
+provided:
+
+- TwilioTransport holds one Twilio client for the life of the process,
+  instead of building one per message.
+- FakeSMSTransport records messages in memory after an optional delay
+  (SMS_FAKE_LATENCY), for development and load testing.
+
+SMSSender runs two lanes of sender threads over the transport. 'urgent'
+carries 2FA codes and 'bulk' carries everything else. All threads share one
+token bucket sized to the provider's rate limit (SMS_RATE_LIMIT messages per
+second, bursts of SMS_RATE_BURST). While an urgent message is waiting for a
+token, bulk messages don't take one. A low-balance sweep therefore fills the
+bulk lane without delaying anyone's login code.
+"""
+import collections
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+URGENT = 'urgent'
+BULK = 'bulk'
+
+# Notification types sent on the urgent lane
+URGENT_NOTIFICATION_TYPES = ('two_factor',)
+
+
+class TwilioTransport:
+    """Send through Twilio with one long-lived client"""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from twilio.rest import Client
+                self._client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+            return self._client
+
+    def send(self, phone_number, message):
+        message_instance = self.client.messages.create(
+            body=message,
+            from_=settings.TWILIO_PHONE_NUMBER,
+            to=phone_number
+        )
+        return {
+            'success': True,
+            'message_id': message_instance.sid,
+            'status': message_instance.status
+        }
+
+
+class FakeSMSTransport:
+    """Keep messages in memory instead of sending them, after an optional provider-like delay"""
+
+    def __init__(self, latency=None):
+        self.latency = getattr(settings, 'SMS_FAKE_LATENCY', 0.0) if latency is None else latency
+        self.sent = collections.deque(maxlen=10000)
+        self._ids = itertools.count(1)
+
+    def send(self, phone_number, message):
+        if self.latency:
+            time.sleep(self.latency)
+        message_id = f'fake_{next(self._ids)}'
+        self.sent.append((phone_number, message))
+        return {'success': True, 'message_id': message_id, 'status': 'sent'}
+
+
+class TokenBucket:
+    """Blocking token bucket; urgent takers are served before bulk ones"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._urgent_waiting = 0
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, urgent=False):
+        with self._condition:
+            if urgent:
+                self._urgent_waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1 and (urgent or not self._urgent_waiting):
+                        self._tokens -= 1
+                        return
+                    # Short of a token: wait for the next one; otherwise until the urgent taker is served
+                    self._condition.wait((1 - self._tokens) / self.rate if self._tokens < 1 else None)
+            finally:
+                if urgent:
+                    self._urgent_waiting -= 1
+                    self._condition.notify_all()
+
+
+class SMSSender:
+    """Sender threads per lane over one transport and one rate limit"""
+
+    def __init__(self, transport=None, rate=None, burst=None, urgent_threads=None, bulk_threads=None):
+        self.transport = transport or import_string(
+            getattr(settings, 'SMS_TRANSPORT', 'notifications.sms.TwilioTransport')
+        )()
+        rate = rate or getattr(settings, 'SMS_RATE_LIMIT', 1.0)
+        self.bucket = TokenBucket(rate, burst or getattr(settings, 'SMS_RATE_BURST', 1))
+        self.threads = {
+            URGENT: urgent_threads or getattr(settings, 'SMS_URGENT_THREADS', 1),
+            BULK: bulk_threads or getattr(settings, 'SMS_BULK_THREADS', 4),
+        }
+        self._queues = {URGENT: queue.Queue(), BULK: queue.Queue()}
+        self._senders = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._senders:
+                return
+            for lane, count in self.threads.items():
+                for index in range(count):
+                    sender = threading.Thread(
+                        target=self._run, args=(lane,), name=f'sms-{lane}-{index}', daemon=True
+                    )
+                    sender.start()
+                    self._senders.append(sender)
+
+    def submit(self, phone_number, message, lane=BULK):
+        """Queue a message on a lane; the returned Future resolves to the transport's response"""
+        self._start()
+        future = Future()
+        self._queues[lane].put((phone_number, message, future))
+        return future
+
+    def close(self):
+        """Stop the senders once their lanes are drained"""
+        with self._lock:
+            senders, self._senders = self._senders, []
+        if not senders:
+            return
+        for lane, count in self.threads.items():
+            for _ in range(count):
+                self._queues[lane].put(None)
+        for sender in senders:
+            sender.join()
+
+    def _run(self, lane):
+        lane_queue = self._queues[lane]
+        while True:
+            item = lane_queue.get()
+            if item is None:
+                return
+            phone_number, message, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.bucket.acquire(urgent=lane == URGENT)
+                future.set_result(self.transport.send(phone_number, message))
+            except Exception as e:
+                future.set_exception(e)
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sms_sender():
+    """The process-wide SMSSender, built from settings on first use"""
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = SMSSender()
+        return _sender
+
+
+def lane_for(notification_type):
+    return URGENT if notification_type in URGENT_NOTIFICATION_TYPES else BULK
@@ -0,0 +1,94 @@
+"""
+Compiled notification templates
+
+Every active NotificationTemplate is read in one query and compiled into
+django.template.Template objects, kept per process and keyed by
+(template_type, channel). Rendering a notification then needs neither a query
+nor template parsing.
+
+Changes are picked up through a version number kept in the default cache.
+Saving or deleting a NotificationTemplate (and the admin's bulk actions)
+bumps it once the change commits. Each process compares it with the version
+it compiled and reloads everything when they differ. When the version has been
+evicted a new one is started from the clock, as in accounts.dashboard_cache.
+"""
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.template import Context, Template, TemplateSyntaxError
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'notification_templates:version'
+
+_lock = threading.Lock()
+_compiled = {}
+_compiled_version = None
+
+
+class CompiledTemplate:
+    """A NotificationTemplate with its subject, body and HTML parsed once"""
+    __slots__ = ('template', 'title', 'body', 'html')
+
+    def __init__(self, template):
+        self.template = template
+        self.title = Template(template.subject or template.title)
+        self.body = Template(template.body_template)
+        self.html = Template(template.html_template) if template.html_template else None
+
+    def render(self, context_data):
+        """(title, message, html_message) for context_data"""
+        context = Context(context_data)
+        return (
+            self.title.render(context),
+            self.body.render(context),
+            self.html.render(context) if self.html else '',
+        )
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # No version yet: the next read starts a fresh one
+        pass
+
+
+def invalidate_templates():
+    """Make every process recompile its templates once the current transaction commits"""
+    transaction.on_commit(bump_version)
+
+
+def load_templates():
+    """Compile all active templates for this process; called lazily and at worker start"""
+    from .models import NotificationTemplate
+    global _compiled, _compiled_version
+    with _lock:
+        # Read the version first: a change committing during the load bumps it past ours
+        version = get_version()
+        compiled = {}
+        for template in NotificationTemplate.objects.filter(is_active=True):
+            try:
+                compiled[(template.template_type, template.channel)] = CompiledTemplate(template)
+            except TemplateSyntaxError as e:
+                logger.error(f'Notification template {template} does not compile: {str(e)}')
+        _compiled, _compiled_version = compiled, version
+    return len(compiled)
+
+
+def get_compiled_template(template_type, channel):
+    """The compiled active template for (template_type, channel), or None"""
+    if _compiled_version is None or _compiled_version != get_version():
+        load_templates()
+    return _compiled.get((template_type, channel))
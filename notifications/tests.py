@@ -0,0 +1,360 @@
+import re
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from datetime import time as dt_time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction as db_transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.identifiers import allocate_account_numbers
+from accounts.models import BankAccount
+from banking.models import Transaction
+from .dispatcher import run_dispatcher
+from .email_delivery import EmailDeliveryEngine
+from .models import Notification, NotificationOutbox, NotificationPreference, NotificationTemplate
+from .preference_cache import ResolvedPreferences, resolve_preferences
+from .services import EmailNotificationService, NotificationService
+from .sms import BULK, URGENT, FakeSMSTransport, SMSSender, TwilioTransport, lane_for
+from .template_cache import get_compiled_template, load_templates
+
+
+class NotificationOutboxTests(TestCase):
+    """Notifications are queued in the business transaction and delivered by the dispatcher"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('outbox', 'outbox@example.com', 'x')
+        self.account = BankAccount.objects.create(
+            user=self.user, account_number=allocate_account_numbers()[0], account_name='Outbox'
+        )
+        NotificationOutbox.objects.all().delete()
+
+    def deposit(self):
+        return Transaction.objects.create(
+            transaction_type='deposit', amount=Decimal('3.00'), total_amount=Decimal('3.00'),
+            description='Outbox deposit', to_account=self.account,
+        )
+
+    def test_queued_with_the_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.deposit()
+        inserts = [query['sql'] for query in queries if 'notifications_notificationoutbox' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertTrue(inserts[0].startswith('INSERT'))
+
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual((entry.template_type, entry.status), ('deposit_received', 'pending'))
+        self.assertEqual(entry.context_data['amount'], '3.00')
+
+    def test_rolled_back_transaction_queues_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with db_transaction.atomic():
+                self.deposit()
+                raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_status_change_is_queued_after_save(self):
+        txn = self.deposit()
+        txn.status = 'completed'
+        txn.save()
+        self.assertEqual(
+            list(NotificationOutbox.objects.values_list('template_type', flat=True)),
+            ['deposit_received', 'transaction_completed']
+        )
+
+    def test_dispatcher_drains_the_outbox(self):
+        NotificationService().send_notification(self.user, 'account', 'welcome_message', channels=['in_app'])
+        NotificationService().send_notification(self.user, 'account', 'welcome_message', channels=['in_app'])
+
+        stats = run_dispatcher(concurrency=1, batch_size=1, once=True)
+        self.assertEqual((stats['sent'], stats['failed'], stats['batches']), (2, 0, 2))
+        self.assertFalse(NotificationOutbox.objects.exclude(status='sent').exists())
+        self.assertEqual(Notification.objects.filter(user=self.user, channel='in_app').count(), 2)
+
+    @override_settings(NOTIFICATION_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_delivery_is_retried_then_given_up(self):
+        NotificationService().send_notification(self.user, 'account', 'welcome_message', channels=['in_app'])
+        entry = NotificationOutbox.objects.get()
+
+        with mock.patch.object(NotificationService, 'deliver_notification', side_effect=RuntimeError('down')):
+            self.assertEqual(run_dispatcher(concurrency=1, once=True)['failed'], 1)
+            entry.refresh_from_db()
+            self.assertEqual((entry.status, entry.attempts, entry.last_error), ('pending', 1, 'down'))
+            self.assertGreater(entry.available_at, timezone.now())
+
+            # Backed off rows are not due yet
+            self.assertEqual(run_dispatcher(concurrency=1, once=True)['batches'], 0)
+
+            NotificationOutbox.objects.filter(pk=entry.pk).update(available_at=timezone.now())
+            run_dispatcher(concurrency=1, once=True)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), ('failed', 2))
+
+    def test_failed_channel_is_rescheduled_alone(self):
+        NotificationService().send_notification(self.user, 'account', 'welcome_message', channels=['in_app', 'email'])
+        entry = NotificationOutbox.objects.get()
+
+        def email_down(service, channel, notification, context_data):
+            return channel != 'email'
+
+        with mock.patch.object(NotificationService, '_send_to_channel', autospec=True, side_effect=email_down):
+            self.assertEqual(run_dispatcher(concurrency=1, once=True)['failed'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, entry.channels), ('pending', 1, ['email']))
+        self.assertIn('email', entry.last_error)
+        self.assertGreater(entry.available_at, timezone.now())
+
+        NotificationOutbox.objects.filter(pk=entry.pk).update(available_at=timezone.now())
+        with mock.patch.object(NotificationService, '_send_to_channel', autospec=True, return_value=True):
+            self.assertEqual(run_dispatcher(concurrency=1, once=True)['sent'], 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), ('sent', 2))
+        sent = Notification.objects.filter(user=self.user, status='sent').values_list('channel', flat=True)
+        self.assertEqual(sorted(sent), ['email', 'in_app'])
+
+
+class NotificationTemplateCacheTests(TestCase):
+    """Notification templates are compiled once and recompiled when one changes"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template = NotificationTemplate.objects.create(
+                template_type='deposit_received', channel='in_app',
+                title='Deposit of {{ amount }}', body_template='{{ user_name }} received {{ amount }}',
+            )
+
+    def test_rendering_skips_the_database(self):
+        load_templates()
+        with self.assertNumQueries(0):
+            compiled = get_compiled_template('deposit_received', 'in_app')
+            rendered = compiled.render({'user_name': 'Ada', 'amount': '3.00'})
+            missing = get_compiled_template('deposit_received', 'push')
+        self.assertEqual(rendered, ('Deposit of 3.00', 'Ada received 3.00', ''))
+        self.assertIsNone(missing)
+
+    def test_saving_a_template_recompiles_it(self):
+        load_templates()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.body_template = 'Received {{ amount }}'
+            self.template.save()
+        self.assertEqual(get_compiled_template('deposit_received', 'in_app').render({'amount': '1'})[1], 'Received 1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.delete()
+        self.assertIsNone(get_compiled_template('deposit_received', 'in_app'))
+
+
+class NotificationPreferenceCacheTests(TestCase):
+    """Notification preferences are compiled, cached and resolved in bulk"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [User.objects.create_user(f'prefs{index}', f'prefs{index}@example.com', 'x') for index in range(3)]
+        self.ids = [user.pk for user in self.users]
+
+    def test_bulk_resolution_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            resolved = resolve_preferences(self.ids)
+        self.assertEqual(set(resolved), set(self.ids))
+        with self.assertNumQueries(0):
+            resolve_preferences(self.ids)
+
+    def test_bits_match_the_preference_fields(self):
+        row = NotificationPreference.objects.get(user=self.users[0])
+        row.sms_enabled = row.email_security = False
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        preferences = resolve_preferences([self.ids[0]])[self.ids[0]]
+
+        self.assertFalse(preferences.allows('email', 'security'))
+        self.assertTrue(preferences.allows('email', 'transaction'))
+        self.assertFalse(preferences.allows('sms', 'transaction'))
+        self.assertEqual(preferences.default_channels('transaction'), ['email', 'in_app'])
+        self.assertEqual(preferences.default_channels('card'), [])
+
+    def test_saving_drops_the_cached_form(self):
+        self.assertTrue(resolve_preferences([self.ids[1]])[self.ids[1]].allows('push', 'security'))
+        row = NotificationPreference.objects.get(user=self.users[1])
+        row.push_enabled = False
+        row.quiet_hours_enabled = True
+        row.quiet_hours_start, row.quiet_hours_end = dt_time(22, 0), dt_time(8, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+
+        preferences = resolve_preferences([self.ids[1]])[self.ids[1]]
+        self.assertFalse(preferences.allows('push', 'security'))
+        self.assertTrue(preferences.in_quiet_hours(dt_time(23, 30)))
+        self.assertTrue(preferences.in_quiet_hours(dt_time(7, 0)))
+        self.assertFalse(preferences.in_quiet_hours(dt_time(12, 0)))
+
+    def test_save_committing_during_a_read_is_not_masked(self):
+        compile_row = ResolvedPreferences.compile
+
+        def save_commits_after_the_read(row):
+            # The reader holds the old row while the user turns SMS off
+            with self.captureOnCommitCallbacks(execute=True):
+                saved = NotificationPreference.objects.get(pk=row.pk)
+                saved.sms_enabled = False
+                saved.save()
+            return compile_row(row)
+
+        with mock.patch.object(ResolvedPreferences, 'compile', side_effect=save_commits_after_the_read):
+            stale = resolve_preferences([self.ids[0]])[self.ids[0]]
+        self.assertTrue(stale.channel_enabled('sms'))
+        self.assertFalse(resolve_preferences([self.ids[0]])[self.ids[0]].channel_enabled('sms'))
+
+    def test_missing_rows_get_defaults(self):
+        NotificationPreference.objects.filter(user=self.users[2]).delete()
+        self.assertTrue(resolve_preferences([self.ids[2]])[self.ids[2]].allows('email', 'transaction'))
+        self.assertTrue(NotificationPreference.objects.filter(user=self.users[2]).exists())
+
+
+class _StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages; closes the session after server.drop_after messages"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        received = 0
+        self.reply('220 stand-in ready')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (data_line := self.rfile.readline().decode()).strip() != '.':
+                    data.append(data_line)
+                self.server.messages.append(''.join(data))
+                self.reply('250 queued')
+                received += 1
+                if self.server.drop_after and received >= self.server.drop_after:
+                    return
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class PooledEmailDeliveryTests(TestCase):
+    """Emails share persistent SMTP connections and survive dropped ones"""
+
+    def start_server(self, drop_after=0):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _StandInSMTPHandler)
+        server.daemon_threads = True
+        server.connections, server.messages, server.drop_after = 0, [], drop_after
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def engine(self, server, **options):
+        host, port = server.server_address
+        engine = EmailDeliveryEngine(connection_factory=lambda: get_connection(
+            'django.core.mail.backends.smtp.EmailBackend', host=host, port=port,
+            username='', password='', use_tls=False, use_ssl=False, timeout=5, fail_silently=False,
+        ), **options)
+        self.addCleanup(engine.close)
+        return engine
+
+    def messages(self, count):
+        return [
+            EmailMessage(f'Statement {index}', 'Your statement is ready', 'bank@example.com', ['customer@example.com'])
+            for index in range(count)
+        ]
+
+    def test_connections_are_reused_up_to_the_cap(self):
+        server = self.start_server()
+        engine = self.engine(server, pool_size=2, max_messages_per_connection=10)
+
+        self.assertEqual(engine.send_messages(self.messages(30), timeout=10), 30)
+        self.assertEqual(len(server.messages), 30)
+        self.assertLessEqual(server.connections, 4)
+
+    def send_with_timeout(self, future):
+        user = User.objects.create_user('timeout', 'timeout@example.com', 'x')
+        notification = Notification(user=user, title='Statement ready', message='Your statement is ready')
+        engine = mock.Mock(submit=mock.Mock(return_value=future))
+        with override_settings(EMAIL_DELIVERY_TIMEOUT=0), \
+                mock.patch('notifications.services.get_email_engine', return_value=engine):
+            return EmailNotificationService()._send_real_email(user, notification, '<p>Ready</p>', 'Ready')
+
+    def test_timed_out_email_still_queued_is_withdrawn_and_failed(self):
+        future = Future()
+
+        self.assertFalse(self.send_with_timeout(future))
+        self.assertTrue(future.cancelled())
+
+    def test_timed_out_email_already_sending_is_not_failed(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        # A failure would have the dispatcher send it again once this one lands
+        self.assertTrue(self.send_with_timeout(future))
+        self.assertFalse(future.cancelled())
+
+    def test_dropped_connection_is_replaced(self):
+        server = self.start_server(drop_after=4)
+        engine = self.engine(server, pool_size=1)
+
+        self.assertEqual(engine.send_messages(self.messages(10), timeout=10), 10)
+        subjects = sorted(re.search(r'Subject: ([^\r\n]*)', message).group(1) for message in server.messages)
+        self.assertEqual(subjects, sorted(f'Statement {index}' for index in range(10)))
+        self.assertEqual(server.connections, 3)
+
+
+class SMSSenderTests(TestCase):
+    """SMS go out under the provider's rate limit, with 2FA codes ahead of bulk alerts"""
+
+    def sender(self, **options):
+        sender = SMSSender(transport=FakeSMSTransport(latency=0), **options)
+        self.addCleanup(sender.close)
+        return sender
+
+    def test_rate_limit_is_respected(self):
+        sender = self.sender(rate=20, burst=1, bulk_threads=4)
+        started = time.monotonic()
+        futures = [sender.submit('+15550000000', f'Alert {index}') for index in range(11)]
+        for future in futures:
+            self.assertTrue(future.result(5)['success'])
+        # One token up front, then ten more at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+        self.assertEqual(len(sender.transport.sent), 11)
+
+    def test_urgent_lane_overtakes_a_bulk_sweep(self):
+        sender = self.sender(rate=10, burst=1, bulk_threads=4)
+        sweep = [sender.submit('+15550000000', f'Low balance {index}') for index in range(20)]
+        code = sender.submit('+15550000001', 'Your code is 123456', lane=URGENT)
+
+        self.assertTrue(code.result(1)['success'])
+        self.assertFalse(sweep[-1].done())
+        for future in sweep:
+            future.result(5)
+
+    def test_notifications_pick_their_lane(self):
+        self.assertEqual(lane_for('two_factor'), URGENT)
+        self.assertEqual(lane_for('transaction'), BULK)
+
+    def test_twilio_client_is_built_once(self):
+        transport = TwilioTransport()
+        with mock.patch('twilio.rest.Client') as client:
+            client.return_value.messages.create.return_value = mock.Mock(sid='SM1', status='queued')
+            transport.send('+15550000000', 'One')
+            response = transport.send('+15550000000', 'Two')
+        self.assertEqual(client.call_count, 1)
+        self.assertEqual(response, {'success': True, 'message_id': 'SM1', 'status': 'queued'})
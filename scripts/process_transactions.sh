@@ -9,6 +9,10 @@ PYTHON_PATH="/Users/chiagoziestanley/Dev-space/DominionTrust_Bank/backend/venv/b
 LOG_DIR="/Users/chiagoziestanley/Dev-space/DominionTrust_Bank/backend/logs"
 LOG_FILE="$LOG_DIR/transaction_processing.log"
 
+# Parallel workers for posting due transactions. Overlapping runs are safe:
+# each worker claims its own chunk of transactions.
+WORKERS="${TRANSACTION_WORKERS:-4}"
+
 # Create log directory if it doesn't exist
 mkdir -p "$LOG_DIR"
 
@@ -19,7 +23,7 @@ echo "=== Transaction Processing Started: $(date) ===" >> "$LOG_FILE"
 cd "$PROJECT_DIR"
 
 # Run the management command
-"$PYTHON_PATH" manage.py process_pending_transactions >> "$LOG_FILE" 2>&1
+"$PYTHON_PATH" manage.py process_pending_transactions --workers "$WORKERS" >> "$LOG_FILE" 2>&1
 
 # Check exit status
 if [ $? -eq 0 ]; then
@@ -298,7 +298,7 @@ def display_all_email_notifications():
         print("=" * 80)
         
         try:
-            notifications = notification_service.send_notification(
+            notifications = notification_service.deliver_notification(
                 user=user,
                 notification_type=scenario['type'],
                 template_type=scenario['template'],
@@ -139,7 +139,7 @@ def test_notification_service():
             print(f"\n{i}. Testing {scenario['name']}...")
             
             try:
-                notifications = notification_service.send_notification(
+                notifications = notification_service.deliver_notification(
                     user=user,
                     notification_type=scenario['type'],
                     template_type=scenario['template'],
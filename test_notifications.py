@@ -31,7 +31,7 @@ def test_transfer_notification():
     # Test notification service directly
     ns = NotificationService()
     try:
-        result = ns.send_notification(
+        result = ns.deliver_notification(
             user=user,
             notification_type='transaction',
             template_type='transfer_sent',